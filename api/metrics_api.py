@@ -0,0 +1,27 @@
+"""
+    Prometheus metrics endpoint
+"""
+
+from __future__ import annotations
+
+from flask import Blueprint, Response
+
+from commons import metrics
+from helpers import http_client
+
+
+metrics_blueprint = Blueprint("metrics_blueprint", __name__)
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def metrics_handler():
+    """
+        API(GET) exposing teardown latency, per-step breakdown, retries, failures and in-flight
+        teardowns in the Prometheus text format.
+
+        :return: metrics text, status_code: {...}
+        :rtype: Response
+    """
+    # Pool utilisation is sampled on scrape rather than on every request.
+    http_client.pool_stats()
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,63 @@
+"""
+    Session details cache API Endpoints
+"""
+
+from __future__ import annotations
+
+from http import HTTPStatus
+
+from flask import Blueprint, current_app, request
+
+from commons import env_info
+from commons.base_response import BaseResponse
+from helpers.session_cache import get_session_cache, validate_session_details
+
+
+session_cache_blueprint = Blueprint("session_cache_blueprint", __name__)
+
+
+@session_cache_blueprint.route('/api/v1/session-cache', methods=['POST'])
+def session_cache_handler():
+    """
+        API(POST) to pre-populate the session details teardowns read, sent when sessions are created so
+        the teardown doesn't have to call get-session-details.
+
+        Body: one entry, a list of entries or {"sessions": [...]}, each entry
+              {"session_id" | "request_id": "...", "enable_video": bool, "enable_logs": bool, "log_name": "..."}
+
+        :return: data:{"cached": n, "invalid": [...]}, status_code: {...}
+        :rtype: response dict , status code
+    """
+    session_cache = get_session_cache()
+    if session_cache is None:
+        base_response = BaseResponse(status_code=HTTPStatus.NOT_FOUND, msg="Session cache is disabled.")
+        return base_response.send_response(), base_response.status_code
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        items = payload.get("sessions") if "sessions" in payload else [payload]
+    else:
+        items = payload
+
+    if not isinstance(items, list) or not items:
+        base_response = BaseResponse(status_code=HTTPStatus.BAD_REQUEST, msg="Expected session entries.")
+        return base_response.send_response(), base_response.status_code
+    if len(items) > env_info.SESSION_CACHE_MAX_ITEMS:
+        base_response = BaseResponse(status_code=HTTPStatus.BAD_REQUEST,
+                                     msg=f"At most {env_info.SESSION_CACHE_MAX_ITEMS} sessions per request.")
+        return base_response.send_response(), base_response.status_code
+
+    cached = 0
+    invalid = []
+    for index, item in enumerate(items):
+        error = validate_session_details(item)
+        if error is not None:
+            invalid.append({"index": index, "error": error})
+            continue
+
+        session_cache.put(item, session_id=item.get("session_id"), request_id=item.get("request_id"))
+        cached += 1
+
+    current_app.logger.info(f"session_cache_handler cached {cached} of {len(items)} entries")
+    base_response = BaseResponse(data={"cached": cached, "invalid": invalid})
+    return base_response.data, base_response.status_code
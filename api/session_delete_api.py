@@ -4,17 +4,29 @@
 
 from __future__ import annotations
 
-from flask import Blueprint, current_app
+from http import HTTPStatus
 
+from flask import Blueprint, current_app, request
+
+from commons import env_info
 from commons.base_response import BaseResponse
+from helpers import circuit_breaker, http_client
+from helpers.artifact_spool import get_artifact_spool
+from helpers.session_cache import get_session_cache
+from helpers.utils import get_session_deleted_response
+from k8s import k8s_client
+from methods.batch_delete import batch_delete_sessions
 from methods.delete_session import delete_session
+from methods.teardown_queue import get_teardown_queue
 
 
 session_blueprint = Blueprint("session_blueprint", __name__)
 
 
 @session_blueprint.route('/api/v1/session/<string:pod_name>/<string:session_id>/<string:delete_type>', methods=['DELETE'])
-def delete_session_handler(pod_name=None, session_id=None, delete_type=None):
+@session_blueprint.route('/api/v1/namespaces/<string:namespace>/session/<string:pod_name>/<string:session_id>/'
+                         '<string:delete_type>', methods=['DELETE'])
+def delete_session_handler(pod_name=None, session_id=None, delete_type=None, namespace=None):
     """
         API(DELETE) to delete sessions and delete k8s pod.
 
@@ -24,10 +36,16 @@ def delete_session_handler(pod_name=None, session_id=None, delete_type=None):
         :type: session_id: str
         :param: delete_type: It contains unique org id.
         :type: delete_type: str
+        :param: namespace: namespace of the pod, derived from the pod name when not in the URI.
+        :type: namespace: str
 
         :return: data:{...}, status_code: {...}
         :rtype: response dict , status code
     """
+    forbidden = _forbidden_namespace(namespace)
+    if forbidden is not None:
+        return forbidden
+
     base_response = BaseResponse()
 
     try:
@@ -35,7 +53,13 @@ def delete_session_handler(pod_name=None, session_id=None, delete_type=None):
             session_id = "".join(session_id.split("-"))
 
         current_app.logger.info(f"delete_session_handler called with session_id: {session_id}")
-        delete_session(base_response=base_response, pod_name=pod_name, session_id=session_id, delete_type=delete_type)
+        if env_info.ASYNC_TEARDOWN:
+            accepted = _enqueue_teardown(pod_name=pod_name, session_id=session_id, delete_type=delete_type,
+                                         namespace=namespace)
+            if accepted is not None:
+                return accepted
+        delete_session(base_response=base_response, pod_name=pod_name, session_id=session_id, delete_type=delete_type,
+                       namespace=namespace)
     except Exception as err:
         current_app.logger.error(err)
 
@@ -43,7 +67,9 @@ def delete_session_handler(pod_name=None, session_id=None, delete_type=None):
 
 
 @session_blueprint.route('/api/v1/timeout/<string:pod_name>/<string:req_id>/<string:delete_type>', methods=['DELETE'])
-def timeout_session_handler(pod_name=None, req_id=None, delete_type=None):
+@session_blueprint.route('/api/v1/namespaces/<string:namespace>/timeout/<string:pod_name>/<string:req_id>/'
+                         '<string:delete_type>', methods=['DELETE'])
+def timeout_session_handler(pod_name=None, req_id=None, delete_type=None, namespace=None):
     """
         API(DELETE) to timeout sessions and delete k8s pod.
 
@@ -53,16 +79,139 @@ def timeout_session_handler(pod_name=None, req_id=None, delete_type=None):
         :type: req_id: str
         :param: delete_type: It contains unique org id.
         :type: delete_type: str
+        :param: namespace: namespace of the pod, derived from the pod name when not in the URI.
+        :type: namespace: str
 
         :return: Base Response object{data:{...}, msg:"...", status: ...}
         :rtype: response dict , status code
     """
+    forbidden = _forbidden_namespace(namespace)
+    if forbidden is not None:
+        return forbidden
+
     base_response = BaseResponse()
 
     try:
         current_app.logger.info(f"timeout_session_handler called with request_id: {req_id}")
-        delete_session(base_response=base_response, pod_name=pod_name, request_id=req_id, delete_type=delete_type)
+        if env_info.ASYNC_TEARDOWN:
+            accepted = _enqueue_teardown(pod_name=pod_name, request_id=req_id, delete_type=delete_type,
+                                         namespace=namespace)
+            if accepted is not None:
+                return accepted
+        delete_session(base_response=base_response, pod_name=pod_name, request_id=req_id, delete_type=delete_type,
+                       namespace=namespace)
     except Exception as err:
         current_app.logger.error(err)
 
     return base_response.data, base_response.status_code
+
+
+@session_blueprint.route('/api/v1/sessions:batchDelete', methods=['POST'])
+def batch_delete_handler():
+    """
+        API(POST) to delete many sessions and their k8s pods in one request.
+
+        Body: {"sessions": [{"pod_name": "...", "session_id" | "request_id": "...", "delete_type": "...",
+                             "namespace": "..." (optional)}, ...]}
+
+        :return: data:{"results": [...]}, status_code: {...}
+        :rtype: response dict , status code
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get("sessions") if isinstance(payload, dict) else payload
+
+    if not isinstance(items, list) or not items:
+        base_response = BaseResponse(status_code=HTTPStatus.BAD_REQUEST, msg="`sessions` must be a non-empty list.")
+        return base_response.send_response(), base_response.status_code
+    if len(items) > env_info.BATCH_DELETE_MAX_ITEMS:
+        base_response = BaseResponse(status_code=HTTPStatus.BAD_REQUEST,
+                                     msg=f"At most {env_info.BATCH_DELETE_MAX_ITEMS} sessions per batch.")
+        return base_response.send_response(), base_response.status_code
+
+    base_response = BaseResponse()
+    try:
+        base_response.data = {"results": batch_delete_sessions(items)}
+    except Exception as err:
+        current_app.logger.error(err)
+        base_response.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+        base_response.msg = str(err)
+        return base_response.send_response(), base_response.status_code
+
+    return base_response.data, base_response.status_code
+
+
+@session_blueprint.route('/api/v1/teardown/stats', methods=['GET'])
+def teardown_stats_handler():
+    """
+        API(GET) to fetch teardown queue depth, latency, HTTP pool, pod cache, circuit breaker, artifact
+        spool and session cache metrics.
+
+        :return: data:{...}, status_code: {...}
+        :rtype: response dict , status code
+    """
+    stats = get_teardown_queue().stats()
+    stats["http_pool"] = http_client.pool_stats()
+    stats["pod_cache"] = k8s_client.pod_informer_stats(namespace=k8s_client.default_namespace())
+    stats["pod_caches"] = {namespace: k8s_client.pod_informer_stats(namespace=namespace)
+                           for namespace in env_info.NAMESPACES}
+    stats["circuits"] = circuit_breaker.breaker_stats()
+    spool = get_artifact_spool()
+    stats["artifact_spool"] = spool.stats() if spool is not None else None
+    session_cache = get_session_cache()
+    stats["session_cache"] = session_cache.stats() if session_cache is not None else None
+    base_response = BaseResponse(data=stats)
+    return base_response.data, base_response.status_code
+
+
+@session_blueprint.route('/api/v1/teardown/<string:job_id>', methods=['GET'])
+def teardown_status_handler(job_id=None):
+    """
+        API(GET) to fetch the status of an asynchronous teardown job.
+
+        :param: job_id: id returned in the X-Teardown-Job-Id header of a DELETE call.
+        :type: job_id: str
+
+        :return: data:{...}, status_code: {...}
+        :rtype: response dict , status code
+    """
+    job = get_teardown_queue().get(job_id)
+    if job is None:
+        base_response = BaseResponse(status_code=HTTPStatus.NOT_FOUND, msg=f"Teardown job `{job_id}` not found")
+        return base_response.send_response(), base_response.status_code
+
+    base_response = BaseResponse(data=job.to_dict())
+    return base_response.data, base_response.status_code
+
+
+def _forbidden_namespace(namespace):
+    """
+        :return: (error response, 403) when the namespace from the URI isn't served by this instance, else None
+        :rtype: tuple/None
+    """
+    if namespace is None or namespace in k8s_client.served_namespaces():
+        return None
+    current_app.logger.warning(f"Refused teardown in namespace `{namespace}`, not served by this instance.")
+    base_response = BaseResponse(status_code=HTTPStatus.FORBIDDEN,
+                                 msg=f"Namespace `{namespace}` is not served by this instance.")
+    return base_response.send_response(), base_response.status_code
+
+
+def _enqueue_teardown(pod_name, session_id=None, request_id=None, delete_type=None, namespace=None):
+    """
+        Puts a teardown job on the background queue.
+
+        :return: (W3C delete response, 202, headers) or None when the queue is full
+        :rtype: tuple/None
+    """
+    job = get_teardown_queue().submit(pod_name=pod_name, session_id=session_id, request_id=request_id,
+                                      delete_type=delete_type, namespace=namespace)
+    if job is None:
+        current_app.logger.warning(f"Teardown queue full, deleting pod_name: {pod_name} synchronously.")
+        return None
+
+    current_app.logger.info(f"Teardown job {job.job_id} queued for pod_name: {pod_name}")
+    headers = {
+        "X-Teardown-Job-Id": job.job_id,
+        "Location": f"/api/v1/teardown/{job.job_id}",
+    }
+    return get_session_deleted_response(), HTTPStatus.ACCEPTED, headers
@@ -0,0 +1,29 @@
+"""
+    main:app wired to the benchmark fakes, served by gunicorn in benchmarks.load_test.
+
+    The backend and sidecar fakes run in the load test process (BASE_URL, SIDECAR_PORT), the K8s and
+    storage fakes in each worker. BENCH_K8S_FAULT / BENCH_S3_FAULT are fault specs, BENCH_LOG_KIB the
+    size of the pod logs, and every deleted pod is appended to BENCH_DELETIONS_FILE.
+"""
+
+from __future__ import annotations
+
+import os
+
+from benchmarks.fakes import Fault, FakeCoreV1Api, FakeStorage
+from helpers.storage import set_storage
+from k8s import k8s_client
+from main import app
+
+
+def _record_deletion(pod_name: str) -> None:
+    # One short O_APPEND write per line, so lines of concurrent workers don't interleave.
+    with open(os.environ["BENCH_DELETIONS_FILE"], "a") as file:
+        file.write(f"{pod_name}\n")
+
+
+k8s_client.set_core_v1_api(FakeCoreV1Api(log_bytes=int(os.environ.get("BENCH_LOG_KIB", "256")) * 1024,
+                                         fault=Fault.parse(os.environ.get("BENCH_K8S_FAULT", "")),
+                                         on_delete=_record_deletion if os.environ.get("BENCH_DELETIONS_FILE")
+                                         else None))
+set_storage(FakeStorage(fault=Fault.parse(os.environ.get("BENCH_S3_FAULT", ""))))
@@ -0,0 +1,210 @@
+"""
+    Local stand-ins for the teardown dependencies: K8s API, backend, pod sidecar and S3 storage,
+    with latency and failure injection.
+"""
+
+from __future__ import annotations
+
+import http.server
+import json
+import random
+import threading
+import time
+import types
+import typing as t
+
+from kubernetes.client.exceptions import ApiException
+
+from helpers.storage import MemoryStorage
+
+
+class Fault:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0):
+        """
+            :param : latency: seconds added to every call
+            :type: latency: float
+            :param : jitter: extra random seconds, uniform in [0, jitter]
+            :type: jitter: float
+            :param : failure_rate: share of calls failing, 0..1
+            :type: failure_rate: float
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    @classmethod
+    def parse(cls, spec: str) -> "Fault":
+        """
+            :param : spec: "latency[,jitter[,failure_rate]]" in seconds, e.g. "0.05,0.02,0.01"
+            :type: spec: str
+        """
+        values = [float(value) for value in spec.split(",") if value.strip()] if spec else []
+        return cls(*values)
+
+    def apply(self) -> bool:
+        """
+            Sleeps for the injected latency.
+
+            :return whether this call should fail
+            :rtype: bool
+        """
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        return self.failure_rate > 0 and random.random() < self.failure_rate
+
+
+class _FakeLogResponse:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def stream(self, amt: int = 65536, decode_content: bool = True) -> t.Iterator[bytes]:
+        for offset in range(0, len(self.data), amt):
+            yield self.data[offset:offset + amt]
+
+    def release_conn(self) -> None:
+        pass
+
+
+class FakeCoreV1Api:
+    """
+        In-memory CoreV1Api covering the calls made during a teardown. Every pod name exists until it
+        is deleted, so any pod name can be torn down once.
+    """
+
+    def __init__(self, pod_ip: str = "127.0.0.1", log_bytes: int = 256 * 1024, fault: Fault = None,
+                 on_delete: t.Callable[[str], None] = None):
+        self.pod_ip = pod_ip
+        self.on_delete = on_delete
+        self.log_data = (b"browser log line\n" * (log_bytes // 17 + 1))[:log_bytes]
+        self.fault = fault or Fault()
+        self.deleted: t.Set[str] = set()
+        self.calls: t.Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _call(self, name: str, pod_name: str) -> None:
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            gone = pod_name in self.deleted
+        if self.fault.apply():
+            raise ApiException(status=500, reason="Injected failure")
+        if gone:
+            raise ApiException(status=404, reason="Not Found")
+
+    def read_namespaced_pod(self, name: str, namespace: str, **kwargs: t.Any):
+        self._call("read_namespaced_pod", name)
+        return types.SimpleNamespace(metadata=types.SimpleNamespace(name=name, namespace=namespace, labels={}),
+                                     status=types.SimpleNamespace(pod_ip=self.pod_ip, phase="Running"))
+
+    def read_namespaced_pod_log(self, name: str, namespace: str, container: str = None,
+                                _preload_content: bool = True, **kwargs: t.Any):
+        self._call("read_namespaced_pod_log", name)
+        if _preload_content:
+            return self.log_data.decode()
+        return _FakeLogResponse(self.log_data)
+
+    def delete_namespaced_pod(self, name: str, namespace: str, body: t.Any = None, **kwargs: t.Any):
+        self._call("delete_namespaced_pod", name)
+        with self._lock:
+            self.deleted.add(name)
+        if self.on_delete is not None:
+            self.on_delete(name)
+        return types.SimpleNamespace(status="Success")
+
+
+class FakeStorage(MemoryStorage):
+    """
+        MemoryStorage standing in for S3, objects are counted but not kept so long runs stay small.
+    """
+
+    def __init__(self, fault: Fault = None):
+        super().__init__()
+        self.fault = fault or Fault()
+        self.bytes_stored = 0
+
+    def put_object(self, key: str, data: t.Any, content_type: str = "text/plain",
+                   content_encoding: str = None) -> None:
+        if self.fault.apply():
+            raise IOError("Injected S3 failure")
+        with self._lock:
+            self.bytes_stored += len(data)
+            self.objects[key] = b""
+
+
+_ENDPOINTS = ("get-session-details", "update-session-status", "stop-recording")
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeHttpServer"
+
+    def _respond(self, status: int, body: t.Dict[str, t.Any]) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.count(self.command, self.path)
+        if self.server.fault.apply():
+            self._respond(503, {"msg": "Injected failure"})
+            return
+        if "/get-session-details/" in self.path:
+            session_key = self.path.rstrip("/").rsplit("/", 1)[-1]
+            self._respond(200, {"data": {"enable_video": self.server.enable_video,
+                                         "enable_logs": self.server.enable_logs,
+                                         "log_name": f"bench/{session_key}.log",
+                                         "status": "running"},
+                                "msg": "Session details fetched."})
+        else:
+            self._respond(200, {"msg": "ok"})
+
+    do_GET = _handle
+    do_PUT = _handle
+    do_POST = _handle
+
+    def log_message(self, format: str, *args: t.Any) -> None:
+        pass
+
+
+class FakeHttpServer(http.server.ThreadingHTTPServer):
+    """
+        Serves the backend (get-session-details, update-session-status) or the pod sidecar
+        (stop-recording) API on a local port.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, fault: Fault = None, enable_video: bool = True, enable_logs: bool = True):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.fault = fault or Fault()
+        self.enable_video = enable_video
+        self.enable_logs = enable_logs
+        self.requests: t.Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def count(self, method: str, path: str) -> None:
+        name = next((name for name in _ENDPOINTS if name in path), path)
+        endpoint = f"{method} {name}"
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def start(self) -> "FakeHttpServer":
+        self._thread = threading.Thread(target=self.serve_forever, name=f"fake-http-{self.port}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
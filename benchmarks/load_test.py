@@ -0,0 +1,203 @@
+"""
+    Load-test harness: throughput and latency of the DELETE endpoints versus gunicorn worker count.
+
+    By default gunicorn serves benchmarks.fake_app, the app wired to the local fakes of the K8s API,
+    backend, pod sidecar and S3. The DELETE routes answer 200 whether or not the teardown worked, so
+    the pods the fake K8s API deleted are reported next to the HTTP statuses.
+
+    python -m benchmarks.load_test --workers 1,2,4 --threads 16 --requests 500 --concurrency 50
+    python -m benchmarks.load_test --backend-fault 0.02,0.01 --sidecar-fault 0.5
+    python -m benchmarks.load_test --url http://127.0.0.1:5002 --requests 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_PATH = "/api/v1/session/chrome-load-{i}/session-{i}/completed"
+
+# Service settings of benchmark runs against the fakes, the fakes' addresses are added per run.
+BENCH_ENV = {
+    "ORG_NAME": "bench",
+    "STORAGE_BACKEND": "memory",
+    "RETRY_LIMIT": "3",
+    "RETRY_PAUSE_TIME": "1",
+    "POD_WAIT_TIME": "5",
+    "LOG_LEVEL": "WARNING",
+    "LOG_GROUP_NAME": "",
+    "ASYNC_TEARDOWN": "false",
+    "POD_INFORMER": "false",
+    "TEARDOWN_DEDUP_TTL": "0",
+}
+
+
+def percentile(values: t.List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def wait_for_port(host: str, port: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex((host, port)) == 0:
+                return True
+        time.sleep(0.2)
+    return False
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_load(base_url: str, method: str, path_template: str, requests: int, concurrency: int) -> t.Dict[str, t.Any]:
+    """
+        :return throughput, latency percentiles and status code counts
+        :rtype: dict
+    """
+    parsed = urllib.parse.urlsplit(base_url)
+
+    def one(index: int) -> t.Tuple[float, int]:
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=300)
+        start = time.monotonic()
+        try:
+            connection.request(method, path_template.format(i=index))
+            status = connection.getresponse().status
+        except Exception:
+            status = 0
+        finally:
+            connection.close()
+        return time.monotonic() - start, status
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.monotonic() - start
+
+    latencies = [latency for latency, _ in results]
+    statuses: t.Dict[str, int] = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "statuses": statuses,
+    }
+
+
+def run_with_gunicorn(app: str, workers: int, threads: int, args: argparse.Namespace,
+                      fakes: t.Dict[str, t.Any] = None) -> t.Dict[str, t.Any]:
+    """
+        :param : fakes: backend and sidecar fake servers the app is pointed at, None to use the environment
+        :type: fakes: dict
+    """
+    port = free_port()
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(port),
+               GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads))
+    deletions_file = None
+    if fakes is not None:
+        deletions_file = tempfile.NamedTemporaryFile(prefix="load-test-deletions-", delete=False).name
+        env = {**BENCH_ENV, **env,
+               "BASE_URL": f"http://127.0.0.1:{fakes['backend'].port}", "BACKEND_URL": "api",
+               "SIDECAR_PORT": str(fakes["sidecar"].port), "BENCH_DELETIONS_FILE": deletions_file,
+               "BENCH_LOG_KIB": str(args.log_kib), "BENCH_K8S_FAULT": args.k8s_fault,
+               "BENCH_S3_FAULT": args.s3_fault}
+        backend_before = dict(fakes["backend"].requests)
+
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null", app]
+    server = subprocess.Popen(command, env=env)
+    try:
+        if not wait_for_port("127.0.0.1", port, timeout=args.startup_timeout):
+            raise RuntimeError(f"gunicorn did not start listening on port {port}")
+        result = run_load(f"http://127.0.0.1:{port}", args.method, args.path, args.requests, args.concurrency)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=args.startup_timeout + 60)
+    result.update({"workers": workers, "threads": threads})
+
+    if deletions_file is not None:
+        with open(deletions_file) as file:
+            result["pods_deleted"] = len(set(file.read().split()))
+        os.unlink(deletions_file)
+        result["backend_requests"] = {endpoint: count - backend_before.get(endpoint, 0)
+                                      for endpoint, count in fakes["backend"].requests.items()
+                                      if count > backend_before.get(endpoint, 0)}
+    return result
+
+
+def main(argv: t.Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="benchmarks.fake_app:app",
+                        help="WSGI app to serve with gunicorn, anything but the default uses the real dependencies "
+                             "the environment points to")
+    parser.add_argument("--url", help="load an already running server instead of starting gunicorn")
+    parser.add_argument("--k8s-fault", default="", help="fault spec of every K8s API call")
+    parser.add_argument("--backend-fault", default="", help="fault spec of the backend endpoints")
+    parser.add_argument("--sidecar-fault", default="", help="fault spec of stop-recording")
+    parser.add_argument("--s3-fault", default="", help="fault spec of each storage upload")
+    parser.add_argument("--log-kib", type=int, default=256, help="size of each fake pod log")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--threads", type=int, default=16, help="threads per worker")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--method", default="DELETE")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="request path, {i} is replaced by the request index")
+    parser.add_argument("--startup-timeout", type=float, default=30)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        results = [run_load(args.url, args.method, args.path, args.requests, args.concurrency)]
+    elif args.app == "benchmarks.fake_app:app":
+        # Imported here, it loads the service modules the load test itself doesn't need.
+        from benchmarks.fakes import Fault, FakeHttpServer
+
+        fakes = {"backend": FakeHttpServer(fault=Fault.parse(args.backend_fault)).start(),
+                 "sidecar": FakeHttpServer(fault=Fault.parse(args.sidecar_fault)).start()}
+        try:
+            results = [run_with_gunicorn(args.app, int(workers), args.threads, args, fakes=fakes)
+                       for workers in args.workers.split(",")]
+        finally:
+            for fake in fakes.values():
+                fake.stop()
+    else:
+        results = [run_with_gunicorn(args.app, int(workers), args.threads, args)
+                   for workers in args.workers.split(",")]
+
+    print(f"{'workers':>8} {'threads':>8} {'rps':>10} {'p50 ms':>10} {'p99 ms':>10} {'deleted':>8}  statuses")
+    for result in results:
+        print(f"{result.get('workers', '-'):>8} {result.get('threads', '-'):>8} {result['throughput_rps']:>10} "
+              f"{result['p50_ms']:>10} {result['p99_ms']:>10} {result.get('pods_deleted', '-'):>8}  "
+              f"{result['statuses']}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+    Startup-time benchmark: time until `main:app` is importable (and the app created) in a fresh interpreter.
+
+    python -m benchmarks.startup_time --runs 10
+    python -m benchmarks.startup_time --module helpers.utils --import-profile 15
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import typing as t
+
+from benchmarks.load_test import percentile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module: str, env: t.Dict[str, str]) -> float:
+    """
+        :return seconds a fresh interpreter needs to import the module, interpreter start excluded
+        :rtype: float
+    """
+    code = ("import time; start = time.perf_counter(); import " + module +
+            "; print(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(module: str, env: t.Dict[str, str], top: int) -> t.List[t.Dict[str, t.Any]]:
+    """
+        :return the top-level packages with the largest cumulative import time (python -X importtime)
+        :rtype: list
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    packages: t.Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, raw_name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented, the cumulative time of a top-level import includes them.
+        if raw_name.startswith("  "):
+            continue
+        name = raw_name.strip()
+        packages[name] = packages.get(name, 0) + int(cumulative)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"module": name, "cumulative_ms": round(micros / 1000, 1)} for name, micros in ranked]
+
+
+def main(argv: t.Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="module to import, `main` also creates the app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-profile", type=int, default=0, metavar="N",
+                        help="also list the N slowest top-level imports")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+
+    start = time.monotonic()
+    samples = [time_import(args.module, env) for _ in range(args.runs)]
+    result = {
+        "module": args.module,
+        "runs": args.runs,
+        "min_ms": round(min(samples) * 1000, 1),
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+        "wall_seconds": round(time.monotonic() - start, 3),
+    }
+    if args.import_profile:
+        result["slowest_imports"] = import_profile(args.module, env, args.import_profile)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+    Teardown benchmark against local fakes of the K8s API, backend, pod sidecar and S3.
+
+    Runs the DELETE route in-process at each concurrency level and reports throughput, latency
+    percentiles, per-step timings and memory, as JSON that can be compared run over run.
+
+    python -m benchmarks.teardown_bench --concurrency 50,500 --teardowns 1000
+    python -m benchmarks.teardown_bench --k8s-fault 0.02,0.01 --backend-fault 0.01,0,0.05 --output run.json
+    python -m benchmarks.teardown_bench --compare baseline.json
+
+    Fault specs are "latency[,jitter[,failure_rate]]" in seconds. Service settings can be tuned through
+    the usual environment variables (e.g. TEARDOWN_STEP_WORKERS), the fakes' addresses are set here.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+import typing as t
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Nothing from the service (benchmarks.fakes included) is imported at module level: env_info reads the
+# environment once, at its first import, so main() sets it up first.
+from benchmarks.load_test import BENCH_ENV, free_port, percentile
+
+
+_COMPARED = ("throughput_rps", "p50_ms", "p99_ms", "tracemalloc_peak_mb")
+
+
+def _histogram_totals(name: str, label: str) -> t.Dict[str, t.Tuple[int, float]]:
+    from commons import metrics
+
+    totals: t.Dict[str, t.Tuple[int, float]] = {}
+    for sample in metrics.snapshot().get(name, {}).get("samples", []):
+        key = sample["labels"].get(label, "")
+        count, total = totals.get(key, (0, 0.0))
+        totals[key] = (count + sample["value"]["count"], total + sample["value"]["sum"])
+    return totals
+
+
+def prewarm(app, run_id: str, teardowns: int, enable_video: bool, enable_logs: bool) -> None:
+    """
+        Pushes the session details of the level's sessions to the session cache, as session creation would.
+    """
+    sessions = [{"session_id": f"session-{run_id}-{index}", "enable_video": enable_video,
+                 "enable_logs": enable_logs, "log_name": f"bench/session-{run_id}-{index}.log"}
+                for index in range(teardowns)]
+    with app.test_client() as test_client:
+        for offset in range(0, len(sessions), 1000):
+            test_client.post("/api/v1/session-cache", json={"sessions": sessions[offset:offset + 1000]})
+
+
+def run_level(app, concurrency: int, teardowns: int, delete_type: str, trace_memory: bool,
+              prewarm_sessions: t.Dict[str, bool] = None) -> t.Dict[str, t.Any]:
+    """
+        :return throughput, latency percentiles, outcomes, mean step timings and memory of one level
+        :rtype: dict
+    """
+    run_id = uuid.uuid4().hex[:8]
+    if prewarm_sessions is not None:
+        prewarm(app, run_id, teardowns, **prewarm_sessions)
+    steps_before = _histogram_totals("teardown_step_seconds", "step")
+    # The DELETE routes answer 200 whether or not the teardown worked, outcomes come from the teardown metric.
+    outcomes_before = _histogram_totals("teardown_duration_seconds", "outcome")
+
+    def one(index: int) -> t.Tuple[float, int]:
+        path = f"/api/v1/session/bench-{run_id}-{index}/session-{run_id}-{index}/{delete_type}"
+        start = time.perf_counter()
+        with app.test_client() as test_client:
+            status = test_client.delete(path).status_code
+        return time.perf_counter() - start, status
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(teardowns)))
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies = [latency for latency, _ in results]
+    statuses: t.Dict[str, int] = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    step_means = {}
+    for step, (count, total) in _histogram_totals("teardown_step_seconds", "step").items():
+        before_count, before_total = steps_before.get(step, (0, 0.0))
+        if count > before_count:
+            step_means[step] = round((total - before_total) / (count - before_count) * 1000, 1)
+
+    outcomes = {}
+    for outcome, (count, _) in _histogram_totals("teardown_duration_seconds", "outcome").items():
+        count -= outcomes_before.get(outcome, (0, 0.0))[0]
+        if count:
+            outcomes[outcome] = count
+
+    return {
+        "concurrency": concurrency,
+        "teardowns": teardowns,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(teardowns / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else 0.0,
+        "statuses": statuses,
+        "outcomes": outcomes,
+        "step_mean_ms": step_means,
+        "tracemalloc_peak_mb": round(peak / 2 ** 20, 2) if peak is not None else None,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(results: t.List[t.Dict[str, t.Any]], baseline_path: str) -> None:
+    with open(baseline_path) as file:
+        baseline = {level["concurrency"]: level for level in json.load(file)["levels"]}
+
+    print(f"\nchange versus {baseline_path}")
+    for level in results:
+        previous = baseline.get(level["concurrency"])
+        if previous is None:
+            continue
+        changes = []
+        for key in _COMPARED:
+            old, new = previous.get(key), level.get(key)
+            if old and new is not None:
+                changes.append(f"{key} {(new - old) / old * 100:+.1f}%")
+        print(f"  concurrency {level['concurrency']:>5}: {', '.join(changes)}")
+
+
+def main(argv: t.Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="50,500", help="comma separated concurrency levels")
+    parser.add_argument("--teardowns", type=int, default=1000, help="teardowns per level")
+    parser.add_argument("--delete-type", default="completed")
+    parser.add_argument("--k8s-fault", default="", help="fault spec of every K8s API call")
+    parser.add_argument("--backend-fault", default="", help="fault spec of the backend endpoints")
+    parser.add_argument("--sidecar-fault", default="", help="fault spec of stop-recording")
+    parser.add_argument("--s3-fault", default="", help="fault spec of each storage upload")
+    parser.add_argument("--log-kib", type=int, default=256, help="size of each fake pod log")
+    parser.add_argument("--no-video", action="store_true", help="sessions without video recording")
+    parser.add_argument("--no-logs", action="store_true", help="sessions without log upload")
+    parser.add_argument("--prewarm", action="store_true",
+                        help="pre-populate the session cache so teardowns skip get-session-details")
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="skip allocation tracing, which slows the run down")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON output of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    backend_port, sidecar_port = free_port(), free_port()
+    for name, value in BENCH_ENV.items():
+        os.environ.setdefault(name, value)
+    os.environ.update({"BASE_URL": f"http://127.0.0.1:{backend_port}", "BACKEND_URL": "api",
+                       "SIDECAR_PORT": str(sidecar_port)})
+
+    # Imported after the environment is set, env_info reads it at import.
+    from benchmarks.fakes import Fault, FakeCoreV1Api, FakeHttpServer, FakeStorage
+    from commons import env_info
+    from helpers.storage import set_storage
+    from k8s import k8s_client
+    from main import app
+
+    if not env_info.ROOT_URL.startswith(os.environ["BASE_URL"]) or env_info.SIDECAR_PORT != sidecar_port:
+        raise RuntimeError("commons.env_info was imported before the benchmark environment was set")
+
+    backend = FakeHttpServer(port=backend_port, fault=Fault.parse(args.backend_fault), enable_video=not args.no_video,
+                             enable_logs=not args.no_logs).start()
+    sidecar = FakeHttpServer(port=sidecar_port, fault=Fault.parse(args.sidecar_fault)).start()
+    k8s_api = FakeCoreV1Api(log_bytes=args.log_kib * 1024, fault=Fault.parse(args.k8s_fault))
+    storage = FakeStorage(fault=Fault.parse(args.s3_fault))
+    k8s_client.set_core_v1_api(k8s_api)
+    set_storage(storage)
+
+    levels = []
+    try:
+        for concurrency in (int(level) for level in args.concurrency.split(",")):
+            level = run_level(app, concurrency, args.teardowns, args.delete_type, not args.no_tracemalloc,
+                              prewarm_sessions={"enable_video": not args.no_video, "enable_logs": not args.no_logs}
+                              if args.prewarm else None)
+            levels.append(level)
+            print(f"concurrency {concurrency:>5}: {level['throughput_rps']:>8} rps  p50 {level['p50_ms']:>8} ms  "
+                  f"p99 {level['p99_ms']:>8} ms  peak {level['tracemalloc_peak_mb']} MiB  {level['outcomes']}")
+    finally:
+        backend.stop()
+        sidecar.stop()
+
+    report = {
+        "args": vars(args),
+        "levels": levels,
+        "k8s_calls": k8s_api.calls,
+        "backend_requests": backend.requests,
+        "sidecar_requests": sidecar.requests,
+        "stored_bytes": storage.bytes_stored,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        compare(levels, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,9 @@
+from __future__ import annotations
+
+import dataclasses
 import os
+import typing as t
+
 import env_file
 
 try:
@@ -6,29 +11,258 @@ try:
 except Exception as err:
     pass
 
-HOST = os.environ.get("HOST")
-PORT = os.environ.get("PORT")
-DEBUG_MODE = os.environ.get("DEBUG_MODE")
 
-ROOT_URL = os.path.join(os.environ.get("BASE_URL"), os.environ.get("BACKEND_URL"))
-ORG_NAME = os.environ.get("ORG_NAME")
+# Malformed values don't stop the import, they fall back to the default and are reported by
+# validate_settings(), so the service (and tests) can be imported without a full environment.
+_PROBLEMS: t.List[str] = []
+
+
+def _get_bool(name, default="false"):
+    return os.environ.get(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _get_number(name, default, cast):
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        _PROBLEMS.append(f"{name}={value!r} is not a valid {cast.__name__}, using {default}")
+        return default
+
+
+def _get_int(name, default):
+    return _get_number(name, default, int)
+
+
+def _get_float(name, default):
+    return _get_number(name, default, float)
+
+
+def _get_list(name, default=""):
+    return tuple(dict.fromkeys(value.strip() for value in (os.environ.get(name) or default).split(",")
+                               if value.strip()))
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """
+        Validated, typed settings the service can't work without. Read once into SETTINGS, the module
+        constants of these settings are taken from it.
+    """
+    base_url: str
+    backend_url: str
+    org_name: str | None
+    namespaces: t.Tuple[str, ...]
+    storage_backend: str
+    s3_bucket: str | None
+    pod_deletion_wait_time: int
+    func_retry_limit: int
+    func_retry_pause_time: int
+    teardown_deadline: float
+    http_connect_timeout: float
+    http_read_timeout: float
+    orphan_reaper_rate: float
+    port: int
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        org_name = os.environ.get("ORG_NAME")
+        return cls(base_url=os.environ.get("BASE_URL", ""),
+                   backend_url=os.environ.get("BACKEND_URL", ""),
+                   org_name=org_name,
+                   # Namespaces served by this instance, ORG_NAME stays the default for routes without a
+                   # namespace. Teardowns in any other namespace are refused, also when NAMESPACES is unset.
+                   namespaces=_get_list("NAMESPACES", org_name or ""),
+                   storage_backend=os.environ.get("STORAGE_BACKEND", "s3"),
+                   s3_bucket=os.environ.get("S3_BUCKET"),
+                   pod_deletion_wait_time=_get_int("POD_WAIT_TIME", 60),
+                   func_retry_limit=_get_int("RETRY_LIMIT", 6),
+                   func_retry_pause_time=_get_int("RETRY_PAUSE_TIME", 5),
+                   teardown_deadline=_get_float("TEARDOWN_DEADLINE", 60),
+                   http_connect_timeout=_get_float("HTTP_CONNECT_TIMEOUT", 3),
+                   http_read_timeout=_get_float("HTTP_READ_TIMEOUT", 30),
+                   # Pod teardowns the orphan reaper starts per second, 0 disables the limit.
+                   orphan_reaper_rate=_get_float("ORPHAN_REAPER_RATE", 1),
+                   port=_get_int("PORT", 5002))
+
+    @property
+    def root_url(self) -> str:
+        return os.path.join(self.base_url, self.backend_url)
+
+    def problems(self) -> t.List[str]:
+        """
+            :return human readable configuration errors, empty when the settings are usable
+            :rtype: list
+        """
+        problems = list(_PROBLEMS)
+        if not self.base_url or not self.backend_url:
+            problems.append("BASE_URL and BACKEND_URL are required to reach the backend")
+        if not self.org_name and not self.namespaces:
+            problems.append("ORG_NAME or NAMESPACES is required, they are the namespaces of the browser pods")
+        if self.org_name and self.namespaces and self.org_name not in self.namespaces:
+            problems.append(f"ORG_NAME={self.org_name!r} must be one of NAMESPACES {list(self.namespaces)}")
+        if self.storage_backend not in ("s3", "filesystem", "memory"):
+            problems.append(f"STORAGE_BACKEND={self.storage_backend!r} must be s3, filesystem or memory")
+        if self.storage_backend == "s3" and not self.s3_bucket:
+            problems.append("S3_BUCKET is required with STORAGE_BACKEND=s3")
+        for name, value in (("POD_WAIT_TIME", self.pod_deletion_wait_time), ("RETRY_LIMIT", self.func_retry_limit),
+                            ("TEARDOWN_DEADLINE", self.teardown_deadline),
+                            ("HTTP_CONNECT_TIMEOUT", self.http_connect_timeout),
+                            ("HTTP_READ_TIMEOUT", self.http_read_timeout)):
+            if value <= 0:
+                problems.append(f"{name} must be positive, got {value}")
+        if self.func_retry_pause_time < 0:
+            problems.append(f"RETRY_PAUSE_TIME must not be negative, got {self.func_retry_pause_time}")
+        if self.orphan_reaper_rate < 0:
+            problems.append(f"ORPHAN_REAPER_RATE must not be negative, got {self.orphan_reaper_rate}")
+        if not 0 < self.port < 65536:
+            problems.append(f"PORT must be a valid port, got {self.port}")
+        return problems
+
+
+SETTINGS = Settings.from_env()
+
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = SETTINGS.port
+DEBUG_MODE = _get_bool("DEBUG_MODE")
+
+# Async job status, /metrics, teardown coalescing and the session cache are kept per process, so more
+# than one worker splits them: scale with threads, and with replicas beyond that.
+GUNICORN_WORKERS = _get_int("GUNICORN_WORKERS", 1)
+GUNICORN_THREADS = _get_int("GUNICORN_THREADS", 32)
+GUNICORN_TIMEOUT = _get_int("GUNICORN_TIMEOUT", 180)
+GUNICORN_GRACEFUL_TIMEOUT = _get_int("GUNICORN_GRACEFUL_TIMEOUT", 120)
+
+ROOT_URL = SETTINGS.root_url
+ORG_NAME = SETTINGS.org_name
+NAMESPACES = SETTINGS.namespaces
+NAMESPACE_LOOKUP = _get_bool("NAMESPACE_LOOKUP")
+NAMESPACE_INDEX_TTL = _get_float("NAMESPACE_INDEX_TTL", 300)
+NAMESPACE_INDEX_SIZE = _get_int("NAMESPACE_INDEX_SIZE", 10000)
 
 AWS_ACCESS_KEY = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
 REGION_NAME = os.environ.get("AWS_DEFAULT_REGION")
 ECR_BROWSER_IMAGES = os.environ.get("AWS_ECR_IMAGE")
-S3_BUCKET = os.environ.get("S3_BUCKET")
+S3_BUCKET = SETTINGS.s3_bucket
+S3_MAX_POOL_CONNECTIONS = _get_int("S3_MAX_POOL_CONNECTIONS", 50)
+S3_MAX_ATTEMPTS = _get_int("S3_MAX_ATTEMPTS", 3)
+STORAGE_BACKEND = SETTINGS.storage_backend
+STORAGE_PATH = os.environ.get("STORAGE_PATH", "/tmp/session-artifacts")
 
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL")
 LOG_FORMAT = os.environ.get("LOG_FORMAT")
 LOG_GROUP_NAME = os.environ.get("LOG_GROUP_NAME")
+LOG_STREAM_NAME = os.environ.get("LOG_STREAM_NAME") or ORG_NAME or "session-delete"
+TRACING_ENABLED = _get_bool("TRACING_ENABLED")
+LOG_JSON = _get_bool("LOG_JSON", "true")
+LOG_CONSOLE = _get_bool("LOG_CONSOLE", "true")
+# Bound of the listener queue and of the CloudWatch send backlog each, LOG_OVERFLOW_POLICY applies to both.
+LOG_QUEUE_SIZE = _get_int("LOG_QUEUE_SIZE", 10000)
+LOG_OVERFLOW_POLICY = os.environ.get("LOG_OVERFLOW_POLICY", "drop_newest")
+LOG_BATCH_INTERVAL = _get_int("LOG_BATCH_INTERVAL", 5)
+LOG_BATCH_COUNT = _get_int("LOG_BATCH_COUNT", 1000)
+LOG_HANDLER_RETRY_MAX_PAUSE = _get_float("LOG_HANDLER_RETRY_MAX_PAUSE", 300)
 
 
-POD_DELETION_WAIT_TIME = int(os.environ.get("POD_WAIT_TIME"))
-FUNC_RETRY_LIMIT = int(os.environ.get("RETRY_LIMIT"))
-FUNC_RETRY_PAUSE_TIME = int(os.environ.get("RETRY_PAUSE_TIME"))
+POD_DELETION_WAIT_TIME = SETTINGS.pod_deletion_wait_time
+POD_INFORMER = _get_bool("POD_INFORMER")
+CONFIRM_POD_DELETION = _get_bool("CONFIRM_POD_DELETION")
+POD_DELETE_GRACE_PERIOD = _get_int("POD_DELETE_GRACE_PERIOD", None)
+POD_DELETE_PROPAGATION_POLICY = os.environ.get("POD_DELETE_PROPAGATION_POLICY") or None
+FUNC_RETRY_LIMIT = SETTINGS.func_retry_limit
+FUNC_RETRY_PAUSE_TIME = SETTINGS.func_retry_pause_time
+RETRY_BASE_DELAY = _get_float("RETRY_BASE_DELAY", 0.5)
+TEARDOWN_DEADLINE = SETTINGS.teardown_deadline
+
+ASYNC_TEARDOWN = _get_bool("ASYNC_TEARDOWN")
+TEARDOWN_QUEUE_SIZE = _get_int("TEARDOWN_QUEUE_SIZE", 1000)
+TEARDOWN_WORKERS = _get_int("TEARDOWN_WORKERS", 8)
+TEARDOWN_JOB_TTL = _get_int("TEARDOWN_JOB_TTL", 3600)
+TEARDOWN_DEDUP_TTL = _get_float("TEARDOWN_DEDUP_TTL", 60)
+# 0 sizes the step pool from the threads that can run teardowns, see methods/delete_session.py.
+TEARDOWN_STEP_WORKERS = _get_int("TEARDOWN_STEP_WORKERS", 0)
+# Must be on a volume that outlives the pod (e.g. a PersistentVolumeClaim): on an emptyDir or the container
+# filesystem the journal is lost with the pod and only worker restarts within the pod are recovered.
+TEARDOWN_JOURNAL_PATH = os.environ.get("TEARDOWN_JOURNAL_PATH", "")
+TEARDOWN_JOURNAL_HEARTBEAT = _get_float("TEARDOWN_JOURNAL_HEARTBEAT", 10)
+TEARDOWN_JOURNAL_RETENTION = _get_float("TEARDOWN_JOURNAL_RETENTION", 86400)
+TEARDOWN_JOURNAL_COMPACT_INTERVAL = _get_float("TEARDOWN_JOURNAL_COMPACT_INTERVAL", 3600)
+
+ORPHAN_REAPER = _get_bool("ORPHAN_REAPER")
+ORPHAN_REAPER_INTERVAL = _get_float("ORPHAN_REAPER_INTERVAL", 300)
+ORPHAN_REAPER_LABEL_SELECTOR = os.environ.get("ORPHAN_REAPER_LABEL_SELECTOR", "")
+ORPHAN_REAPER_SESSION_LABEL = os.environ.get("ORPHAN_REAPER_SESSION_LABEL", "session_id")
+ORPHAN_REAPER_REQUEST_LABEL = os.environ.get("ORPHAN_REAPER_REQUEST_LABEL", "request_id")
+ORPHAN_REAPER_STALE_STATUSES = tuple(status.strip() for status in os.environ.get(
+    "ORPHAN_REAPER_STALE_STATUSES", "completed,aborted,timeout").split(",") if status.strip())
+ORPHAN_REAPER_MIN_AGE = _get_float("ORPHAN_REAPER_MIN_AGE", 600)
+ORPHAN_REAPER_PAGE_SIZE = _get_int("ORPHAN_REAPER_PAGE_SIZE", 100)
+ORPHAN_REAPER_RATE = SETTINGS.orphan_reaper_rate
+ORPHAN_REAPER_CONCURRENCY = _get_int("ORPHAN_REAPER_CONCURRENCY", 4)
+ORPHAN_REAPER_DRY_RUN = _get_bool("ORPHAN_REAPER_DRY_RUN")
+ORPHAN_REAPER_LOCK_PATH = os.environ.get("ORPHAN_REAPER_LOCK_PATH", "/tmp/session-delete-reaper.lock")
+
+BATCH_DELETE_CONCURRENCY = _get_int("BATCH_DELETE_CONCURRENCY", 16)
+BATCH_DELETE_MAX_ITEMS = _get_int("BATCH_DELETE_MAX_ITEMS", 500)
+
+CIRCUIT_BREAKER_ENABLED = _get_bool("CIRCUIT_BREAKER_ENABLED", "true")
+CIRCUIT_WINDOW = _get_float("CIRCUIT_WINDOW", 30)
+CIRCUIT_MIN_CALLS = _get_int("CIRCUIT_MIN_CALLS", 10)
+CIRCUIT_FAILURE_RATIO = _get_float("CIRCUIT_FAILURE_RATIO", 0.5)
+CIRCUIT_OPEN_SECONDS = _get_float("CIRCUIT_OPEN_SECONDS", 30)
+CIRCUIT_HALF_OPEN_CALLS = _get_int("CIRCUIT_HALF_OPEN_CALLS", 1)
+BULKHEAD_LIMITS = {
+    "backend": _get_int("BULKHEAD_BACKEND", 32),
+    "pod_sidecar": _get_int("BULKHEAD_POD_SIDECAR", 64),
+    "s3": _get_int("BULKHEAD_S3", 16),
+    "k8s": _get_int("BULKHEAD_K8S", 32),
+}
+BULKHEAD_WAIT = _get_float("BULKHEAD_WAIT", 1)
+
+HTTP_CONNECT_TIMEOUT = SETTINGS.http_connect_timeout
+HTTP_READ_TIMEOUT = SETTINGS.http_read_timeout
+SIDECAR_READ_TIMEOUT = _get_float("SIDECAR_READ_TIMEOUT", 120)
+SIDECAR_PORT = _get_int("SIDECAR_PORT", 9092)
+HTTP_POOL_HOSTS = _get_int("HTTP_POOL_HOSTS", 100)
+HTTP_POOL_MAXSIZE = _get_int("HTTP_POOL_MAXSIZE", 50)
+
+LOG_STREAMING = _get_bool("LOG_STREAMING")
+LOG_COMPRESSION = _get_bool("LOG_COMPRESSION")
+LOG_STREAM_CHUNK_SIZE = _get_int("LOG_STREAM_CHUNK_SIZE", 64 * 1024)
+S3_PART_SIZE = _get_int("S3_PART_SIZE", 8 * 1024 * 1024)
+
+ARTIFACT_OFFLOAD = _get_bool("ARTIFACT_OFFLOAD")
+ARTIFACT_SPOOL_PATH = os.environ.get("ARTIFACT_SPOOL_PATH", "/tmp/session-delete-spool")
+ARTIFACT_SPOOL_MAX_BYTES = _get_int("ARTIFACT_SPOOL_MAX_BYTES", 1024 * 1024 * 1024)
+ARTIFACT_SPOOL_SCAN_INTERVAL = _get_float("ARTIFACT_SPOOL_SCAN_INTERVAL", 30)
+ARTIFACT_UPLOAD_WORKERS = _get_int("ARTIFACT_UPLOAD_WORKERS", 4)
+ARTIFACT_UPLOAD_MAX_ATTEMPTS = _get_int("ARTIFACT_UPLOAD_MAX_ATTEMPTS", 10)
+ARTIFACT_UPLOAD_MAX_PAUSE = _get_float("ARTIFACT_UPLOAD_MAX_PAUSE", 300)
+
+# Session details pushed at session creation, so teardowns can skip the backend lookup. 0 disables.
+SESSION_CACHE_TTL = _get_float("SESSION_CACHE_TTL", 6 * 3600)
+SESSION_CACHE_SIZE = _get_int("SESSION_CACHE_SIZE", 50000)
+SESSION_CACHE_MAX_ITEMS = _get_int("SESSION_CACHE_MAX_ITEMS", 1000)
 
 HEADERS = {
     "Content-Type": "application/json"
 }
+
+SETTINGS_STRICT = _get_bool("SETTINGS_STRICT")
+
+
+def validate_settings() -> t.List[str]:
+    """
+        :return configuration errors of SETTINGS
+        :rtype: list
+        :raises ValueError: when SETTINGS_STRICT is set and there are errors
+    """
+    problems = SETTINGS.problems()
+    if problems and SETTINGS_STRICT:
+        raise ValueError("Invalid configuration: " + "; ".join(problems))
+    return problems
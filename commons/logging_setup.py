@@ -0,0 +1,328 @@
+"""
+    Queue-based, structured logging shipped to CloudWatch off the request path
+"""
+
+from __future__ import annotations
+
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import typing as t
+from logging.handlers import QueueHandler, QueueListener
+
+from commons import env_info, metrics
+
+
+LOG_RECORDS_DROPPED = metrics.counter("log_records_dropped_total", "Log records dropped because the queue was full.")
+LOG_SINK_FAILURES = metrics.counter("log_sink_failures_total", "Log records the primary sink failed to ship.")
+
+CONTEXT_FIELDS = ("namespace", "pod_name", "session_id", "request_id")
+
+_LOG_CONTEXT: contextvars.ContextVar[t.Dict[str, t.Any]] = contextvars.ContextVar("log_context", default={})
+_LISTENER: QueueListener | None = None
+
+
+@contextlib.contextmanager
+def log_context(**fields: t.Any) -> t.Iterator[None]:
+    """
+        Adds fields (namespace, pod_name, session_id, request_id) to every record logged in this context,
+        including step graph threads, which copy the context.
+    """
+    token = _LOG_CONTEXT.set({**_LOG_CONTEXT.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _LOG_CONTEXT.reset(token)
+
+
+class LogContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _LOG_CONTEXT.get()
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+        Never blocks the caller: when the queue is full the record is dropped (drop_newest) or the
+        oldest queued record makes room for it (drop_oldest).
+    """
+
+    def __init__(self, log_queue: queue.Queue, overflow_policy: str = "drop_newest"):
+        super().__init__(log_queue)
+        self.overflow_policy = overflow_policy
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the listener thread, only what can't cross threads is resolved here.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow_policy == "drop_oldest":
+                with contextlib.suppress(queue.Empty):
+                    self.queue.get_nowait()
+                    LOG_RECORDS_DROPPED.inc()
+                with contextlib.suppress(queue.Full):
+                    self.queue.put_nowait(record)
+                    return
+            LOG_RECORDS_DROPPED.inc()
+
+
+class FallbackHandler(logging.Handler):
+    """
+        Ships to the primary handler and falls back to the local sink when it raises.
+    """
+
+    def __init__(self, primary: logging.Handler, fallback: logging.Handler):
+        super().__init__()
+        self.primary = primary
+        self.fallback = fallback
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.primary.emit(record)
+        except Exception:
+            LOG_SINK_FAILURES.inc()
+            self.fallback.handle(record)
+
+    def flush(self) -> None:
+        self.primary.flush()
+        self.fallback.flush()
+
+    def close(self) -> None:
+        self.primary.close()
+        self.fallback.close()
+        super().close()
+
+
+def _build_formatter() -> logging.Formatter:
+    if env_info.LOG_JSON:
+        return JsonFormatter()
+    return logging.Formatter(fmt=env_info.LOG_FORMAT)
+
+
+def _undelivered_events(events: t.List[t.Dict[str, t.Any]], response: t.Dict[str, t.Any] | None
+                        ) -> t.List[t.Dict[str, t.Any]]:
+    """
+        :param : events: log events of the last put_log_events call, in the order they were sent
+        :type: events: list
+        :param : response: its response, None when every attempt raised
+        :type: response: dict/None
+        :return the events CloudWatch didn't store
+        :rtype: list
+    """
+    if response is None:
+        return events
+    rejected = response.get("rejectedLogEventsInfo")
+    if not rejected:
+        return []
+    # End indexes are exclusive, the start index inclusive.
+    too_old = max(rejected.get("tooOldLogEventEndIndex", 0), rejected.get("expiredLogEventEndIndex", 0))
+    too_new = rejected.get("tooNewLogEventStartIndex", len(events))
+    return [event for index, event in enumerate(events) if index < too_old or index >= too_new]
+
+
+def _drop_oldest_event(backlog: queue.Queue) -> bool:
+    """
+        :return whether the oldest queued log event was dropped, flush and close markers are never dropped
+        :rtype: bool
+    """
+    with backlog.mutex:
+        if not backlog.queue or not isinstance(backlog.queue[0], dict):
+            return False
+        backlog.queue.popleft()
+        backlog.unfinished_tasks -= 1
+        if backlog.unfinished_tasks == 0:
+            backlog.all_tasks_done.notify_all()
+        return True
+
+
+def _build_cloudwatch_handler(on_undelivered: t.Callable[[t.List[t.Dict[str, t.Any]]], None]) -> logging.Handler:
+    """
+        watchtower sends batches from its own thread and only warns when a batch can't be delivered, so
+        put_log_events is wrapped to hand the events CloudWatch didn't store to on_undelivered.
+
+        Its per-stream queues are unbounded, so while CloudWatch is slow or throttling they are held to
+        LOG_QUEUE_SIZE events with the LOG_OVERFLOW_POLICY of the listener queue.
+    """
+    import watchtower
+
+    class DeliveryCheckedHandler(watchtower.CloudWatchLogHandler):
+        def __init__(self, *args: t.Any, **kwargs: t.Any):
+            super().__init__(*args, **kwargs)
+            self._delivery = threading.local()
+            put_log_events = self.cwl_client.put_log_events
+
+            def checked_put_log_events(**kwargs):
+                self._delivery.events = kwargs.get("logEvents", [])
+                response = put_log_events(**kwargs)
+                self._delivery.response = response
+                return response
+
+            self.cwl_client.put_log_events = checked_put_log_events
+
+        def emit(self, message):
+            backlog = self.queues.get(self._get_stream_name(message))
+            if backlog is not None and backlog.qsize() >= env_info.LOG_QUEUE_SIZE:
+                LOG_RECORDS_DROPPED.inc()
+                if env_info.LOG_OVERFLOW_POLICY != "drop_oldest" or not _drop_oldest_event(backlog):
+                    return
+            super().emit(message)
+
+        def _submit_batch(self, batch, log_stream_name, max_retries=5):
+            if not batch:
+                return
+            self._delivery.events = batch
+            self._delivery.response = None
+            super()._submit_batch(batch, log_stream_name, max_retries=max_retries)
+            undelivered = _undelivered_events(self._delivery.events, self._delivery.response)
+            if undelivered:
+                on_undelivered(undelivered)
+
+    return DeliveryCheckedHandler(log_group_name=env_info.LOG_GROUP_NAME,
+                                  log_stream_name=env_info.LOG_STREAM_NAME,
+                                  send_interval=env_info.LOG_BATCH_INTERVAL,
+                                  max_batch_count=env_info.LOG_BATCH_COUNT)
+
+
+class LazyCloudWatchHandler(logging.Handler):
+    """
+        Builds the watchtower handler (and its boto3 client) on the first record, in the queue listener
+        thread, so creating the app doesn't wait for it. Raises while CloudWatch is unavailable so the
+        FallbackHandler routes records to the local sink; creation is retried with backoff, up to
+        LOG_HANDLER_RETRY_MAX_PAUSE apart. Batches the watchtower send thread fails to deliver are written
+        to fallback_sink, already formatted, as are the handler's own notices.
+    """
+
+    def __init__(self, fallback_sink: logging.StreamHandler):
+        super().__init__()
+        self.fallback_sink = fallback_sink
+        self._handler: logging.Handler | None = None
+        self._attempts = 0
+        self._retry_at = 0.0
+
+    def _get_handler(self) -> logging.Handler:
+        if self._handler is None and time.monotonic() >= self._retry_at:
+            try:
+                handler = _build_cloudwatch_handler(on_undelivered=self._ship_undelivered)
+                handler.setFormatter(self.formatter)
+                self._handler = handler
+                if self._attempts:
+                    self._notice(logging.INFO, f"CloudWatch logging available after {self._attempts} failed attempts")
+            except Exception as err:
+                self._attempts += 1
+                pause = min(env_info.LOG_HANDLER_RETRY_MAX_PAUSE, 2 ** self._attempts)
+                self._retry_at = time.monotonic() + pause
+                self._notice(logging.WARNING,
+                             f"CloudWatch logging unavailable, using local sink, retrying in {pause}s: {err}")
+        if self._handler is None:
+            raise RuntimeError("CloudWatch handler unavailable")
+        return self._handler
+
+    def _notice(self, level: int, message: str) -> None:
+        # Not logged through the app logger, whose records would come back to this handler.
+        self.fallback_sink.handle(logging.LogRecord(name=__name__, level=level, pathname=__file__, lineno=0,
+                                                    msg=message, args=None, exc_info=None))
+
+    def _ship_undelivered(self, events: t.List[t.Dict[str, t.Any]]) -> None:
+        LOG_SINK_FAILURES.inc(len(events))
+        sink = self.fallback_sink
+        sink.acquire()
+        try:
+            for event in events:
+                sink.stream.write(event["message"] + sink.terminator)
+            sink.flush()
+        except Exception as err:
+            self._notice(logging.ERROR, f"Couldn't write {len(events)} undelivered log records: {err}")
+        finally:
+            sink.release()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._get_handler().emit(record)
+
+    def flush(self) -> None:
+        if self._handler is not None:
+            self._handler.flush()
+
+    def close(self) -> None:
+        if self._handler is not None:
+            self._handler.close()
+        super().close()
+
+
+def setup_logging(logger: logging.Logger) -> QueueListener:
+    """
+        Replaces the logger's handlers with a bounded queue handler. A background listener formats
+        records and ships them to CloudWatch (batched by watchtower) and to the local stderr sink.
+
+        :param : logger: logger to configure, usually app.logger
+        :type: logger: logging.Logger
+        :return started queue listener
+        :rtype: QueueListener
+    """
+    global _LISTENER
+    if _LISTENER is not None:
+        return _LISTENER
+
+    formatter = _build_formatter()
+    local_sink = logging.StreamHandler(sys.stderr)
+    local_sink.setFormatter(formatter)
+
+    targets: t.List[logging.Handler] = [local_sink]
+    if env_info.LOG_GROUP_NAME:
+        fallback_sink = logging.StreamHandler(sys.stderr)
+        fallback_sink.setFormatter(formatter)
+        cloudwatch = LazyCloudWatchHandler(fallback_sink=fallback_sink)
+        cloudwatch.setFormatter(formatter)
+        shipper = FallbackHandler(primary=cloudwatch, fallback=fallback_sink)
+        targets = [shipper] if not env_info.LOG_CONSOLE else [shipper, local_sink]
+
+    log_queue: queue.Queue = queue.Queue(maxsize=env_info.LOG_QUEUE_SIZE)
+    queue_handler = BoundedQueueHandler(log_queue, overflow_policy=env_info.LOG_OVERFLOW_POLICY)
+    queue_handler.addFilter(LogContextFilter())
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.setLevel(env_info.LOG_LEVEL or logging.INFO)
+    logger.propagate = False
+
+    _LISTENER = QueueListener(log_queue, *targets, respect_handler_level=True)
+    _LISTENER.start()
+    atexit.register(_LISTENER.stop)
+    return _LISTENER
@@ -0,0 +1,210 @@
+"""
+    In-process metrics registry
+"""
+
+from __future__ import annotations
+
+import threading
+import typing as t
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_REGISTRY: t.Dict[str, "_Metric"] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: t.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: t.Dict[t.Tuple[str, ...], t.Any] = {}
+
+    def _key(self, labels: t.Dict[str, t.Any]) -> t.Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def samples(self) -> t.Dict[t.Tuple[str, ...], t.Any]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels: t.Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: t.Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels: t.Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: t.Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: t.Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: t.Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: t.Sequence[str] = (),
+                 buckets: t.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: t.Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = {"count": 0, "sum": 0.0, "buckets": [0] * len(self.buckets)}
+                self._values[key] = sample
+            sample["count"] += 1
+            sample["sum"] += value
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample["buckets"][index] += 1
+
+    def samples(self) -> t.Dict[t.Tuple[str, ...], t.Any]:
+        with self._lock:
+            return {key: {"count": sample["count"], "sum": sample["sum"], "buckets": list(sample["buckets"])}
+                    for key, sample in self._values.items()}
+
+
+def _get_or_create(cls, name: str, documentation: str, labelnames: t.Sequence[str] = (), **kwargs: t.Any):
+    with _REGISTRY_LOCK:
+        metric = _REGISTRY.get(name)
+        if metric is None:
+            metric = cls(name, documentation, labelnames, **kwargs)
+            _REGISTRY[name] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric `{name}` already registered as {metric.metric_type}")
+        return metric
+
+
+def counter(name: str, documentation: str, labelnames: t.Sequence[str] = ()) -> Counter:
+    """
+        :param : name: metric name
+        :type: name: str
+        :param : documentation: help text for the metric
+        :type: documentation: str
+        :param : labelnames: names of labels the metric is partitioned by
+        :type: labelnames: tuple
+        :return registered Counter
+        :rtype: Counter
+    """
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: t.Sequence[str] = ()) -> Gauge:
+    """
+        :param : name: metric name
+        :type: name: str
+        :param : documentation: help text for the metric
+        :type: documentation: str
+        :param : labelnames: names of labels the metric is partitioned by
+        :type: labelnames: tuple
+        :return registered Gauge
+        :rtype: Gauge
+    """
+    return _get_or_create(Gauge, name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: t.Sequence[str] = (),
+              buckets: t.Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """
+        :param : name: metric name
+        :type: name: str
+        :param : documentation: help text for the metric
+        :type: documentation: str
+        :param : labelnames: names of labels the metric is partitioned by
+        :type: labelnames: tuple
+        :param : buckets: upper bounds of histogram buckets
+        :type: buckets: tuple
+        :return registered Histogram
+        :rtype: Histogram
+    """
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def snapshot() -> t.Dict[str, t.Any]:
+    """
+        :return all registered metrics with their current samples
+        :rtype: dict
+    """
+    with _REGISTRY_LOCK:
+        metrics = list(_REGISTRY.values())
+
+    result = {}
+    for metric in metrics:
+        result[metric.name] = {
+            "type": metric.metric_type,
+            "samples": [{"labels": dict(zip(metric.labelnames, key)), "value": value}
+                        for key, value in metric.samples().items()],
+        }
+    return result
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: t.Sequence[str], key: t.Sequence[str], extra: t.Dict[str, str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs += [f'{name}="{_escape(value)}"' for name, value in extra.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus() -> str:
+    """
+        :return all registered metrics in the Prometheus text exposition format (0.0.4)
+        :rtype: str
+    """
+    with _REGISTRY_LOCK:
+        metrics = list(_REGISTRY.values())
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+        lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+        for key, value in metric.samples().items():
+            if isinstance(metric, Histogram):
+                for bound, count in zip(metric.buckets, value["buckets"]):
+                    labels = _format_labels(metric.labelnames, key, {"le": _format_value(float(bound))})
+                    lines.append(f"{metric.name}_bucket{labels} {count}")
+                labels = _format_labels(metric.labelnames, key, {"le": "+Inf"})
+                lines.append(f"{metric.name}_bucket{labels} {value['count']}")
+                labels = _format_labels(metric.labelnames, key)
+                lines.append(f"{metric.name}_sum{labels} {_format_value(value['sum'])}")
+                lines.append(f"{metric.name}_count{labels} {value['count']}")
+            else:
+                lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,36 @@
+"""
+    Gunicorn configuration for production serving: gunicorn -c gunicorn.conf.py main:app
+"""
+
+from commons import env_info
+
+
+bind = f"{env_info.HOST}:{env_info.PORT}"
+
+# gthread workers: teardowns are I/O bound, threads overlap the waits. One worker by default: the teardown
+# job store, metrics, coalescing and session cache live in the worker process and aren't shared between
+# workers, e.g. a job status poll reaching another worker answers 404.
+worker_class = "gthread"
+workers = env_info.GUNICORN_WORKERS
+threads = env_info.GUNICORN_THREADS
+
+# A synchronous teardown can legitimately take as long as TEARDOWN_DEADLINE plus the video upload.
+timeout = env_info.GUNICORN_TIMEOUT
+graceful_timeout = env_info.GUNICORN_GRACEFUL_TIMEOUT
+keepalive = 5
+
+# The app starts background threads, which don't survive a fork, so it is loaded per worker.
+preload_app = False
+
+accesslog = "-"
+
+
+def worker_exit(server, worker):
+    """
+        Runs in the worker after it stopped accepting requests: drains queued asynchronous teardowns.
+    """
+    from methods.teardown_queue import get_teardown_queue
+
+    drained = get_teardown_queue().shutdown(timeout=graceful_timeout)
+    if not drained:
+        server.log.warning(f"Worker {worker.pid} exited with teardown jobs still queued.")
@@ -0,0 +1,327 @@
+"""
+    Bounded local disk spool for artifacts uploaded to storage after the pod is gone
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+import typing as t
+import uuid
+
+from flask import Flask, current_app
+
+from commons import env_info, metrics
+from helpers.storage import get_storage
+
+
+SPOOL_BYTES = metrics.gauge("artifact_spool_bytes", "Bytes of artifacts waiting in the local spool.")
+SPOOL_ENTRIES = metrics.gauge("artifact_spool_entries", "Artifacts waiting in the local spool.")
+SPOOL_REJECTIONS = metrics.counter("artifact_spool_rejections_total",
+                                   "Artifacts not spooled (uploaded directly instead) by reason.", ("reason",))
+UPLOADS_TOTAL = metrics.counter("artifact_uploads_total", "Spooled artifact upload attempts by outcome.", ("outcome",))
+UPLOAD_SECONDS = metrics.histogram("artifact_upload_seconds", "Time to upload one spooled artifact.")
+SPOOL_AGE_SECONDS = metrics.histogram("artifact_spool_age_seconds", "Time from spooling to a successful upload.")
+
+_DATA_SUFFIX = ".data"
+_META_SUFFIX = ".json"
+_TMP_SUFFIX = ".tmp"
+_READ_SIZE = 1024 * 1024
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class ArtifactSpool:
+    """
+        Every artifact is a data file plus a metadata file, the metadata is written last so a crash never
+        leaves a half written entry that looks complete. Uploaders hold an flock on the metadata file, so
+        the gunicorn workers sharing the spool directory don't upload an entry twice. Failed uploads stay
+        in the spool and are retried with backoff; after max_attempts they move to the failed directory.
+    """
+
+    def __init__(self, path: str, max_bytes: int, workers: int, max_attempts: int, max_pause: float,
+                 scan_interval: float):
+        self.path = path
+        self.failed_path = os.path.join(path, "failed")
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.max_pause = max_pause
+        self.scan_interval = scan_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._queued: t.Set[str] = set()
+        self._lock = threading.Lock()
+        self._threads: t.List[threading.Thread] = []
+        # Spools in progress reserve their bytes under the lock before writing them, so concurrent spools
+        # can't overshoot max_bytes together. _disk_bytes is the last scan of the directory, without the
+        # partial files of this process (_writing), which are counted by their reservation instead.
+        self._disk_bytes = 0
+        self._reserved = 0
+        self._writing: t.Set[str] = set()
+        os.makedirs(self.failed_path, exist_ok=True)
+
+    def start(self, app: Flask) -> None:
+        """
+            Starts the uploaders and the scanner, which also picks up entries left by a previous process.
+
+            :param : app: flask application the threads push an app context for
+            :type: app: Flask
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                self._threads.append(threading.Thread(target=self._upload_loop, args=(app,),
+                                                      name=f"artifact-uploader-{index}", daemon=True))
+            self._threads.append(threading.Thread(target=self._scan_loop, args=(app,),
+                                                  name="artifact-spool-scanner", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def usage(self) -> t.Tuple[int, int]:
+        """
+            :return (bytes, entries) currently in the spool, including partially written entries
+            :rtype: tuple
+        """
+        with self._lock:
+            writing = set(self._writing)
+        total = entries = 0
+        with os.scandir(self.path) as listing:
+            for entry in listing:
+                if entry.path in writing:
+                    continue
+                if entry.is_file() and entry.name.endswith((_DATA_SUFFIX, _TMP_SUFFIX)):
+                    total += entry.stat().st_size
+                    entries += entry.name.endswith(_DATA_SUFFIX)
+        with self._lock:
+            self._disk_bytes = total
+            total += self._reserved
+        SPOOL_BYTES.set(total)
+        SPOOL_ENTRIES.set(entries)
+        return total, entries
+
+    def _reserve(self, size: int) -> bool:
+        with self._lock:
+            if self._disk_bytes + self._reserved + size > self.max_bytes:
+                return False
+            self._reserved += size
+            return True
+
+    def spool(self, key: str, chunks: t.Iterable[bytes], content_type: str = "text/plain",
+              compress: bool = False) -> int:
+        """
+            Writes the chunks to the spool and queues the upload.
+
+            :param : key: object key in storage
+            :type: key: str
+            :param : chunks: raw data chunks, e.g. from k8s_client.stream_pod_logs
+            :type: chunks: Iterable[bytes]
+            :param : content_type: content type of the stored object
+            :type: content_type: str
+            :param : compress: gzip the object on upload
+            :type: compress: bool
+            :return spooled bytes
+            :rtype: int
+            :raises SpoolFull: the spool has no room for the data, nothing was spooled
+        """
+        used, _ = self.usage()
+        if used >= self.max_bytes:
+            SPOOL_REJECTIONS.inc(reason="full")
+            raise SpoolFull(f"Artifact spool is full ({used} bytes)")
+
+        entry_id = uuid.uuid4().hex
+        data_path = os.path.join(self.path, entry_id + _DATA_SUFFIX)
+        tmp_path = data_path + _TMP_SUFFIX
+        written = 0
+        with self._lock:
+            self._writing.add(tmp_path)
+        try:
+            with open(tmp_path, "wb") as file:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if not self._reserve(len(chunk)):
+                        SPOOL_REJECTIONS.inc(reason="too_large")
+                        raise SpoolFull(f"Artifact `{key}` doesn't fit in the spool")
+                    written += len(chunk)
+                    file.write(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, data_path)
+            self._write_meta(entry_id, {"key": key, "content_type": content_type, "compress": compress,
+                                        "attempts": 0, "next_attempt_at": 0, "spooled_at": time.time()})
+        except BaseException:
+            for path in (tmp_path, data_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            with self._lock:
+                self._writing.discard(tmp_path)
+                self._reserved -= written
+            raise
+
+        # The entry is complete on disk now, its reservation becomes part of the directory usage.
+        with self._lock:
+            self._writing.discard(tmp_path)
+            self._reserved -= written
+            self._disk_bytes += written
+
+        self._enqueue(entry_id)
+        self.usage()
+        return written
+
+    def _write_meta(self, entry_id: str, meta: t.Dict[str, t.Any]) -> None:
+        meta_path = os.path.join(self.path, entry_id + _META_SUFFIX)
+        with open(meta_path + _TMP_SUFFIX, "w") as file:
+            json.dump(meta, file)
+        os.replace(meta_path + _TMP_SUFFIX, meta_path)
+
+    def _enqueue(self, entry_id: str) -> None:
+        with self._lock:
+            if entry_id in self._queued:
+                return
+            self._queued.add(entry_id)
+        self._queue.put(entry_id)
+
+    def scan(self) -> None:
+        """
+            Queues every complete entry whose next attempt is due and removes stale partial files.
+        """
+        now = time.time()
+        with os.scandir(self.path) as listing:
+            for entry in listing:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith((_TMP_SUFFIX, _DATA_SUFFIX)):
+                    # A partial file, or data without metadata, nobody touched for an hour belongs to a
+                    # process that died mid-write.
+                    meta_path = entry.path[:-len(_DATA_SUFFIX)] + _META_SUFFIX
+                    partial = entry.name.endswith(_TMP_SUFFIX) or not os.path.exists(meta_path)
+                    if partial and now - entry.stat().st_mtime > 3600:
+                        current_app.logger.warning(f"Removing incomplete spool file {entry.name}")
+                        os.remove(entry.path)
+                    continue
+                if not entry.name.endswith(_META_SUFFIX):
+                    continue
+                try:
+                    with open(entry.path) as file:
+                        meta = json.load(file)
+                except (OSError, ValueError):
+                    continue
+                if meta.get("next_attempt_at", 0) <= now:
+                    self._enqueue(entry.name[:-len(_META_SUFFIX)])
+        self.usage()
+
+    def _scan_loop(self, app: Flask) -> None:
+        with app.app_context():
+            while True:
+                try:
+                    self.scan()
+                except Exception as err:
+                    current_app.logger.warning(f"Artifact spool scan failed: {err}")
+                time.sleep(self.scan_interval)
+
+    def _upload_loop(self, app: Flask) -> None:
+        with app.app_context():
+            while True:
+                entry_id = self._queue.get()
+                try:
+                    self._upload(entry_id)
+                except Exception as err:
+                    current_app.logger.warning(f"Artifact upload of spool entry {entry_id} failed: {err}")
+                finally:
+                    with self._lock:
+                        self._queued.discard(entry_id)
+
+    def _upload(self, entry_id: str) -> None:
+        meta_path = os.path.join(self.path, entry_id + _META_SUFFIX)
+        data_path = os.path.join(self.path, entry_id + _DATA_SUFFIX)
+        try:
+            lock_file = open(meta_path, "r+")
+        except FileNotFoundError:
+            return
+
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            # Another worker may have uploaded and removed the entry before the lock was taken.
+            if not os.path.exists(data_path):
+                return
+            meta = json.load(lock_file)
+
+            start_time = time.monotonic()
+            try:
+                with open(data_path, "rb") as file:
+                    chunks = iter(lambda: file.read(_READ_SIZE), b"")
+                    get_storage().put_stream(key=meta["key"], chunks=chunks, compress=meta["compress"],
+                                             part_size=env_info.S3_PART_SIZE, content_type=meta["content_type"])
+            except Exception as err:
+                meta["attempts"] += 1
+                if meta["attempts"] >= self.max_attempts:
+                    current_app.logger.error(f"Giving up on artifact `{meta['key']}` after {meta['attempts']} "
+                                             f"attempts, kept in {self.failed_path}: {err}")
+                    os.replace(data_path, os.path.join(self.failed_path, entry_id + _DATA_SUFFIX))
+                    self._write_meta(entry_id, meta)
+                    os.replace(meta_path, os.path.join(self.failed_path, entry_id + _META_SUFFIX))
+                    UPLOADS_TOTAL.inc(outcome="abandoned")
+                else:
+                    meta["next_attempt_at"] = time.time() + min(self.max_pause, 2 ** meta["attempts"])
+                    self._write_meta(entry_id, meta)
+                    current_app.logger.warning(f"Upload of artifact `{meta['key']}` failed (attempt "
+                                               f"{meta['attempts']}), retrying later: {err}")
+                    UPLOADS_TOTAL.inc(outcome="retry")
+                return
+
+            UPLOAD_SECONDS.observe(time.monotonic() - start_time)
+            SPOOL_AGE_SECONDS.observe(time.time() - meta["spooled_at"])
+            UPLOADS_TOTAL.inc(outcome="uploaded")
+            os.remove(data_path)
+            os.remove(meta_path)
+            current_app.logger.info(f"Uploaded spooled artifact `{meta['key']}`.")
+        self.usage()
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        used, entries = self.usage()
+        return {"bytes": used, "max_bytes": self.max_bytes, "entries": entries, "queued": self._queue.qsize(),
+                "failed": sum(1 for name in os.listdir(self.failed_path) if name.endswith(_META_SUFFIX))}
+
+
+_SPOOL: ArtifactSpool | None = None
+_SPOOL_LOCK = threading.Lock()
+
+
+def get_artifact_spool() -> ArtifactSpool | None:
+    """
+        :return process wide spool, None when ARTIFACT_OFFLOAD is disabled
+        :rtype: ArtifactSpool/None
+    """
+    global _SPOOL
+    if not env_info.ARTIFACT_OFFLOAD:
+        return None
+    if _SPOOL is None:
+        with _SPOOL_LOCK:
+            if _SPOOL is None:
+                _SPOOL = ArtifactSpool(path=env_info.ARTIFACT_SPOOL_PATH,
+                                       max_bytes=env_info.ARTIFACT_SPOOL_MAX_BYTES,
+                                       workers=env_info.ARTIFACT_UPLOAD_WORKERS,
+                                       max_attempts=env_info.ARTIFACT_UPLOAD_MAX_ATTEMPTS,
+                                       max_pause=env_info.ARTIFACT_UPLOAD_MAX_PAUSE,
+                                       scan_interval=env_info.ARTIFACT_SPOOL_SCAN_INTERVAL)
+    return _SPOOL
+
+
+def start_artifact_uploads(app: Flask) -> None:
+    """
+        :param : app: flask application the upload threads push an app context for
+        :type: app: Flask
+    """
+    spool = get_artifact_spool()
+    if spool is not None:
+        spool.start(app)
@@ -0,0 +1,245 @@
+"""
+    Per-dependency circuit breakers with bulkheads (concurrency limits)
+"""
+
+from __future__ import annotations
+
+import collections
+import threading
+import time
+import typing as t
+
+from commons import env_info, metrics
+
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = metrics.gauge("circuit_breaker_state", "Circuit state by dependency, 0 closed, 1 half-open, 2 open.",
+                              ("dependency",))
+CIRCUIT_TRANSITIONS = metrics.counter("circuit_breaker_transitions_total", "Circuit state changes by dependency.",
+                                      ("dependency", "state"))
+CIRCUIT_REJECTIONS = metrics.counter("circuit_breaker_rejections_total",
+                                     "Calls failed fast by dependency and reason (open, bulkhead).",
+                                     ("dependency", "reason"))
+BULKHEAD_IN_USE = metrics.gauge("bulkhead_in_use", "Concurrent calls holding a bulkhead slot by dependency.",
+                                ("dependency",))
+
+
+class DependencyUnavailable(Exception):
+    """
+        Raised instead of calling a dependency, retrying won't help until the dependency recovers.
+    """
+
+    def __init__(self, dependency: str, message: str):
+        super().__init__(message)
+        self.dependency = dependency
+
+
+class CircuitOpenError(DependencyUnavailable):
+    pass
+
+
+class BulkheadFullError(DependencyUnavailable):
+    pass
+
+
+def _any_error(error: BaseException | None, result: t.Any) -> bool:
+    return error is not None
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, is_failure: t.Callable[[BaseException | None, t.Any], bool] = _any_error,
+                 window: float = 30, min_calls: int = 10, failure_ratio: float = 0.5, open_seconds: float = 30,
+                 half_open_calls: int = 1, max_concurrent: int = 0, bulkhead_wait: float = 1.0,
+                 enabled: bool = True, trips: bool = True):
+        """
+            :param : name: dependency name, used as metric label
+            :type: name: str
+            :param : is_failure: classifies (error, result) of a call as a dependency failure
+            :type: is_failure: Callable function
+            :param : window: seconds of call outcomes the failure ratio is computed over
+            :type: window: float
+            :param : min_calls: calls within the window needed before the circuit may open
+            :type: min_calls: int
+            :param : failure_ratio: share of failed calls in the window that opens the circuit
+            :type: failure_ratio: float
+            :param : open_seconds: seconds calls fail fast before probing the dependency again
+            :type: open_seconds: float
+            :param : half_open_calls: concurrent probe calls allowed while half-open
+            :type: half_open_calls: int
+            :param : max_concurrent: bulkhead size, 0 for no limit
+            :type: max_concurrent: int
+            :param : bulkhead_wait: seconds to wait for a bulkhead slot before failing fast
+            :type: bulkhead_wait: float
+            :param : enabled: when False calls pass straight through
+            :type: enabled: bool
+            :param : trips: when False the circuit never opens, only the bulkhead applies
+            :type: trips: bool
+        """
+        self.name = name
+        self.is_failure = is_failure
+        self.window = window
+        self.min_calls = max(min_calls, 1)
+        self.failure_ratio = failure_ratio
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(half_open_calls, 1)
+        self.max_concurrent = max_concurrent
+        self.bulkhead_wait = bulkhead_wait
+        self.enabled = enabled
+        self.trips = trips
+        self._bulkhead = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self._lock = threading.Lock()
+        self._outcomes: t.Deque[t.Tuple[float, bool]] = collections.deque()
+        self._failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], dependency=name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def _transition(self, state: str) -> None:
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._probes = 0
+        if state == CLOSED:
+            self._outcomes.clear()
+            self._failures = 0
+        CIRCUIT_STATE.set(_STATE_VALUES[state], dependency=self.name)
+        CIRCUIT_TRANSITIONS.inc(dependency=self.name, state=state)
+
+    def _admit(self) -> bool:
+        """
+            :return whether the call is a half-open probe
+            :rtype: bool
+        """
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    CIRCUIT_REJECTIONS.inc(dependency=self.name, reason="open")
+                    raise CircuitOpenError(self.name, f"Circuit for `{self.name}` is open")
+                self._transition(HALF_OPEN)
+
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    CIRCUIT_REJECTIONS.inc(dependency=self.name, reason="open")
+                    raise CircuitOpenError(self.name, f"Circuit for `{self.name}` is half-open, probe in flight")
+                self._probes += 1
+                return True
+            return False
+
+    def _record(self, failed: bool, probe: bool) -> None:
+        with self._lock:
+            if probe:
+                self._probes -= 1
+                if self._state == HALF_OPEN:
+                    self._transition(OPEN if failed else CLOSED)
+                return
+
+            now = time.monotonic()
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._failures -= self._outcomes.popleft()[1]
+
+            if self.trips and self._state == CLOSED and len(self._outcomes) >= self.min_calls and \
+                    self._failures / len(self._outcomes) >= self.failure_ratio:
+                self._transition(OPEN)
+
+    def call(self, func: t.Callable[..., t.Any], *args: t.Any, **kwargs: t.Any) -> t.Any:
+        """
+            :param : func: call to the dependency
+            :type: func: Callable function
+            :return result of func
+            :raises CircuitOpenError: the circuit is open
+            :raises BulkheadFullError: no bulkhead slot became free within bulkhead_wait
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        probe = self._admit()
+        if self._bulkhead is not None and not self._bulkhead.acquire(timeout=self.bulkhead_wait):
+            if probe:
+                with self._lock:
+                    self._probes -= 1
+            CIRCUIT_REJECTIONS.inc(dependency=self.name, reason="bulkhead")
+            raise BulkheadFullError(self.name, f"All {self.max_concurrent} `{self.name}` slots are busy")
+
+        BULKHEAD_IN_USE.inc(dependency=self.name)
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as err:
+            self._record(self.is_failure(err, None), probe)
+            raise
+        finally:
+            BULKHEAD_IN_USE.dec(dependency=self.name)
+            if self._bulkhead is not None:
+                self._bulkhead.release()
+        self._record(self.is_failure(None, result), probe)
+        return result
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        state = self.state
+        with self._lock:
+            calls = len(self._outcomes)
+            return {"state": state, "calls_in_window": calls, "failures_in_window": self._failures,
+                    "in_use": BULKHEAD_IN_USE.value(dependency=self.name), "max_concurrent": self.max_concurrent,
+                    "trips": self.trips}
+
+
+_BREAKERS: t.Dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+# Every pod runs its own sidecar, so failures of some pods (e.g. a lost node) say nothing about the
+# others: a shared circuit would fail stop-recording fast for healthy pods too. These keep only the
+# bulkhead.
+_BULKHEAD_ONLY = ("pod_sidecar",)
+
+
+def get_breaker(name: str, is_failure: t.Callable[[BaseException | None, t.Any], bool] = _any_error) -> CircuitBreaker:
+    """
+        :param : name: dependency name (backend, pod_sidecar, s3, k8s)
+        :type: name: str
+        :param : is_failure: classifies (error, result) of a call, used when the breaker is created
+        :type: is_failure: Callable function
+        :return process wide breaker of the dependency, configured from env_info; the pod_sidecar one
+                only limits concurrency
+        :rtype: CircuitBreaker
+    """
+    breaker = _BREAKERS.get(name)
+    if breaker is None:
+        with _BREAKERS_LOCK:
+            breaker = _BREAKERS.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name=name, is_failure=is_failure,
+                                         window=env_info.CIRCUIT_WINDOW,
+                                         min_calls=env_info.CIRCUIT_MIN_CALLS,
+                                         failure_ratio=env_info.CIRCUIT_FAILURE_RATIO,
+                                         open_seconds=env_info.CIRCUIT_OPEN_SECONDS,
+                                         half_open_calls=env_info.CIRCUIT_HALF_OPEN_CALLS,
+                                         max_concurrent=env_info.BULKHEAD_LIMITS.get(name, 0),
+                                         bulkhead_wait=env_info.BULKHEAD_WAIT,
+                                         enabled=env_info.CIRCUIT_BREAKER_ENABLED,
+                                         trips=name not in _BULKHEAD_ONLY)
+                _BREAKERS[name] = breaker
+    return breaker
+
+
+def breaker_stats() -> t.Dict[str, t.Dict[str, t.Any]]:
+    """
+        :return state and bulkhead usage of every breaker created so far
+        :rtype: dict
+    """
+    with _BREAKERS_LOCK:
+        breakers = list(_BREAKERS.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
@@ -0,0 +1,124 @@
+"""
+    Shared HTTP client with per-host connection pooling
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import typing as t
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from commons import env_info, metrics
+from helpers import circuit_breaker
+
+
+IN_FLIGHT = metrics.gauge("http_requests_in_flight", "Outbound HTTP requests currently in flight.", ("target",))
+REQUEST_SECONDS = metrics.histogram("http_request_seconds", "Outbound HTTP request latency.", ("target", "method"))
+REQUEST_ERRORS = metrics.counter("http_request_errors_total", "Outbound HTTP requests failed without a response.", ("target",))
+POOLS_OPEN = metrics.gauge("http_pools_open", "Per-host connection pools currently cached.")
+POOL_CONNECTIONS_IDLE = metrics.gauge("http_pool_connections_idle", "Idle keep-alive connections across all pools.")
+POOL_CONNECTIONS_CREATED = metrics.gauge("http_pool_connections_created", "Connections opened by the cached pools.")
+
+_SESSION: requests.Session | None = None
+_ADAPTER: HTTPAdapter | None = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+        :return process wide requests session, created on first use
+        :rtype: requests.Session
+    """
+    global _SESSION, _ADAPTER
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                adapter = HTTPAdapter(pool_connections=env_info.HTTP_POOL_HOSTS,
+                                      pool_maxsize=env_info.HTTP_POOL_MAXSIZE)
+                session = requests.Session()
+                session.headers.update(env_info.HEADERS)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _ADAPTER = adapter
+                _SESSION = session
+    return _SESSION
+
+
+def _is_failure(error: BaseException | None, response: requests.Response | None) -> bool:
+    """
+        Network errors and 5xx answers count against the dependency, 4xx answers don't.
+    """
+    if error is not None:
+        return isinstance(error, requests.RequestException)
+    return response.status_code >= 500
+
+
+def request(method: str, url: str, target: str = "backend", timeout: t.Any = None, **kwargs: t.Any) -> requests.Response:
+    """
+        :param : method: HTTP method
+        :type: method: str
+        :param : url: endpoint for calling API
+        :type: url: str
+        :param : target: dependency being called, selects the circuit breaker and is used as metric label
+        :type: target: str
+        :param : timeout: (connect, read) timeout, defaults to HTTP_CONNECT_TIMEOUT/HTTP_READ_TIMEOUT
+        :type: timeout: tuple
+        :return response from API
+        :rtype: requests.Response
+        :raises DependencyUnavailable: the target's circuit is open or its bulkhead is full
+    """
+    if timeout is None:
+        timeout = (env_info.HTTP_CONNECT_TIMEOUT, env_info.HTTP_READ_TIMEOUT)
+
+    session = get_http_session()
+
+    def send():
+        IN_FLIGHT.inc(target=target)
+        start_time = time.monotonic()
+        try:
+            return session.request(method=method, url=url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            REQUEST_ERRORS.inc(target=target)
+            raise
+        finally:
+            IN_FLIGHT.dec(target=target)
+            REQUEST_SECONDS.observe(time.monotonic() - start_time, target=target, method=method)
+
+    return circuit_breaker.get_breaker(target, is_failure=_is_failure).call(send)
+
+
+def _idle_connections(pool: t.Any) -> int:
+    # urllib3 pre-fills the pool queue with None placeholders, only real connections count.
+    if pool.pool is None:
+        return 0
+    with pool.pool.mutex:
+        return sum(1 for connection in pool.pool.queue if connection is not None)
+
+
+def pool_stats() -> t.Dict[str, t.Any]:
+    """
+        :return utilisation of the cached connection pools
+        :rtype: dict
+    """
+    if _ADAPTER is None:
+        return {"pools": 0, "idle_connections": 0, "connections_created": 0, "requests": 0}
+
+    pools = _ADAPTER.poolmanager.pools
+    idle = created = served = 0
+    open_pools = 0
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        open_pools += 1
+        idle += _idle_connections(pool)
+        created += pool.num_connections
+        served += pool.num_requests
+
+    POOLS_OPEN.set(open_pools)
+    POOL_CONNECTIONS_IDLE.set(idle)
+    POOL_CONNECTIONS_CREATED.set(created)
+    return {"pools": open_pools, "idle_connections": idle, "connections_created": created, "requests": served}
@@ -0,0 +1,68 @@
+"""
+    Token bucket rate limiter
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1):
+        """
+            :param : rate: tokens added per second, 0 disables the limit
+            :type: rate: float
+            :param : burst: max tokens the bucket holds
+            :type: burst: int
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        if self.unlimited:
+            return True
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+            Blocks until a token is available.
+
+            :param : timeout: max seconds to wait, None waits forever
+            :type: timeout: float
+            :return whether a token was taken
+            :rtype: bool
+        """
+        if self.unlimited:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
@@ -0,0 +1,205 @@
+"""
+    Retry policy with exponential backoff, jitter and deadlines
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import random
+import threading
+import time
+import typing as t
+
+from flask import current_app
+
+from commons import metrics
+from helpers.circuit_breaker import CircuitOpenError
+
+
+RETRIES_TOTAL = metrics.counter("retry_attempts_total", "Retried calls by operation.", ("operation",))
+RETRY_GIVE_UPS = metrics.counter("retry_give_ups_total", "Calls abandoned by the retry policy by reason.",
+                                 ("operation", "reason"))
+
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+_CURRENT_DEADLINE: contextvars.ContextVar["Deadline | None"] = contextvars.ContextVar("retry_deadline", default=None)
+_CURRENT_TALLY: contextvars.ContextVar["RetryTally | None"] = contextvars.ContextVar("retry_tally", default=None)
+
+
+class Deadline:
+    def __init__(self, seconds: float | None):
+        """
+            :param : seconds: time budget from now, None for no deadline
+            :type: seconds: float
+        """
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+@contextlib.contextmanager
+def deadline_scope(seconds: float | None) -> t.Iterator[Deadline]:
+    """
+        Sets the deadline used by every retry policy call in this context (and in step graph threads,
+        which copy the context), unless a tighter deadline is already active.
+
+        :param : seconds: time budget from now, None for no deadline
+        :type: seconds: float
+    """
+    deadline = Deadline(seconds)
+    outer = _CURRENT_DEADLINE.get()
+    if outer is not None and outer.remaining() < deadline.remaining():
+        deadline = outer
+    token = _CURRENT_DEADLINE.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _CURRENT_DEADLINE.reset(token)
+
+
+def current_deadline() -> Deadline | None:
+    return _CURRENT_DEADLINE.get()
+
+
+class RetryTally:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self) -> None:
+        with self._lock:
+            self.count += 1
+
+
+@contextlib.contextmanager
+def retry_tally() -> t.Iterator[RetryTally]:
+    """
+        Counts the retries made in this context, including step graph threads.
+    """
+    tally = RetryTally()
+    token = _CURRENT_TALLY.set(tally)
+    try:
+        yield tally
+    finally:
+        _CURRENT_TALLY.reset(token)
+
+
+def is_retryable_status(status_code: int) -> bool:
+    """
+        4xx answers (other than timeouts and throttling) will not change on retry.
+    """
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 6, base_delay: float = 0.5, max_delay: float = 5.0,
+                 multiplier: float = 2.0, jitter: bool = True,
+                 retry_on_status: t.Callable[[int], bool] = is_retryable_status):
+        """
+            :param : max_attempts: number of calls including the first one
+            :type: max_attempts: int
+            :param : base_delay: pause before the first retry in seconds
+            :type: base_delay: float
+            :param : max_delay: upper bound of a single pause in seconds
+            :type: max_delay: float
+            :param : multiplier: backoff growth factor per attempt
+            :type: multiplier: float
+            :param : jitter: use full jitter so concurrent callers don't retry in lockstep
+            :type: jitter: bool
+            :param : retry_on_status: classifies non-200 status codes as retryable
+            :type: retry_on_status: Callable function
+        """
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.retry_on_status = retry_on_status
+
+    def backoff(self, attempt: int) -> float:
+        """
+            :param : attempt: number of the failed attempt, starting at 1
+            :type: attempt: int
+            :return pause before the next attempt in seconds
+            :rtype: float
+        """
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** (attempt - 1)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def _should_retry(self, operation: str, response: t.Any, attempt: int, deadline: Deadline | None):
+        """
+            :return (done, pause) - done when the response is final, otherwise the pause before retrying,
+                    None for pause when the policy gives up
+        """
+        if response is not None:
+            status_code = getattr(response, "status_code", 200)
+            if status_code == 200:
+                return True, None
+            if not self.retry_on_status(status_code):
+                current_app.logger.info(f"Not retrying {operation}, status {status_code} is not retryable")
+                RETRY_GIVE_UPS.inc(operation=operation, reason="status")
+                return True, None
+
+        if attempt >= self.max_attempts:
+            RETRY_GIVE_UPS.inc(operation=operation, reason="attempts")
+            return False, None
+
+        pause = self.backoff(attempt)
+        if deadline is not None and deadline.remaining() <= pause:
+            current_app.logger.warning(f"Not retrying {operation}, deadline exceeded")
+            RETRY_GIVE_UPS.inc(operation=operation, reason="deadline")
+            return False, None
+
+        RETRIES_TOTAL.inc(operation=operation)
+        tally = _CURRENT_TALLY.get()
+        if tally is not None:
+            tally.add()
+        return False, pause
+
+    def call(self, func: t.Callable[..., t.Any], deadline: Deadline | None = None, **kwargs: t.Any):
+        """
+            The first attempt is always made, even past the deadline, so final status updates still go out.
+
+            :param : func: function to be called
+            :type: func: Callable function
+            :param : deadline: overall time budget, defaults to the active deadline_scope
+            :type: deadline: Deadline
+            :param : **kwargs: dict of parameters to be passed while calling function
+            :type: **kwargs: dict
+            :return response with status 200, None when every attempt failed, the status isn't retryable
+                    or the dependency's circuit is open
+            :rtype: json object
+        """
+        deadline = deadline or current_deadline()
+        operation = getattr(func, "__name__", "call")
+        attempt = 0
+        while True:
+            attempt += 1
+            response = None
+            try:
+                response = func(**kwargs)
+            except CircuitOpenError as err:
+                # The dependency's circuit is open, retrying before it closes can't succeed.
+                current_app.logger.warning(f"Not retrying {operation}: {err}")
+                RETRY_GIVE_UPS.inc(operation=operation, reason="unavailable")
+                return None
+            except Exception as err:
+                # Includes BulkheadFullError: a full bulkhead is contention, not an outage.
+                current_app.logger.warning(err)
+
+            done, pause = self._should_retry(operation, response, attempt, deadline)
+            if done:
+                return response if getattr(response, "status_code", 200) == 200 else None
+            if pause is None:
+                return None
+            current_app.logger.info(f"Retrying to call API : {kwargs.get('url')} (attempt {attempt + 1}) in {pause:.2f}s")
+            time.sleep(pause)
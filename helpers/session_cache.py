@@ -0,0 +1,129 @@
+"""
+    In-process cache of the session details a teardown needs, fed when sessions are created
+"""
+
+from __future__ import annotations
+
+import threading
+import typing as t
+
+from cachetools import TTLCache
+
+from commons import env_info, metrics
+
+
+SESSION_CACHE_LOOKUPS = metrics.counter("session_cache_lookups_total", "Session details lookups by result.",
+                                        ("result",))
+SESSION_CACHE_HIT_RATE = metrics.gauge("session_cache_hit_rate", "Share of session details served from the cache.")
+SESSION_CACHE_ENTRIES = metrics.gauge("session_cache_entries", "Sessions held in the cache.")
+
+# The fields of get-session-details the teardown steps read.
+CACHED_FIELDS = ("enable_video", "enable_logs", "log_name")
+
+
+def validate_session_details(item: t.Any) -> str | None:
+    """
+        :param : item: one entry of the pre-populate payload
+        :type: item: dict
+        :return validation error message, None when the entry is valid
+        :rtype: str/None
+    """
+    if not isinstance(item, dict):
+        return "Entry must be an object."
+    if not item.get("session_id") and not item.get("request_id"):
+        return "One of `session_id` or `request_id` is required."
+    for field in ("enable_video", "enable_logs"):
+        if not isinstance(item.get(field), bool):
+            return f"`{field}` must be a boolean."
+    if item["enable_logs"] and not isinstance(item.get("log_name"), str):
+        return "`log_name` is required when `enable_logs` is true."
+    return None
+
+
+class SessionCache:
+    """
+        TTL and LRU bounded map of session_id / request_id -> {enable_video, enable_logs, log_name}.
+        Entries are dropped once their teardown succeeded.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _keys(session_id: str = None, request_id: str = None) -> t.List[t.Tuple[str, str]]:
+        keys = []
+        if session_id:
+            # The DELETE route strips the dashes of firefox session ids, so session ids are keyed without
+            # dashes whichever form is given.
+            keys.append(("session", session_id.replace("-", "")))
+        if request_id:
+            keys.append(("request", request_id))
+        return keys
+
+    def put(self, details: t.Dict[str, t.Any], session_id: str = None, request_id: str = None) -> None:
+        """
+            :param : details: session details, fields other than CACHED_FIELDS are ignored
+            :type: details: dict
+            :param : session_id: webdriver session_id the teardown will use
+            :type: session_id: str
+            :param : request_id: request_id the teardown will use
+            :type: request_id: str
+        """
+        entry = {field: details.get(field) for field in CACHED_FIELDS}
+        with self._lock:
+            for key in self._keys(session_id, request_id):
+                self._cache[key] = entry
+            SESSION_CACHE_ENTRIES.set(len(self._cache))
+
+    def get(self, session_id: str = None, request_id: str = None) -> t.Dict[str, t.Any] | None:
+        """
+            Looks up the key the teardown fetches session details by: session_id, else request_id.
+
+            :return copy of the cached session details, None on miss
+            :rtype: dict/None
+        """
+        keys = self._keys(session_id, request_id)[:1]
+        with self._lock:
+            entry = self._cache.get(keys[0]) if keys else None
+            if entry is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            hit_rate = self._hits / (self._hits + self._misses)
+
+        SESSION_CACHE_LOOKUPS.inc(result="hit" if entry is not None else "miss")
+        SESSION_CACHE_HIT_RATE.set(round(hit_rate, 4))
+        return dict(entry) if entry is not None else None
+
+    def discard(self, session_id: str = None, request_id: str = None) -> None:
+        with self._lock:
+            for key in self._keys(session_id, request_id):
+                self._cache.pop(key, None)
+            SESSION_CACHE_ENTRIES.set(len(self._cache))
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._cache),
+                "max_entries": self._cache.maxsize,
+                "ttl_seconds": self._cache.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+            }
+
+
+_SESSION_CACHE = SessionCache(ttl=env_info.SESSION_CACHE_TTL, maxsize=env_info.SESSION_CACHE_SIZE) \
+    if env_info.SESSION_CACHE_TTL > 0 and env_info.SESSION_CACHE_SIZE > 0 else None
+
+
+def get_session_cache() -> SessionCache | None:
+    """
+        :return process wide session cache, None when SESSION_CACHE_TTL or SESSION_CACHE_SIZE is 0
+        :rtype: SessionCache/None
+    """
+    return _SESSION_CACHE
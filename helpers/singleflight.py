@@ -0,0 +1,93 @@
+"""
+    Single-flight call coalescing with a short-lived cache of completed results
+"""
+
+from __future__ import annotations
+
+import threading
+import typing as t
+
+from cachetools import TTLCache
+
+from commons import metrics
+
+
+COALESCED_CALLS = metrics.counter("singleflight_calls_total", "Coalesced calls by group and role.", ("group", "role"))
+
+ROLE_LEADER = "leader"
+ROLE_FOLLOWER = "follower"
+ROLE_CACHED = "cached"
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self, group: str, ttl: float, maxsize: int = 10000):
+        """
+            :param : group: name used as metric label
+            :type: group: str
+            :param : ttl: seconds a successful result is served to late duplicates, 0 disables the cache
+            :type: ttl: float
+            :param : maxsize: max number of cached results
+            :type: maxsize: int
+        """
+        self.group = group
+        self._lock = threading.Lock()
+        self._in_flight: t.Dict[t.Hashable, _Call] = {}
+        self._completed = TTLCache(maxsize=maxsize, ttl=ttl) if ttl > 0 else None
+
+    def do(self, key: t.Hashable, func: t.Callable[[], t.Any]) -> t.Tuple[t.Any, str]:
+        """
+            Runs func once per key: concurrent callers wait for the running call and get its result or
+            exception, callers within ttl of a successful call get the cached result.
+
+            :param : key: identity of the call
+            :type: key: Hashable
+            :param : func: call to execute
+            :type: func: Callable function
+            :return (result, role) where role is leader, follower or cached
+            :rtype: tuple
+        """
+        with self._lock:
+            if self._completed is not None and key in self._completed:
+                COALESCED_CALLS.inc(group=self.group, role=ROLE_CACHED)
+                return self._completed[key], ROLE_CACHED
+
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+
+        if not leader:
+            COALESCED_CALLS.inc(group=self.group, role=ROLE_FOLLOWER)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, ROLE_FOLLOWER
+
+        COALESCED_CALLS.inc(group=self.group, role=ROLE_LEADER)
+        try:
+            call.result = func()
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if call.error is None and self._completed is not None:
+                    self._completed[key] = call.result
+            call.done.set()
+        return call.result, ROLE_LEADER
+
+    def forget(self, key: t.Hashable) -> None:
+        with self._lock:
+            if self._completed is not None:
+                self._completed.pop(key, None)
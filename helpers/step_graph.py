@@ -0,0 +1,136 @@
+"""
+    Dependency graph of steps executed concurrently on a thread pool
+"""
+
+from __future__ import annotations
+
+import contextvars
+import time
+import typing as t
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+
+from flask import current_app
+
+from helpers.tracing import span
+
+
+class Step:
+    def __init__(self, name: str, func: t.Callable[[t.Dict[str, t.Any]], t.Any], depends_on: t.Sequence[str] = ()):
+        """
+            :param : name: unique name of the step
+            :type: name: str
+            :param : func: callable receiving the results of completed steps
+            :type: func: Callable function
+            :param : depends_on: names of steps which must finish first
+            :type: depends_on: tuple
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+
+class StepGraph:
+    def __init__(self, steps: t.Sequence[Step], executor: Executor, skip: t.Iterable[str] = (),
+                 on_step_done: t.Callable[[str], None] = None):
+        """
+            :param : steps: steps of the graph
+            :type: steps: list
+            :param : executor: pool the steps are submitted to
+            :type: executor: Executor
+            :param : skip: names of steps already done (e.g. before a restart), treated as finished with result None
+            :type: skip: tuple
+            :param : on_step_done: called with the name of every step that finished successfully
+            :type: on_step_done: Callable function
+        """
+        names = {step.name for step in steps}
+        for step in steps:
+            missing = [dep for dep in step.depends_on if dep not in names]
+            if missing:
+                raise ValueError(f"Step `{step.name}` depends on unknown steps: {missing}")
+
+        self.steps = {step.name: step for step in steps}
+        self.executor = executor
+        self.results: t.Dict[str, t.Any] = {}
+        self.timings: t.Dict[str, t.Tuple[float, float]] = {}
+        self.failed_step: str | None = None
+        self.skipped = {name for name in skip if name in names}
+        self.on_step_done = on_step_done
+        self._origin = None
+
+    def run(self) -> t.Dict[str, t.Any]:
+        """
+            Runs every step as soon as its dependencies have finished. On the first failure no new
+            steps are started, running ones are awaited and the error is re-raised.
+
+            :return results keyed by step name
+            :rtype: dict
+        """
+        app = current_app._get_current_object()
+        self._origin = time.monotonic()
+        pending = {name: step for name, step in self.steps.items() if name not in self.skipped}
+        self.results.update(dict.fromkeys(self.skipped))
+        running = {}
+        error = None
+
+        while pending or running:
+            if error is None:
+                ready = [step for step in pending.values() if all(dep in self.results for dep in step.depends_on)]
+                for step in ready:
+                    del pending[step.name]
+                    context = contextvars.copy_context()
+                    future = self.executor.submit(context.run, self._call, app, step)
+                    running[future] = step.name
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    self.results[name] = future.result()
+                    if self.on_step_done is not None:
+                        self.on_step_done(name)
+                except Exception as err:
+                    if error is None:
+                        error = err
+                        self.failed_step = name
+
+        if error is not None:
+            raise error
+        if pending:
+            raise ValueError(f"Steps could not be scheduled, cyclic dependencies: {sorted(pending)}")
+        return self.results
+
+    def _call(self, app, step: Step) -> t.Any:
+        start = time.monotonic() - self._origin
+        try:
+            with app.app_context(), span(f"step:{step.name}"):
+                return step.func(self.results)
+        finally:
+            self.timings[step.name] = (start, time.monotonic() - self._origin)
+
+    def durations(self) -> t.Dict[str, float]:
+        """
+            :return seconds spent in each finished step
+            :rtype: dict
+        """
+        return {name: round(end - start, 3) for name, (start, end) in self.timings.items()}
+
+    def critical_path(self) -> t.List[str]:
+        """
+            :return chain of steps, ending at the last one to finish, that determined the total time
+            :rtype: list
+        """
+        if not self.timings:
+            return []
+
+        name = max(self.timings, key=lambda step_name: self.timings[step_name][1])
+        path = [name]
+        while True:
+            deps = [dep for dep in self.steps[name].depends_on if dep in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda step_name: self.timings[step_name][1])
+            path.append(name)
+        return list(reversed(path))
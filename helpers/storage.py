@@ -0,0 +1,318 @@
+"""
+    Artifact storage backends (S3, local filesystem, in-memory)
+"""
+
+from __future__ import annotations
+
+import abc
+import os
+import threading
+import time
+import typing as t
+import zlib
+
+from commons import env_info, metrics
+from helpers import circuit_breaker
+
+
+MIN_S3_PART_SIZE = 5 * 1024 * 1024
+
+LOG_STREAM_BYTES = metrics.counter("log_stream_bytes_total", "Pod log bytes streamed to storage.", ("stage",))
+LOG_STREAM_BYTES_PER_SECOND = metrics.histogram("log_stream_bytes_per_second", "Pod log streaming throughput.",
+                                                buckets=(1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8))
+LOG_STREAM_PEAK_BUFFER = metrics.gauge("log_stream_peak_buffer_bytes", "Largest part buffer held while streaming logs.")
+
+_S3_CLIENT = None
+_STORAGE: "Storage | None" = None
+_LOCK = threading.Lock()
+
+
+def get_s3_client():
+    """
+        boto3 clients are thread safe, so one client (and its connection pool) is shared by every upload.
+
+        :return process wide S3 client, created on first use
+        :rtype: botocore.client.S3
+    """
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        with _LOCK:
+            if _S3_CLIENT is None:
+                # Imported here, boto3 takes a noticeable share of startup time and only S3 needs it.
+                import boto3
+                from botocore.config import Config
+
+                config = Config(region_name=env_info.REGION_NAME,
+                                max_pool_connections=env_info.S3_MAX_POOL_CONNECTIONS,
+                                retries={"max_attempts": env_info.S3_MAX_ATTEMPTS, "mode": "standard"})
+                _S3_CLIENT = boto3.session.Session().client(service_name="s3",
+                                                            aws_access_key_id=env_info.AWS_ACCESS_KEY,
+                                                            aws_secret_access_key=env_info.AWS_SECRET_KEY,
+                                                            config=config)
+    return _S3_CLIENT
+
+
+def _is_s3_failure(error: BaseException | None, result: t.Any) -> bool:
+    """
+        Client errors (missing bucket, access denied) are not S3 outages, throttling and 5xx are.
+    """
+    from botocore.exceptions import ClientError
+
+    if error is None:
+        return False
+    if isinstance(error, ClientError):
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 500
+        return status_code >= 500 or status_code == 429
+    return True
+
+
+def call_s3(method: str, **kwargs: t.Any) -> t.Any:
+    """
+        Calls an S3 client method through the s3 circuit breaker and bulkhead.
+
+        :param : method: name of the S3 client method
+        :type: method: str
+        :return response of the S3 client
+        :rtype: dict
+    """
+    breaker = circuit_breaker.get_breaker("s3", is_failure=_is_s3_failure)
+    return breaker.call(getattr(get_s3_client(), method), **kwargs)
+
+
+class Storage(abc.ABC):
+    @abc.abstractmethod
+    def put_object(self, key: str, data: t.Any, content_type: str = "text/plain",
+                   content_encoding: str = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    def _open_stream(self, key: str, content_type: str, content_encoding: str | None) -> "StreamWriter":
+        ...
+
+    def put_stream(self, key: str, chunks: t.Iterable[bytes], compress: bool = False,
+                   part_size: int = MIN_S3_PART_SIZE, content_type: str = "text/plain") -> t.Dict[str, t.Any]:
+        """
+            Writes an iterable of chunks part by part, holding at most one part in memory.
+
+            :param : key: object key
+            :type: key: str
+            :param : chunks: raw data chunks
+            :type: chunks: Iterable[bytes]
+            :param : compress: gzip the data on the fly, object is stored with Content-Encoding gzip
+            :type: compress: bool
+            :param : part_size: size of each written part in bytes
+            :type: part_size: int
+            :param : content_type: content type of the stored object
+            :type: content_type: str
+            :return transfer stats
+            :rtype: dict
+        """
+        writer = self._open_stream(key, content_type, "gzip" if compress else None)
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        buffer = bytearray()
+        stats = {"raw_bytes": 0, "uploaded_bytes": 0, "parts": 0, "peak_buffer_bytes": 0}
+        start_time = time.monotonic()
+
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                stats["raw_bytes"] += len(chunk)
+                buffer += compressor.compress(chunk) if compressor else chunk
+                stats["peak_buffer_bytes"] = max(stats["peak_buffer_bytes"], len(buffer))
+                if len(buffer) >= part_size:
+                    writer.write_part(bytes(buffer))
+                    stats["uploaded_bytes"] += len(buffer)
+                    buffer.clear()
+
+            if compressor:
+                buffer += compressor.flush()
+            writer.complete(bytes(buffer))
+            stats["uploaded_bytes"] += len(buffer)
+            stats["parts"] = writer.parts
+        except Exception:
+            try:
+                writer.abort()
+            except Exception:
+                # The original failure is more useful to the caller than the abort failure.
+                pass
+            raise
+        finally:
+            elapsed = time.monotonic() - start_time
+            stats["seconds"] = round(elapsed, 3)
+            LOG_STREAM_BYTES.inc(stats["raw_bytes"], stage="read")
+            LOG_STREAM_BYTES.inc(stats["uploaded_bytes"], stage="uploaded")
+            if elapsed > 0:
+                LOG_STREAM_BYTES_PER_SECOND.observe(stats["raw_bytes"] / elapsed)
+            if stats["peak_buffer_bytes"] > LOG_STREAM_PEAK_BUFFER.value():
+                LOG_STREAM_PEAK_BUFFER.set(stats["peak_buffer_bytes"])
+        return stats
+
+
+class StreamWriter(abc.ABC):
+    parts = 0
+
+    @abc.abstractmethod
+    def write_part(self, data: bytes) -> None:
+        ...
+
+    @abc.abstractmethod
+    def complete(self, data: bytes) -> None:
+        ...
+
+    def abort(self) -> None:
+        pass
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+
+    def put_object(self, key: str, data: t.Any, content_type: str = "text/plain",
+                   content_encoding: str = None) -> None:
+        extra_args = {"ContentEncoding": content_encoding} if content_encoding else {}
+        call_s3("put_object", Bucket=self.bucket, Key=key, Body=data, ContentType=content_type, **extra_args)
+
+    def _open_stream(self, key: str, content_type: str, content_encoding: str | None) -> StreamWriter:
+        return _S3MultipartWriter(self, key, content_type, content_encoding)
+
+
+class _S3MultipartWriter(StreamWriter):
+    def __init__(self, storage: S3Storage, key: str, content_type: str, content_encoding: str | None):
+        self.storage = storage
+        self.key = key
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.upload_id = None
+        self.etags = []
+
+    def write_part(self, data: bytes) -> None:
+        if self.upload_id is None:
+            extra_args = {"ContentEncoding": self.content_encoding} if self.content_encoding else {}
+            self.upload_id = call_s3("create_multipart_upload", Bucket=self.storage.bucket, Key=self.key,
+                                     ContentType=self.content_type, **extra_args)["UploadId"]
+        part_number = len(self.etags) + 1
+        res = call_s3("upload_part", Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id,
+                      PartNumber=part_number, Body=data)
+        self.etags.append({"ETag": res["ETag"], "PartNumber": part_number})
+        self.parts = len(self.etags)
+
+    def complete(self, data: bytes) -> None:
+        if self.upload_id is None:
+            # Small objects never reached a full part, a single put is cheaper than a multipart upload.
+            self.storage.put_object(self.key, data, self.content_type, self.content_encoding)
+            self.parts = 1
+            return
+        if data:
+            self.write_part(data)
+        call_s3("complete_multipart_upload", Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.etags})
+
+    def abort(self) -> None:
+        if self.upload_id is not None:
+            call_s3("abort_multipart_upload", Bucket=self.storage.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class FilesystemStorage(Storage):
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        root = os.path.abspath(self.root)
+        path = os.path.abspath(os.path.join(root, key.lstrip("/")))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"Key `{key}` escapes storage root")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def put_object(self, key: str, data: t.Any, content_type: str = "text/plain",
+                   content_encoding: str = None) -> None:
+        if isinstance(data, str):
+            data = data.encode()
+        with open(self._path(key), "wb") as file:
+            file.write(data)
+
+    def _open_stream(self, key: str, content_type: str, content_encoding: str | None) -> StreamWriter:
+        return _FileWriter(self._path(key))
+
+
+class _FileWriter(StreamWriter):
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.part"
+        self.file = open(self.tmp_path, "wb")
+
+    def write_part(self, data: bytes) -> None:
+        self.file.write(data)
+        self.parts += 1
+
+    def complete(self, data: bytes) -> None:
+        if data:
+            self.write_part(data)
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.objects: t.Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, key: str, data: t.Any, content_type: str = "text/plain",
+                   content_encoding: str = None) -> None:
+        if isinstance(data, str):
+            data = data.encode()
+        with self._lock:
+            self.objects[key] = bytes(data)
+
+    def _open_stream(self, key: str, content_type: str, content_encoding: str | None) -> StreamWriter:
+        return _MemoryWriter(self, key)
+
+
+class _MemoryWriter(StreamWriter):
+    def __init__(self, storage: MemoryStorage, key: str):
+        self.storage = storage
+        self.key = key
+        self.data = bytearray()
+
+    def write_part(self, data: bytes) -> None:
+        self.data += data
+        self.parts += 1
+
+    def complete(self, data: bytes) -> None:
+        if data:
+            self.write_part(data)
+        self.storage.put_object(self.key, bytes(self.data))
+
+
+def get_storage() -> Storage:
+    """
+        :return process wide storage backend selected by STORAGE_BACKEND (s3, filesystem or memory)
+        :rtype: Storage
+    """
+    global _STORAGE
+    if _STORAGE is None:
+        with _LOCK:
+            if _STORAGE is None:
+                if env_info.STORAGE_BACKEND == "filesystem":
+                    _STORAGE = FilesystemStorage(env_info.STORAGE_PATH)
+                elif env_info.STORAGE_BACKEND == "memory":
+                    _STORAGE = MemoryStorage()
+                else:
+                    _STORAGE = S3Storage(env_info.S3_BUCKET)
+    return _STORAGE
+
+
+def set_storage(storage: Storage | None) -> None:
+    """
+        :param : storage: backend to use instead of the configured one, None resets to configuration
+        :type: storage: Storage
+    """
+    global _STORAGE
+    with _LOCK:
+        _STORAGE = storage
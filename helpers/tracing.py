@@ -0,0 +1,122 @@
+"""
+    Lightweight tracing: spans for function calls and teardown steps
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import time
+import typing as t
+
+from flask import current_app
+
+from commons import env_info
+
+
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+
+_CURRENT_SPAN: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(num_bytes: int) -> str:
+    return os.urandom(num_bytes).hex()
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "attributes", "start_ns", "end_ns", "status",
+                 "error")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: str | None, attributes: t.Dict[str, t.Any]):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.error = None
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        """
+            Field names follow the OpenTelemetry span data model so the span log can be imported by
+            an OTLP collector.
+        """
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+def is_enabled() -> bool:
+    return env_info.TRACING_ENABLED
+
+
+def current_span() -> Span | None:
+    return _CURRENT_SPAN.get()
+
+
+def _export(span: Span) -> None:
+    current_app.logger.info(f"span {json.dumps(span.to_dict(), default=str)}")
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: t.Any) -> t.Iterator[Span | None]:
+    """
+        Records a span around the block. A root span gets a new 16 byte trace id, nested spans (also in
+        step graph threads, which copy the context) share the trace id of the outermost one. Ids of the
+        traced work, e.g. the session id of a teardown, go in the attributes.
+
+        :param : name: span name
+        :type: name: str
+        :param : **attributes: extra span attributes
+        :type: **attributes: dict
+    """
+    if not env_info.TRACING_ENABLED:
+        yield None
+        return
+
+    parent = _CURRENT_SPAN.get()
+    new_span = Span(name=name, trace_id=parent.trace_id if parent is not None else _new_id(16),
+                    parent_span_id=parent.span_id if parent is not None else None,
+                    attributes=attributes)
+    token = _CURRENT_SPAN.set(new_span)
+    try:
+        yield new_span
+    except BaseException as err:
+        new_span.status = STATUS_ERROR
+        new_span.error = f"{type(err).__name__}: {err}"
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        new_span.end_ns = time.time_ns()
+        _export(new_span)
+
+
+def traced(func: t.Callable) -> t.Callable:
+    """
+        Decorator recording a span for each call. Costs a single flag check when tracing is disabled.
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not env_info.TRACING_ENABLED:
+            return func(*args, **kwargs)
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -2,80 +2,76 @@
     Helper functions
 """
 
-import inspect
 import json
-import time
 import typing as t
 
-import boto3
-import requests
-
 from flask import current_app
 from commons import env_info
+from helpers import http_client
+from helpers.retry import RetryPolicy
+from helpers.storage import MIN_S3_PART_SIZE, get_storage
+from helpers.tracing import traced
 
 
+@traced
 def retry_func(func: t.Callable[..., t.Any], retry_limit: int = 6, pause_time: int = 5, **kwargs: t.Any):
     """
         :param : func: function to be called
         :type: func: Callable function
         :param : retry_limit: number of tries for calling function
         :type: retry_limit: int
-        :param : pause_time: sleep time after each retry
+        :param : pause_time: upper bound of the exponential backoff pause between tries
         :type: pause_time: int
         :param : **kwargs: dict of parameters to be passed while calling function
         :type: **kwargs: dict
         :return response from API
         :rtype: json object
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
-    retry_count = 0
-    while retry_count < retry_limit:
-        try:
-            if retry_count > 0:
-                current_app.logger.info(f"RETRY FUNC WORKING COUNT : {retry_count}")
-
-            func_res = func(**kwargs)  # function calling
-
-            if func_res.status_code == 200:
-                return func_res
-            current_app.logger.info(f"Retrying to call API : {kwargs['url']}")
-        except Exception as err:
-            current_app.logger.warning(err)
-        retry_count += 1
-        time.sleep(pause_time)
+    policy = RetryPolicy(max_attempts=retry_limit,
+                         base_delay=min(env_info.RETRY_BASE_DELAY, pause_time),
+                         max_delay=pause_time)
+    return policy.call(func, **kwargs)
 
 
+@traced
 def update_session(**kwargs):
     """
         :param : url: endpoint for calling API
         :type: url: str
         :param : data: payload data for PUT request
         :type: data: dict
+        :param : timeout: optional (connect, read) timeout
+        :type: timeout: tuple
         :return response from API
         :rtype: json object
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
-
     if "url" in kwargs and "data" in kwargs:
-        return requests.put(url=kwargs["url"], data=json.dumps(kwargs["data"]), headers=env_info.HEADERS)
+        return http_client.request("PUT", url=kwargs["url"], data=json.dumps(kwargs["data"]),
+                                   target=kwargs.get("target", "backend"), timeout=kwargs.get("timeout"))
     else:
         raise f"Required information for update_function API not correct."
 
 
+@traced
 def get_endpoint_api(**kwargs):
     """
         :param : url: endpoint for calling API
         :type: url: str
+        :param : target: dependency being called, "backend" or "pod_sidecar"
+        :type: target: str
+        :param : timeout: optional (connect, read) timeout
+        :type: timeout: tuple
         :return response from API
         :rtype: json object
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     if "url" in kwargs:
-        return requests.get(url=kwargs["url"], headers=env_info.HEADERS)
+        return http_client.request("GET", url=kwargs["url"],
+                                   target=kwargs.get("target", "backend"), timeout=kwargs.get("timeout"))
     else:
         raise f"Required information for {kwargs['url']} API not correct."
 
 
+@traced
 def upload_to_s3(key, data):
     """
         :param : key: path on S3 bucket
@@ -83,28 +79,52 @@ def upload_to_s3(key, data):
         :param : data: data to be uploaded to S3 bucket.
         :type: data: str
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     current_app.logger.info(f"Uploading data to S3 for organization : {env_info.ORG_NAME}.")
     try:
-        s3_obj = boto3.resource(service_name="s3",
-                                aws_access_key_id=env_info.AWS_ACCESS_KEY,
-                                aws_secret_access_key=env_info.AWS_SECRET_KEY)
-        s3_obj.Bucket(env_info.S3_BUCKET).put_object(Key=key,
-                                                     Body=data,
-                                                     ContentType="text/plain")
+        get_storage().put_object(key=key, data=data, content_type="text/plain")
         current_app.logger.info(f"Successfully uploaded logs data to S3 for organization : {env_info.ORG_NAME}.")
     except Exception as err:
         current_app.logger.warning(f"Exception when calling S3 Boto3 API: {err}")
 
 
+@traced
+def upload_stream_to_s3(key: str, chunks: t.Iterable[bytes], compress: bool = False,
+                        part_size: int = MIN_S3_PART_SIZE) -> t.Dict[str, t.Any]:
+    """
+        Uploads an iterable of chunks with an S3 multipart upload, holding at most one part in memory.
+
+        :param : key: path on S3 bucket
+        :type: key: str
+        :param : chunks: raw data chunks, e.g. from k8s_client.stream_pod_logs
+        :type: chunks: Iterable[bytes]
+        :param : compress: gzip the data on the fly, object is stored with Content-Encoding gzip
+        :type: compress: bool
+        :param : part_size: size of each uploaded part in bytes, at least 5 MiB
+        :type: part_size: int
+        :return transfer stats
+        :rtype: dict
+    """
+    current_app.logger.info(f"Streaming data to S3 for organization : {env_info.ORG_NAME}.")
+    stats = {}
+    try:
+        stats = get_storage().put_stream(key=key, chunks=chunks, compress=compress,
+                                         part_size=max(part_size, MIN_S3_PART_SIZE))
+        current_app.logger.info(f"Successfully streamed logs data to S3 for organization : {env_info.ORG_NAME}.")
+        current_app.logger.info(f"S3 log stream stats for key {key} : {stats}")
+    except Exception as err:
+        current_app.logger.warning(f"Exception when streaming to S3 Boto3 API: {err}")
+    return stats
+
+
+@traced
 def get_session_deleted_response() -> t.Dict[str, t.Any]:
     """
         https://w3c.github.io/webdriver/#delete-session
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     return {'value': None}
 
 
+@traced
 def get_delete_type(delete_type: str = None) -> t.Dict[str, t.Any]:
     """
         :param : delete_type: type of deletion from API URI
@@ -112,7 +132,6 @@ def get_delete_type(delete_type: str = None) -> t.Dict[str, t.Any]:
         :return dict with status
         :rtype: dict
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     if delete_type == "aborted":
         status_data = {"status": "aborted"}
     elif delete_type == "timeout":
@@ -122,6 +141,7 @@ def get_delete_type(delete_type: str = None) -> t.Dict[str, t.Any]:
     return status_data
 
 
+@traced
 def get_generated_urls(request_id: str = None, session_id: str = None) -> [t.Any, str, str]:
     """
         :param : request_id: request_id from API URI
@@ -131,7 +151,6 @@ def get_generated_urls(request_id: str = None, session_id: str = None) -> [t.Any
         :return tuple of urls
         :rtype: tuple
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     if session_id:
         session_details_url = f"{env_info.ROOT_URL}/get-session-details/session/{session_id}"
         update_url = f"{env_info.ROOT_URL}/update-session-status/session/{session_id}"
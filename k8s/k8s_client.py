@@ -4,38 +4,146 @@
 
 from __future__ import annotations
 
-import inspect
+import threading
+import time
 import typing as t
 
 from flask import current_app
 from kubernetes import config, client
 from kubernetes.client import V1Pod
-# from kubernetes.watch import watch
 from kubernetes.client.exceptions import ApiException
 
+from commons import env_info, metrics
+from helpers import circuit_breaker
+from helpers.circuit_breaker import DependencyUnavailable
+from helpers.tracing import traced
+from k8s.namespace_index import PodNamespaceIndex
+from k8s.pod_informer import get_pod_informer
+from k8s.pod_watch import get_namespace_watch
 
-try:
-    config.load_kube_config()
-except Exception as e:
-    config.load_incluster_config()
 
+_V1_INSTANCE: client.CoreV1Api | None = None
+_V1_LOCK = threading.Lock()
+_NAMESPACE_INDEX = PodNamespaceIndex(ttl=env_info.NAMESPACE_INDEX_TTL, maxsize=env_info.NAMESPACE_INDEX_SIZE)
 
-V1_INSTANCE = client.CoreV1Api()
 
+def get_core_v1_api() -> client.CoreV1Api:
+    """
+        Loads the kube config (local file, else in-cluster) on first use rather than at import.
+
+        :return process wide CoreV1Api client
+        :rtype: CoreV1Api
+    """
+    global _V1_INSTANCE
+    if _V1_INSTANCE is None:
+        with _V1_LOCK:
+            if _V1_INSTANCE is None:
+                try:
+                    config.load_kube_config()
+                except Exception as e:
+                    config.load_incluster_config()
+                _V1_INSTANCE = client.CoreV1Api()
+    return _V1_INSTANCE
+
+
+def set_core_v1_api(api: client.CoreV1Api | None) -> None:
+    """
+        :param : api: client to use instead of the configured one (e.g. a fake), None resets to configuration
+        :type: api: CoreV1Api
+    """
+    global _V1_INSTANCE
+    with _V1_LOCK:
+        _V1_INSTANCE = api
+
+
+POD_TIME_TO_TERMINATE = metrics.histogram("pod_time_to_terminate_seconds",
+                                          "Time from delete request until the pod watch reports it gone.")
+POD_DELETE_CONFIRMATIONS = metrics.counter("pod_delete_confirmations_total",
+                                           "Confirmed pod deletions by outcome.", ("outcome",))
+
+
+def _is_failure(error: BaseException | None, result: t.Any) -> bool:
+    """
+        Answers like 404 or 403 are about the request, only connection errors, throttling and 5xx
+        count against the API server.
+    """
+    if error is None:
+        return False
+    if isinstance(error, ApiException):
+        return error.status is None or error.status >= 500 or error.status == 429
+    return True
+
+
+def _call(func: t.Callable[..., t.Any], **kwargs: t.Any) -> t.Any:
+    return circuit_breaker.get_breaker("k8s", is_failure=_is_failure).call(func, **kwargs)
+
+
+def default_namespace() -> str | None:
+    """
+        :return namespace of routes that don't name one: ORG_NAME, else the first of NAMESPACES
+        :rtype: str/None
+    """
+    return env_info.ORG_NAME or (env_info.NAMESPACES[0] if env_info.NAMESPACES else None)
 
+
+def served_namespaces() -> t.Tuple[str, ...]:
+    """
+        :return namespaces pods may be deleted in: NAMESPACES plus the default namespace
+        :rtype: tuple
+    """
+    default = default_namespace()
+    return env_info.NAMESPACES + ((default,) if default and default not in env_info.NAMESPACES else ())
+
+
+@traced
+def resolve_namespace(pod_name: str, namespace: str = None) -> str:
+    """
+        All namespaces share this process' client, HTTP pools, breakers and caches, only the namespace
+        of each call changes.
+
+        :param : pod_name: name of k8s pod
+        :type: pod_name: str
+        :param : namespace: namespace given by the caller (route or request body), None to derive it
+        :type: namespace: str
+        :return namespace to use for the pod: the given one, the one found by the pod index when
+                NAMESPACE_LOOKUP is enabled and several namespaces are served, else the default one
+        :rtype: str
+    """
+    if namespace:
+        if namespace not in served_namespaces():
+            raise Exception(f"Namespace `{namespace}` is not served by this instance")
+        return namespace
+
+    if env_info.NAMESPACE_LOOKUP and len(env_info.NAMESPACES) > 1:
+        informers = [get_pod_informer(namespace=name, api=get_core_v1_api())
+                     for name in env_info.NAMESPACES] if env_info.POD_INFORMER else []
+        return _NAMESPACE_INDEX.lookup(pod_name, namespaces=env_info.NAMESPACES, api=get_core_v1_api(),
+                                       informers=informers, call=_call)
+
+    namespace = default_namespace()
+    if not namespace:
+        raise Exception("No namespace configured, set ORG_NAME or NAMESPACES")
+    return namespace
+
+
+@traced
 def get_pod(namespace: str, pod_name: str) -> V1Pod:
     """
         :param : namespace: namespace of k8s
         :type: namespace: str
         :param : pod_name: name of k8s pod
         :type: pod_name: str
-        :return V1Pod object response
+        :return V1Pod object response, served from the pod informer cache when POD_INFORMER is enabled
         :rtype: V1Pod
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     current_app.logger.info(f"Getting pod : {pod_name} in namespace : {namespace}.")
+    if env_info.POD_INFORMER:
+        cached = get_pod_informer(namespace=namespace, api=get_core_v1_api()).get(pod_name)
+        if cached is not None and cached.pod_ip is not None:
+            return cached.to_v1_pod()
+
     try:
-        return V1_INSTANCE.read_namespaced_pod(name=pod_name, namespace=namespace)
+        return _call(get_core_v1_api().read_namespaced_pod, name=pod_name, namespace=namespace)
     except ApiException as err:
         current_app.logger.warning(f"Exception when calling CoreV1Api->read_namespaced_pod: {err}")
         if err.status == 404:
@@ -43,18 +151,58 @@ def get_pod(namespace: str, pod_name: str) -> V1Pod:
         raise err
 
 
-def delete_pod(namespace: str, pod_name: str) -> None:
+@traced
+def delete_pod(namespace: str, pod_name: str, confirm: bool = None, grace_period_seconds: int = None,
+               propagation_policy: str = None) -> bool | None:
     """
         :param : namespace: namespace of k8s
         :type: namespace: str
         :param : pod_name: name of k8s pod
         :type: pod_name: str
+        :param : confirm: wait (up to POD_DELETION_WAIT_TIME) for the pod to terminate, defaults to CONFIRM_POD_DELETION
+        :type: confirm: bool
+        :param : grace_period_seconds: termination grace period, defaults to POD_DELETE_GRACE_PERIOD
+        :type: grace_period_seconds: int
+        :param : propagation_policy: Foreground/Background/Orphan, defaults to POD_DELETE_PROPAGATION_POLICY
+        :type: propagation_policy: str
+        :return True/False whether termination was confirmed, None when not waiting
+        :rtype: bool/None
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     current_app.logger.info(f"Deleting pod : {pod_name} in namespace : {namespace}.")
+
+    if confirm is None:
+        confirm = env_info.CONFIRM_POD_DELETION
+    if grace_period_seconds is None:
+        grace_period_seconds = env_info.POD_DELETE_GRACE_PERIOD
+    if propagation_policy is None:
+        propagation_policy = env_info.POD_DELETE_PROPAGATION_POLICY
+
+    namespace_watch = None
+    deleted_event = None
+    if confirm:
+        namespace_watch = get_namespace_watch(namespace=namespace, api=get_core_v1_api())
+        deleted_event = namespace_watch.expect_deletion(pod_name)
+
     try:
-        V1_INSTANCE.delete_namespaced_pod(name=pod_name, namespace=namespace)
+        start_time = time.monotonic()
+        _call(get_core_v1_api().delete_namespaced_pod, name=pod_name, namespace=namespace,
+              body=client.V1DeleteOptions(grace_period_seconds=grace_period_seconds,
+                                          propagation_policy=propagation_policy))
         current_app.logger.info(f"Successfully deleted pod : {pod_name} in namespace : {namespace}.")
+        _NAMESPACE_INDEX.forget(pod_name)
+
+        if not confirm:
+            return None
+
+        confirmed = deleted_event.wait(timeout=env_info.POD_DELETION_WAIT_TIME)
+        if confirmed:
+            POD_TIME_TO_TERMINATE.observe(time.monotonic() - start_time)
+            current_app.logger.info(f"Pod : {pod_name} in namespace : {namespace} terminated.")
+        else:
+            current_app.logger.warning(f"Pod : {pod_name} in namespace : {namespace} not terminated after "
+                                       f"{env_info.POD_DELETION_WAIT_TIME}s.")
+        POD_DELETE_CONFIRMATIONS.inc(outcome="confirmed" if confirmed else "timeout")
+        return confirmed
     except ApiException as err:
         current_app.logger.warning(f"Exception when calling CoreV1Api->delete_namespaced_pod: {err}")
         if err.status == 403:
@@ -62,8 +210,12 @@ def delete_pod(namespace: str, pod_name: str) -> None:
         if err.status == 404:
             raise Exception(f'Pod `{pod_name}` in namespace `{namespace}` not found') from err
         raise err
+    finally:
+        if namespace_watch is not None:
+            namespace_watch.forget_deletion(pod_name)
 
 
+@traced
 def get_pod_logs(namespace: str, pod_name: str, container_name: str):
     """
         :param : namespace: namespace of k8s
@@ -75,19 +227,80 @@ def get_pod_logs(namespace: str, pod_name: str, container_name: str):
         :return logs_data from k8s pod
         :rtype: text/plain
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     current_app.logger.info(f"Fetching pod logs for: {pod_name} in namespace : {namespace}.")
     logs_data = ""
     try:
-        logs_data = V1_INSTANCE.read_namespaced_pod_log(name=pod_name,
-                                                        namespace=namespace,
-                                                        container=container_name)
+        logs_data = _call(get_core_v1_api().read_namespaced_pod_log,
+                          name=pod_name,
+                          namespace=namespace,
+                          container=container_name)
         current_app.logger.info(f"Successfully fetched logs for pod name : `{pod_name}`")
-    except ApiException as err:
+    except (ApiException, DependencyUnavailable) as err:
         current_app.logger.warning(f"Exception when calling CoreV1Api->read_namespaced_pod_log: {err}")
     return logs_data
 
 
+def stream_pod_logs(namespace: str, pod_name: str, container_name: str,
+                    chunk_size: int = 64 * 1024) -> t.Iterator[bytes]:
+    """
+        :param : namespace: namespace of k8s
+        :type: namespace: str
+        :param : pod_name: name of k8s pod
+        :type: pod_name: str
+        :param : container_name: name of container inside k8s pod
+        :type: container_name: str
+        :param : chunk_size: max size of each yielded chunk in bytes
+        :type: chunk_size: int
+        :return iterator over raw log chunks, read without loading the whole log in memory
+        :rtype: Iterator[bytes]
+    """
+    current_app.logger.info(f"Streaming pod logs for: {pod_name} in namespace : {namespace}.")
+    try:
+        response = _call(get_core_v1_api().read_namespaced_pod_log,
+                         name=pod_name,
+                         namespace=namespace,
+                         container=container_name,
+                         _preload_content=False)
+    except (ApiException, DependencyUnavailable) as err:
+        current_app.logger.warning(f"Exception when calling CoreV1Api->read_namespaced_pod_log: {err}")
+        return
+
+    try:
+        for chunk in response.stream(chunk_size, decode_content=True):
+            yield chunk
+        current_app.logger.info(f"Successfully streamed logs for pod name : `{pod_name}`")
+    finally:
+        response.release_conn()
+
+
+def list_pods(namespace: str, label_selector: str = None, page_size: int = 100) -> t.Iterator[V1Pod]:
+    """
+        :param : namespace: namespace of k8s
+        :type: namespace: str
+        :param : label_selector: only pods matching this selector, e.g. "app=browser"
+        :type: label_selector: str
+        :param : page_size: pods fetched per list call
+        :type: page_size: int
+        :return iterator over the pods, listed page by page with continue tokens
+        :rtype: Iterator[V1Pod]
+    """
+    continue_token = None
+    while True:
+        kwargs = {"_continue": continue_token} if continue_token else {}
+        try:
+            pods = _call(get_core_v1_api().list_namespaced_pod, namespace=namespace,
+                         label_selector=label_selector or "", limit=page_size, **kwargs)
+        except ApiException as err:
+            current_app.logger.warning(f"Exception when calling CoreV1Api->list_namespaced_pod: {err}")
+            raise err
+
+        yield from pods.items
+        continue_token = pods.metadata._continue
+        if not continue_token:
+            return
+
+
+@traced
 def get_pod_ip(pod: V1Pod) -> t.Any | None:
     """
         :param : pod: V1Pod object
@@ -95,7 +308,6 @@ def get_pod_ip(pod: V1Pod) -> t.Any | None:
         :return pod_ip/None from V1pod object
         :rtype: str/None
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
     pod_ip = pod.status.pod_ip
 
     # In some cases K8s does not return pod IP
@@ -106,36 +318,31 @@ def get_pod_ip(pod: V1Pod) -> t.Any | None:
     return pod_ip
 
 
-# def get_watch_pod_status(namespace: str, pod_name: str, status_type: str, timeout: int = 120) -> bool:
-#     """
-#         :param : namespace: namespace of k8s
-#         :type: namespace: str
-#         :param : pod_name: name of k8s pod
-#         :type: pod_name: str
-#         :param : status_type: status of pod for which watch_pod stream should run
-#         :type: status_type: str
-#         :param : timeout: time for which watch_pod stream should run
-#         :type: timeout: int
-#         :return True/False status flag value
-#         :rtype: bool
-#     """
-#     status = False
-#     k8_func = None
-#     w = watch.Watch()
-#
-#     if status_type == "Running":
-#         k8_func = V1_INSTANCE.read_namespaced_pod
-#     elif status_type == "Terminating":
-#         k8_func = V1_INSTANCE.delete_namespaced_pod
-#
-#     for event in w.stream(func=k8_func,
-#                           namespace=namespace,
-#                           name=pod_name,
-#                           timeout_seconds=timeout):
-#         if event["object"].status.phase == status_type:
-#             w.stop()
-#             status = True
-#             return status
-#
-#     w.stop()
-#     return status
+def start_pod_informer(namespace: str) -> None:
+    """
+        Warms the pod cache at startup so the first teardowns don't miss.
+
+        :param : namespace: namespace of k8s
+        :type: namespace: str
+    """
+    current_app.logger.info(f"Starting pod informer for namespace : {namespace}.")
+    get_pod_informer(namespace=namespace, api=get_core_v1_api())
+
+
+def pod_informer_stats(namespace: str) -> t.Dict[str, t.Any] | None:
+    """
+        :param : namespace: namespace of k8s
+        :type: namespace: str
+        :return cache size, hit rate and staleness, None when POD_INFORMER is disabled
+        :rtype: dict/None
+    """
+    if not env_info.POD_INFORMER:
+        return None
+    return get_pod_informer(namespace=namespace, api=get_core_v1_api()).stats()
+
+
+def __getattr__(name: str) -> t.Any:
+    # Keeps `k8s_client.V1_INSTANCE` working for existing callers.
+    if name == "V1_INSTANCE":
+        return get_core_v1_api()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
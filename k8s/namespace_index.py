@@ -0,0 +1,74 @@
+"""
+    Index resolving the namespace of a pod, for instances serving several namespaces
+"""
+
+from __future__ import annotations
+
+import threading
+import typing as t
+
+from cachetools import TTLCache
+from kubernetes import client
+
+from commons import metrics
+
+
+NAMESPACE_LOOKUPS = metrics.counter("pod_namespace_lookups_total", "Pod namespace lookups by source.", ("source",))
+
+
+class PodNamespaceIndex:
+    """
+        pod name -> namespace, answered from a TTL cache, then from the pod informers of the served
+        namespaces, then with one cluster wide list call filtered by pod name.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def remember(self, pod_name: str, namespace: str) -> None:
+        with self._lock:
+            self._cache[pod_name] = namespace
+
+    def forget(self, pod_name: str) -> None:
+        with self._lock:
+            self._cache.pop(pod_name, None)
+
+    def lookup(self, pod_name: str, namespaces: t.Sequence[str], api: client.CoreV1Api,
+               informers: t.Sequence[t.Any] = (), call: t.Callable[..., t.Any] = None) -> str:
+        """
+            :param : pod_name: name of k8s pod
+            :type: pod_name: str
+            :param : namespaces: namespaces served by this instance, pods elsewhere are ignored
+            :type: namespaces: list
+            :param : api: client used on cache and informer misses
+            :type: api: CoreV1Api
+            :param : informers: pod informers of the served namespaces
+            :type: informers: list
+            :param : call: wrapper for the API call (e.g. a circuit breaker), called with (func, **kwargs)
+            :type: call: Callable function
+            :return namespace of the pod
+            :rtype: str
+        """
+        with self._lock:
+            namespace = self._cache.get(pod_name)
+        if namespace is not None:
+            NAMESPACE_LOOKUPS.inc(source="cache")
+            return namespace
+
+        for informer in informers:
+            if informer.contains(pod_name):
+                NAMESPACE_LOOKUPS.inc(source="informer")
+                self.remember(pod_name, informer.namespace)
+                return informer.namespace
+
+        NAMESPACE_LOOKUPS.inc(source="api")
+        kwargs = {"field_selector": f"metadata.name={pod_name}"}
+        pods = call(api.list_pod_for_all_namespaces, **kwargs) if call else api.list_pod_for_all_namespaces(**kwargs)
+        found = sorted({pod.metadata.namespace for pod in pods.items if pod.metadata.namespace in namespaces})
+        if not found:
+            raise Exception(f"Pod `{pod_name}` not found in namespaces {list(namespaces)}")
+        if len(found) > 1:
+            raise Exception(f"Pod `{pod_name}` exists in several namespaces {found}, the namespace must be given")
+        self.remember(pod_name, found[0])
+        return found[0]
@@ -0,0 +1,130 @@
+"""
+    In-process pod cache fed by the shared namespace watch.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import typing as t
+
+from kubernetes.client import CoreV1Api, V1ObjectMeta, V1Pod, V1PodStatus
+
+from commons import metrics
+from k8s.pod_watch import EVENT_SYNC, get_namespace_watch
+
+
+CACHE_LOOKUPS = metrics.counter("pod_cache_lookups_total", "Pod cache lookups by result.", ("namespace", "result"))
+CACHE_HIT_RATE = metrics.gauge("pod_cache_hit_rate", "Share of pod lookups served from the cache.", ("namespace",))
+CACHE_SIZE = metrics.gauge("pod_cache_pods", "Pods held in the cache.", ("namespace",))
+CACHE_STALENESS = metrics.gauge("pod_cache_staleness_seconds", "Seconds since the cache last heard from the API server.",
+                                ("namespace",))
+
+
+class CachedPod:
+    __slots__ = ("name", "namespace", "pod_ip", "phase", "resource_version", "updated_at")
+
+    def __init__(self, pod: V1Pod):
+        self.name = pod.metadata.name
+        self.namespace = pod.metadata.namespace
+        self.pod_ip = pod.status.pod_ip if pod.status else None
+        self.phase = pod.status.phase if pod.status else None
+        self.resource_version = pod.metadata.resource_version
+        self.updated_at = time.monotonic()
+
+    def to_v1_pod(self) -> V1Pod:
+        return V1Pod(metadata=V1ObjectMeta(name=self.name, namespace=self.namespace,
+                                           resource_version=self.resource_version),
+                     status=V1PodStatus(pod_ip=self.pod_ip, phase=self.phase))
+
+
+class PodInformer:
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._pods: t.Dict[str, CachedPod] = {}
+        self._lock = threading.Lock()
+        self._last_event_at: float | None = None
+        self._hits = 0
+        self._misses = 0
+
+    def on_event(self, event_type: str, obj: t.Any) -> None:
+        with self._lock:
+            if event_type == EVENT_SYNC:
+                self._pods = {pod.metadata.name: CachedPod(pod) for pod in obj}
+            elif event_type == "DELETED":
+                self._pods.pop(obj.metadata.name, None)
+            elif event_type in ("ADDED", "MODIFIED"):
+                self._pods[obj.metadata.name] = CachedPod(obj)
+            self._last_event_at = time.monotonic()
+            CACHE_SIZE.set(len(self._pods), namespace=self.namespace)
+
+    def get(self, pod_name: str) -> CachedPod | None:
+        """
+            :param : pod_name: name of k8s pod
+            :type: pod_name: str
+            :return cached pod, None on miss
+            :rtype: CachedPod/None
+        """
+        with self._lock:
+            cached = self._pods.get(pod_name)
+            if cached is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            hit_rate = self._hits / (self._hits + self._misses)
+
+        CACHE_LOOKUPS.inc(namespace=self.namespace, result="hit" if cached is not None else "miss")
+        CACHE_HIT_RATE.set(round(hit_rate, 4), namespace=self.namespace)
+        CACHE_STALENESS.set(self.staleness(), namespace=self.namespace)
+        return cached
+
+    def contains(self, pod_name: str) -> bool:
+        """
+            Membership check that leaves the hit rate alone, used to find a pod's namespace.
+        """
+        with self._lock:
+            return pod_name in self._pods
+
+    def staleness(self) -> float:
+        """
+            :return seconds since the last sync or watch event, -1 before the first sync
+            :rtype: float
+        """
+        if self._last_event_at is None:
+            return -1
+        return round(time.monotonic() - self._last_event_at, 3)
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "namespace": self.namespace,
+                "pods": len(self._pods),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "staleness_seconds": self.staleness(),
+            }
+
+
+_INFORMERS: t.Dict[str, PodInformer] = {}
+_INFORMERS_LOCK = threading.Lock()
+
+
+def get_pod_informer(namespace: str, api: CoreV1Api) -> PodInformer:
+    """
+        :param : namespace: namespace of k8s
+        :type: namespace: str
+        :param : api: client used by the namespace watch
+        :type: api: CoreV1Api
+        :return the namespace's informer, subscribed to its shared watch on first use
+        :rtype: PodInformer
+    """
+    with _INFORMERS_LOCK:
+        informer = _INFORMERS.get(namespace)
+        if informer is None:
+            informer = PodInformer(namespace)
+            namespace_watch = get_namespace_watch(namespace=namespace, api=api)
+            namespace_watch.add_listener(informer.on_event)
+            _INFORMERS[namespace] = informer
+        return informer
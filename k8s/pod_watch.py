@@ -0,0 +1,167 @@
+"""
+    Shared namespace-level pod watch streams.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import typing as t
+
+from flask import Flask, current_app
+from kubernetes import watch
+from kubernetes.client import CoreV1Api, V1Pod
+from kubernetes.client.exceptions import ApiException
+
+from commons import metrics
+
+
+WATCH_RESTARTS = metrics.counter("pod_watch_restarts_total", "Namespace pod watch restarts by reason.",
+                                 ("namespace", "reason"))
+WATCH_EVENTS = metrics.counter("pod_watch_events_total", "Pod watch events received.", ("namespace", "type"))
+
+EVENT_SYNC = "SYNC"
+
+Listener = t.Callable[[str, t.Any], None]
+
+
+class NamespaceWatch:
+    """
+        One list + watch stream per namespace. Listeners get ("SYNC", [V1Pod, ...]) after every
+        (re)list and (event_type, V1Pod) for each ADDED/MODIFIED/DELETED event.
+    """
+
+    def __init__(self, namespace: str, api: CoreV1Api, app: Flask, watch_timeout: int = 300):
+        self.namespace = namespace
+        self.api = api
+        self.app = app
+        self.watch_timeout = watch_timeout
+        self.resource_version: str | None = None
+        self.synced = threading.Event()
+        self._listeners: t.List[Listener] = []
+        self._deletion_waiters: t.Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"pod-watch-{namespace}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def add_listener(self, listener: Listener) -> None:
+        """
+            Listeners added after the initial sync get their own SYNC snapshot straight away.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+        if self.synced.is_set():
+            listener(EVENT_SYNC, self.api.list_namespaced_pod(namespace=self.namespace).items)
+
+    def remove_listener(self, listener: Listener) -> None:
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def expect_deletion(self, pod_name: str) -> threading.Event:
+        """
+            Register before issuing the delete so the DELETED event can't be missed.
+
+            :param : pod_name: name of k8s pod
+            :type: pod_name: str
+            :return event set once the pod is gone
+            :rtype: threading.Event
+        """
+        with self._lock:
+            return self._deletion_waiters.setdefault(pod_name, threading.Event())
+
+    def forget_deletion(self, pod_name: str) -> None:
+        with self._lock:
+            self._deletion_waiters.pop(pod_name, None)
+
+    def _dispatch(self, event_type: str, obj: t.Any) -> None:
+        with self._lock:
+            listeners = list(self._listeners)
+            if event_type == EVENT_SYNC:
+                present = {pod.metadata.name for pod in obj}
+                gone = [event for name, event in self._deletion_waiters.items() if name not in present]
+            elif event_type == "DELETED":
+                waiter = self._deletion_waiters.get(obj.metadata.name)
+                gone = [waiter] if waiter is not None else []
+            else:
+                gone = []
+
+        for event in gone:
+            event.set()
+        for listener in listeners:
+            try:
+                listener(event_type, obj)
+            except Exception as err:
+                current_app.logger.warning(f"Pod watch listener failed for namespace {self.namespace}: {err}")
+
+    def _list(self) -> None:
+        pods = self.api.list_namespaced_pod(namespace=self.namespace)
+        self.resource_version = pods.metadata.resource_version
+        self._dispatch(EVENT_SYNC, pods.items)
+        self.synced.set()
+
+    def _run(self) -> None:
+        with self.app.app_context():
+            backoff = 1
+            while not self._stopped.is_set():
+                try:
+                    if self.resource_version is None:
+                        self._list()
+                    stream = watch.Watch()
+                    for event in stream.stream(self.api.list_namespaced_pod,
+                                               namespace=self.namespace,
+                                               resource_version=self.resource_version,
+                                               timeout_seconds=self.watch_timeout):
+                        if self._stopped.is_set():
+                            stream.stop()
+                            break
+                        pod: V1Pod = event["object"]
+                        self.resource_version = pod.metadata.resource_version
+                        WATCH_EVENTS.inc(namespace=self.namespace, type=event["type"])
+                        self._dispatch(event["type"], pod)
+                    backoff = 1
+                except ApiException as err:
+                    if err.status == 410:
+                        # resourceVersion too old, relist to resync.
+                        WATCH_RESTARTS.inc(namespace=self.namespace, reason="expired")
+                        self.resource_version = None
+                        continue
+                    current_app.logger.warning(f"Pod watch for namespace {self.namespace} failed: {err}")
+                    WATCH_RESTARTS.inc(namespace=self.namespace, reason="error")
+                    self.resource_version = None
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                except Exception as err:
+                    current_app.logger.warning(f"Pod watch for namespace {self.namespace} failed: {err}")
+                    WATCH_RESTARTS.inc(namespace=self.namespace, reason="error")
+                    self.resource_version = None
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+
+
+_WATCHES: t.Dict[str, NamespaceWatch] = {}
+_WATCHES_LOCK = threading.Lock()
+
+
+def get_namespace_watch(namespace: str, api: CoreV1Api) -> NamespaceWatch:
+    """
+        :param : namespace: namespace of k8s
+        :type: namespace: str
+        :param : api: client used to list and watch pods
+        :type: api: CoreV1Api
+        :return the namespace's shared watch, started on first use
+        :rtype: NamespaceWatch
+    """
+    with _WATCHES_LOCK:
+        namespace_watch = _WATCHES.get(namespace)
+        if namespace_watch is None:
+            namespace_watch = NamespaceWatch(namespace=namespace, api=api, app=current_app._get_current_object())
+            namespace_watch.start()
+            _WATCHES[namespace] = namespace_watch
+        return namespace_watch
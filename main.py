@@ -1,25 +1,64 @@
-import watchtower
 import logging
 
 from flask_cors import CORS
 from flask import Flask
 
+from api.metrics_api import metrics_blueprint
+from api.session_cache_api import session_cache_blueprint
 from api.session_delete_api import session_blueprint
-from commons.env_info import HOST, PORT, DEBUG_MODE, ORG_NAME, LOG_LEVEL, LOG_GROUP_NAME, LOG_FORMAT
+from commons.env_info import HOST, PORT, DEBUG_MODE, NAMESPACES, LOG_LEVEL, POD_INFORMER, ORPHAN_REAPER, \
+    validate_settings
+from commons.logging_setup import setup_logging
+from helpers.artifact_spool import start_artifact_uploads
+from k8s import k8s_client
+from methods.orphan_reaper import start_orphan_reaper
+from methods.teardown_journal import start_journal_maintenance
 
-app = Flask(__name__)
-CORS(app)
 
+def create_app() -> Flask:
+    """
+        Builds the application. Background threads (pod informer, teardown workers, artifact uploads,
+        journal recovery, orphan reaper) are started here, so production servers must load the app in
+        each worker process, after forking.
 
-logging.basicConfig(level=LOG_LEVEL)
-handler = watchtower.CloudWatchLogHandler(log_group_name=LOG_GROUP_NAME, log_stream_name=ORG_NAME)
-handler.setFormatter(
-    logging.Formatter(fmt=LOG_FORMAT))
-app.logger.addHandler(handler)
+        Kubernetes, S3 and CloudWatch clients are created on first use, not here.
 
+        :return configured Flask app
+        :rtype: Flask
+        :raises ValueError: the configuration is invalid and SETTINGS_STRICT is set
+    """
+    flask_app = Flask(__name__)
+    CORS(flask_app)
 
-app.register_blueprint(session_blueprint)
+    logging.basicConfig(level=LOG_LEVEL)
+    setup_logging(flask_app.logger)
+    for problem in validate_settings():
+        flask_app.logger.error(f"Configuration problem: {problem}")
+
+    flask_app.register_blueprint(session_blueprint)
+    flask_app.register_blueprint(metrics_blueprint)
+    flask_app.register_blueprint(session_cache_blueprint)
+
+    if POD_INFORMER:
+        with flask_app.app_context():
+            for namespace in NAMESPACES:
+                k8s_client.start_pod_informer(namespace=namespace)
+
+    # Uploads spooled artifacts, including those a previous process left behind.
+    start_artifact_uploads(flask_app)
+
+    # Resumes teardowns a previous (crashed or restarted) process left unfinished.
+    start_journal_maintenance(flask_app)
+
+    if ORPHAN_REAPER:
+        start_orphan_reaper(flask_app, namespaces=NAMESPACES)
+
+    return flask_app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':
+    # Development server only, production runs `gunicorn -c gunicorn.conf.py main:app`.
     app.run(host=HOST, port=PORT, debug=DEBUG_MODE)
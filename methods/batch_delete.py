@@ -0,0 +1,168 @@
+"""
+    Methods to tear down many sessions in one request
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import threading
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from flask import current_app
+
+from commons import env_info
+from commons.base_response import BaseResponse
+from commons.static_messages import SESSION_NOT_DELETED
+from helpers.utils import retry_func, update_session
+from k8s import k8s_client
+from methods.delete_session import delete_session
+
+
+_BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=env_info.BATCH_DELETE_CONCURRENCY, thread_name_prefix="batch-delete")
+
+
+class StatusUpdateSender:
+    """
+        Sends the status update of each batch item as soon as that item is torn down. Items sending the
+        same update (url and payload) send it once, the others wait for and reuse the result of the first.
+    """
+
+    def __init__(self):
+        self._sent: t.Dict[t.Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def send(self, update_url: str, status_data: t.Dict[str, t.Any]) -> bool:
+        """
+            :param : update_url: url of the backend status update
+            :type: update_url: str
+            :param : status_data: status update payload
+            :type: status_data: dict
+            :return whether the backend accepted the update
+            :rtype: bool
+        """
+        key = (update_url, json.dumps(status_data, sort_keys=True, default=str))
+        with self._lock:
+            future = self._sent.get(key)
+            if future is not None:
+                sender = False
+            else:
+                sender = True
+                future = self._sent[key] = Future()
+        if not sender:
+            return future.result()
+
+        try:
+            res = retry_func(func=update_session,
+                             retry_limit=env_info.FUNC_RETRY_LIMIT,
+                             pause_time=env_info.FUNC_RETRY_PAUSE_TIME,
+                             url=update_url,
+                             data=status_data)
+            future.set_result(res is not None)
+        except Exception as err:
+            current_app.logger.error(f"Status update to {update_url} failed: {err}")
+            future.set_result(False)
+        return future.result()
+
+
+def validate_batch_item(item: t.Any) -> str | None:
+    """
+        :param : item: one entry of the batch payload
+        :type: item: dict
+        :return validation error message, None when the entry is valid
+        :rtype: str/None
+    """
+    if not isinstance(item, dict):
+        return "Entry must be an object."
+    if not item.get("pod_name"):
+        return "`pod_name` is required."
+    if not item.get("session_id") and not item.get("request_id"):
+        return "One of `session_id` or `request_id` is required."
+    if item.get("namespace") and item["namespace"] not in k8s_client.served_namespaces():
+        return f"Namespace `{item['namespace']}` is not served by this instance."
+    return None
+
+
+def batch_delete_sessions(items: t.List[t.Dict[str, t.Any]]) -> t.List[t.Dict[str, t.Any]]:
+    """
+        :param : items: list of {pod_name, session_id|request_id, delete_type, namespace (optional)}
+        :type: items: list
+        :return per-item results, in request order
+        :rtype: list
+    """
+    current_app.logger.info(f"batch_delete_sessions called with {len(items)} entries")
+    app = current_app._get_current_object()
+    status_sender = StatusUpdateSender()
+    results: t.List[t.Dict[str, t.Any] | None] = [None] * len(items)
+    futures = {}
+    seen_pods = {}
+
+    for index, item in enumerate(items):
+        error = validate_batch_item(item)
+        if error is not None:
+            results[index] = {"index": index, "status": "invalid", "error": error}
+            continue
+
+        pod_name = item["pod_name"]
+        session_id = item.get("session_id")
+        if session_id and "firefox" in pod_name:
+            session_id = "".join(session_id.split("-"))
+
+        result = {
+            "index": index,
+            "pod_name": pod_name,
+            "namespace": item.get("namespace"),
+            "session_id": session_id,
+            "request_id": None if session_id else item.get("request_id"),
+            "delete_type": item.get("delete_type"),
+        }
+        results[index] = result
+
+        pod_key = (result["namespace"], pod_name)
+        if pod_key in seen_pods:
+            result["status"] = "duplicate"
+            result["duplicate_of"] = seen_pods[pod_key]
+            continue
+        seen_pods[pod_key] = index
+
+        futures[index] = _BATCH_EXECUTOR.submit(contextvars.copy_context().run, _delete_item, app, result,
+                                                status_sender)
+
+    for index, future in futures.items():
+        future.result()
+
+    for result in results:
+        if result.get("status") == "duplicate":
+            result.update({key: value for key, value in results[result["duplicate_of"]].items()
+                           if key in ("msg", "error", "status_updated")})
+
+    return results
+
+
+def _delete_item(app, result: t.Dict[str, t.Any], status_sender: StatusUpdateSender) -> None:
+    deferred_updates = []
+
+    def defer_status_update(update_url, status_data, on_sent):
+        deferred_updates.append((update_url, status_data, on_sent))
+
+    with app.app_context():
+        base_response = BaseResponse()
+        try:
+            delete_session(base_response=base_response, pod_name=result["pod_name"], namespace=result["namespace"],
+                           session_id=result["session_id"], request_id=result["request_id"],
+                           delete_type=result["delete_type"], defer_status_update=defer_status_update)
+            result["status"] = "deleted"
+        except Exception as err:
+            current_app.logger.error(f"Batch delete failed for pod_name: {result['pod_name']}: {err}")
+            result["status"] = "failed"
+            result["error"] = str(err)
+            base_response.msg = SESSION_NOT_DELETED
+        result["msg"] = base_response.msg
+
+        # Sent once this item's pod is gone, without waiting for the rest of the batch.
+        for update_url, status_data, on_sent in deferred_updates:
+            result["status_updated"] = status_sender.send(update_url, status_data)
+            # Lets delete_session journal the update as done, or failed.
+            if on_sent is not None:
+                on_sent(result["status_updated"])
@@ -4,23 +4,80 @@
 
 from __future__ import annotations
 
-import inspect
-from datetime import datetime
+import contextlib
+import sqlite3
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
 
+import urllib3
 from flask import current_app
-from commons import env_info
+from kubernetes.client.exceptions import ApiException
+from commons import env_info, metrics
 from k8s import k8s_client
 
+from commons.base_response import BaseResponse
 from commons.static_messages import SESSION_DELETED_SUCCESSFULLY, SESSION_NOT_DELETED
 from helpers.utils import get_session_deleted_response, update_session, get_endpoint_api, upload_to_s3, \
-    get_delete_type, retry_func
+    upload_stream_to_s3, get_delete_type, retry_func
 from helpers.utils import get_generated_urls
+from commons.logging_setup import log_context
+from helpers.artifact_spool import SpoolFull, get_artifact_spool
+from helpers.retry import deadline_scope, retry_tally
+from helpers.session_cache import get_session_cache
+from helpers.singleflight import ROLE_LEADER, SingleFlight
+from helpers.step_graph import Step, StepGraph
+from helpers.tracing import span
+from methods.teardown_journal import STATUS_COMPLETED, STATUS_FAILED, get_journal
 
 
-def delete_session(pod_name: str, session_id: str = None, request_id: str = None, delete_type: str = None, base_response = None):
+# The step graph is at most 2 steps wide. Unless TEARDOWN_STEP_WORKERS is set, the pool has room for
+# every thread that can run a teardown at once (request threads, async workers, batch workers, reaper
+# workers and journal recovery), so interactive teardowns never queue behind the slow steps of a batch.
+_MAX_PARALLEL_STEPS = 2
+_STEP_WORKERS = env_info.TEARDOWN_STEP_WORKERS or _MAX_PARALLEL_STEPS * (
+    env_info.GUNICORN_THREADS + env_info.TEARDOWN_WORKERS + env_info.BATCH_DELETE_CONCURRENCY +
+    env_info.ORPHAN_REAPER_CONCURRENCY + 1)
+_STEP_EXECUTOR = ThreadPoolExecutor(max_workers=_STEP_WORKERS, thread_name_prefix="teardown-step")
+
+TEARDOWN_SECONDS = metrics.histogram("teardown_duration_seconds", "End-to-end teardown latency.",
+                                     ("delete_type", "outcome"))
+TEARDOWN_STEP_SECONDS = metrics.histogram("teardown_step_seconds", "Teardown latency per step.", ("step",))
+TEARDOWN_FAILURES = metrics.counter("teardown_failures_total", "Failed teardowns by delete type and failed step.",
+                                    ("delete_type", "step"))
+TEARDOWN_RETRIES = metrics.counter("teardown_retries_total", "Retries made during teardowns by delete type.",
+                                   ("delete_type",))
+TEARDOWNS_IN_FLIGHT = metrics.gauge("teardowns_in_flight", "Teardowns currently running.")
+
+_TEARDOWN_FLIGHTS = SingleFlight(group="teardown", ttl=env_info.TEARDOWN_DEDUP_TTL)
+
+# Steps with side effects, skipped when a journaled teardown is resumed after they completed. The fetch
+# steps always run again since later steps need their results.
+RESUMABLE_STEPS = ("stop_recording", "ship_logs", "update_status", "delete_pod")
+
+
+class TeardownFailed(Exception):
+    """
+        A teardown step failed, the step's error is the __cause__.
     """
+
+    def __init__(self, message: str, step: str | None):
+        super().__init__(message)
+        self.step = step
+
+
+def delete_session(pod_name: str, session_id: str = None, request_id: str = None, delete_type: str = None, base_response = None,
+                   defer_status_update: t.Callable[[str, t.Dict[str, t.Any], t.Callable[[bool], None]], None] = None,
+                   journal_job_id: str = None, completed_steps: t.Sequence[str] = (), namespace: str = None):
+    """
+        Concurrent calls for the same pod wait on the running teardown and share its outcome;
+        calls within TEARDOWN_DEDUP_TTL seconds of a successful teardown are answered from cache.
+
         :param : pod_name: name of k8s pod
         :type: pod_name: str
+        :param : namespace: namespace of the pod, resolved by k8s_client.resolve_namespace when None
+        :type: namespace: str
         :param : session_id: webdriver session_id from API URI
         :type: session_id: str
         :param : request_id: request_id from API URI
@@ -29,83 +86,291 @@ def delete_session(pod_name: str, session_id: str = None, request_id: str = None
         :type: delete_type: str
         :param : base_response:  Base Response object{data:{...}, msg:"...", status: ...}
         :type: base_response: json object
+        :param : defer_status_update: when given, called with (update_url, status_data, on_sent) instead of
+                 sending the status update, so callers can coalesce updates. The caller must call
+                 on_sent(sent) once the update was sent or given up; until then the journal keeps the
+                 teardown running, so a restart resends the update.
+        :type: defer_status_update: Callable function
+        :param : journal_job_id: journal entry of a teardown being resumed or queued, a new entry is started
+                 otherwise. When the call is coalesced with another teardown the entry is finished with the
+                 shared outcome.
+        :type: journal_job_id: str
+        :param : completed_steps: steps the resumed teardown already completed
+        :type: completed_steps: list
+        :return seconds spent in each teardown step
+        :rtype: dict
+    """
+    led = threading.Event()
+
+    def run():
+        led.set()
+        journal, job_id = _journal_begin(journal_job_id, pod_name, namespace, session_id, request_id, delete_type)
+        deferred = threading.Event()
+        outcome = {"status": STATUS_FAILED}
+
+        def journal_step(step):
+            if job_id is not None:
+                try:
+                    journal.record_step(job_id, step)
+                except sqlite3.Error as err:
+                    current_app.logger.warning(f"Couldn't journal step `{step}` for pod_name: {pod_name}: {err}")
+
+        def record_step(step):
+            # A deferred status update is journaled once the caller actually sent it.
+            if step != "update_status" or not deferred.is_set():
+                journal_step(step)
+
+        def on_sent(sent):
+            if job_id is None:
+                return
+            if sent:
+                journal_step("update_status")
+                _journal_finish(journal, job_id, outcome["status"])
+            else:
+                _journal_finish(journal, job_id, STATUS_FAILED)
+
+        def defer(update_url, status_data):
+            deferred.set()
+            defer_status_update(update_url, status_data, on_sent)
+
+        leader_response = BaseResponse()
+        try:
+            durations = _delete_session(pod_name=pod_name, namespace=namespace, session_id=session_id,
+                                        request_id=request_id,
+                                        delete_type=delete_type, base_response=leader_response,
+                                        defer_status_update=defer if defer_status_update is not None else None,
+                                        skip_steps=[step for step in completed_steps if step in RESUMABLE_STEPS],
+                                        on_step_done=record_step)
+            outcome["status"] = STATUS_COMPLETED
+        finally:
+            if job_id is not None and not deferred.is_set():
+                _journal_finish(journal, job_id, outcome["status"])
+        return leader_response.data, leader_response.msg, durations
+
+    status = STATUS_FAILED
+    try:
+        namespace = k8s_client.resolve_namespace(pod_name, namespace)
+        (data, msg, durations), role = _TEARDOWN_FLIGHTS.do((namespace, pod_name), run)
+        status = STATUS_COMPLETED
+    except Exception:
+        base_response.data = get_session_deleted_response()
+        base_response.msg = SESSION_NOT_DELETED
+        raise
+    finally:
+        # Only run() journals, so an entry given to a follower, a cached answer or a call that failed
+        # before running is finished here; left running it would be resumed after a restart.
+        if journal_job_id is not None and not led.is_set():
+            _journal_finish_given(journal_job_id, status)
+
+    if role != ROLE_LEADER:
+        current_app.logger.info(f"Duplicate teardown for pod_name: {pod_name} answered as {role}.")
+    base_response.data = data
+    base_response.msg = msg
+    return durations
+
+
+def _journal_begin(job_id: str | None, pod_name: str, namespace: str, session_id: str, request_id: str,
+                   delete_type: str):
+    """
+        :return (journal, job id), both None when journaling is disabled or the journal can't be written
+        :rtype: tuple
     """
-    current_app.logger.info(f"Function Name ==>> {inspect.stack()[0][3]}")
-    current_app.logger.info(f"deleting pod name : {pod_name}")
-    current_app.logger.info(f"pod_name: {pod_name}, session_id: {session_id}, request_id: {request_id}, delete_type: {delete_type}")
+    try:
+        journal = get_journal()
+        if journal is None:
+            return None, None
+        if job_id is None:
+            job_id = journal.begin(pod_name=pod_name, namespace=namespace, session_id=session_id,
+                                   request_id=request_id, delete_type=delete_type)
+        return journal, job_id
+    except sqlite3.Error as err:
+        current_app.logger.warning(f"Couldn't journal teardown for pod_name: {pod_name}: {err}")
+        return None, None
+
 
-    session_data = {}
+def _journal_finish(journal, job_id: str, status: str) -> None:
+    try:
+        journal.finish(job_id, status)
+    except sqlite3.Error as err:
+        current_app.logger.warning(f"Couldn't mark journaled teardown {job_id} as {status}: {err}")
 
-    session_details_url, update_url = get_generated_urls(session_id=session_id, request_id=request_id)
-    status_data = get_delete_type(delete_type=delete_type)
 
+def _journal_finish_given(job_id: str, status: str) -> None:
     try:
-        pod = k8s_client.get_pod(namespace=env_info.ORG_NAME, pod_name=pod_name)
-        pod_ip = k8s_client.get_pod_ip(pod)
+        journal = get_journal()
+    except sqlite3.Error as err:
+        current_app.logger.warning(f"Couldn't mark journaled teardown {job_id} as {status}: {err}")
+        return
+    if journal is not None:
+        _journal_finish(journal, job_id, status)
+
+
+def _delete_session(pod_name: str, namespace: str, session_id: str = None, request_id: str = None, delete_type: str = None, base_response = None,
+                    defer_status_update: t.Callable[[str, t.Dict[str, t.Any]], None] = None,
+                    skip_steps: t.Sequence[str] = (), on_step_done: t.Callable[[str], None] = None):
+    """
+        Runs the teardown step graph, see delete_session.
+    """
+    with log_context(namespace=namespace, pod_name=pod_name, session_id=session_id, request_id=request_id), \
+            span("delete_session", session_id=session_id, request_id=request_id, namespace=namespace,
+                 pod_name=pod_name, delete_type=delete_type):
+        current_app.logger.info(f"deleting pod name : {pod_name}")
+        current_app.logger.info(f"pod_name: {pod_name}, session_id: {session_id}, request_id: {request_id}, delete_type: {delete_type}")
+
+        session_details_url, update_url = get_generated_urls(session_id=session_id, request_id=request_id)
+        status_data = get_delete_type(delete_type=delete_type)
+
+        def fetch_pod(results):
+            pod = k8s_client.get_pod(namespace=namespace, pod_name=pod_name)
+            pod_ip = k8s_client.get_pod_ip(pod)
+            current_app.logger.info(f"Pod Name: {pod_name} && Pod IP : {pod_ip}, session_id: {session_id}, request_id: {request_id}")
+            return pod_ip
 
-        current_app.logger.info(f"Pod Name: {pod_name} && Pod IP : {pod_ip}, session_id: {session_id}, request_id: {request_id}")
+        session_cache = get_session_cache()
 
-        current_app.logger.info(f"/get-session-details api called with pod_name: {pod_name}")
-        get_session_details_res = retry_func(func=get_endpoint_api,
-                                             retry_limit=env_info.FUNC_RETRY_LIMIT,
-                                             pause_time=env_info.FUNC_RETRY_PAUSE_TIME,
-                                             url=session_details_url)
+        def fetch_session_details(results):
+            if session_cache is not None:
+                session_data = session_cache.get(session_id=session_id, request_id=request_id)
+                if session_data is not None:
+                    current_app.logger.info(f"Session data from cache : {session_data}")
+                    return session_data
+
+            current_app.logger.info(f"/get-session-details api called with pod_name: {pod_name}")
+            get_session_details_res = retry_func(func=get_endpoint_api,
+                                                 retry_limit=env_info.FUNC_RETRY_LIMIT,
+                                                 pause_time=env_info.FUNC_RETRY_PAUSE_TIME,
+                                                 url=session_details_url)
+            if get_session_details_res is None:
+                raise Exception(f"Couldn't fetch session details for pod_name: {pod_name}")
 
-        if get_session_details_res.status_code == 200:
             get_session_details_res = get_session_details_res.json()
             session_data = get_session_details_res["data"]
             current_app.logger.info(f"Session data from backend : {session_data}")
+            current_app.logger.info(get_session_details_res["msg"])
+            return session_data
+
+        def stop_recording(results):
+            if not results["fetch_session_details"].get("enable_video"):
+                return None
+
+            current_app.logger.info(f"/stop-recording api called with pod_name: {pod_name}")
+            stop_recording_url = f"http://{results['fetch_pod']}:{env_info.SIDECAR_PORT}/stop-recording"
 
-            if session_data["enable_video"]:
-                current_app.logger.info(f"/stop-recording api called with pod_name: {pod_name}")
-                stop_recording_url = f"http://{pod_ip}:9092/stop-recording"
+            recording_res = retry_func(func=get_endpoint_api,
+                                       retry_limit=env_info.FUNC_RETRY_LIMIT,
+                                       pause_time=env_info.FUNC_RETRY_PAUSE_TIME,
+                                       url=stop_recording_url,
+                                       target="pod_sidecar",
+                                       timeout=(env_info.HTTP_CONNECT_TIMEOUT, env_info.SIDECAR_READ_TIMEOUT))
 
-                start_time = datetime.now()
+            if recording_res is not None and recording_res.status_code == 200:
+                current_app.logger.info("Video recording successfully stopped.")
+            else:
+                current_app.logger.info("Couldn't stop video recorder.")
+            return recording_res
 
-                recording_res = retry_func(func=get_endpoint_api,
-                                           retry_limit=env_info.FUNC_RETRY_LIMIT,
-                                           pause_time=env_info.FUNC_RETRY_PAUSE_TIME,
-                                           url=stop_recording_url)
-                total_time_diff = (datetime.now() - start_time).total_seconds()
-                current_app.logger.info(f"Total time for video to stop and upload : {total_time_diff}")
+        def ship_logs(results):
+            session_data = results["fetch_session_details"]
+            if not session_data.get("enable_logs"):
+                return None
 
-                if recording_res.status_code == 200:
-                    current_app.logger.info("Video recording successfully stopped.")
-                else:
-                    current_app.logger.info("Couldn't stop video recorder.")
-        current_app.logger.info(get_session_details_res["msg"])
+            # The pod only has to live until its logs are on local disk, the upload happens later. An
+            # unusable spool (full, or a directory that can't be created) or a log stream that breaks off
+            # falls back to a direct upload; spool() discards the partial entry. Like the direct upload,
+            # this never fails the step, update_status and delete_pod depend on it.
+            try:
+                spool = get_artifact_spool()
+                if spool is not None:
+                    with contextlib.closing(k8s_client.stream_pod_logs(
+                            namespace=namespace, pod_name=pod_name, container_name="browser",
+                            chunk_size=env_info.LOG_STREAM_CHUNK_SIZE)) as log_chunks:
+                        spooled_bytes = spool.spool(key=session_data["log_name"], chunks=log_chunks,
+                                                    compress=env_info.LOG_COMPRESSION)
+                    current_app.logger.info(f"Spooled {spooled_bytes} bytes of logs for pod_name: {pod_name}, "
+                                            f"upload deferred")
+                    return {"spooled_bytes": spooled_bytes}
+            except (SpoolFull, OSError, ApiException, urllib3.exceptions.HTTPError) as err:
+                current_app.logger.warning(f"Couldn't spool logs for pod_name: {pod_name}, uploading "
+                                           f"directly: {err}")
 
-        if "enable_logs" in session_data and session_data["enable_logs"]:
-            start_time = datetime.now()
-            logs_data = k8s_client.get_pod_logs(namespace=env_info.ORG_NAME, pod_name=pod_name, container_name="browser")
+            if env_info.LOG_STREAMING:
+                current_app.logger.info(f"s3 multipart upload called for pod_name: {pod_name}")
+                log_chunks = k8s_client.stream_pod_logs(namespace=namespace, pod_name=pod_name,
+                                                        container_name="browser", chunk_size=env_info.LOG_STREAM_CHUNK_SIZE)
+                return upload_stream_to_s3(key=session_data["log_name"], chunks=log_chunks,
+                                           compress=env_info.LOG_COMPRESSION, part_size=env_info.S3_PART_SIZE)
+
+            start_time = time.monotonic()
+            logs_data = k8s_client.get_pod_logs(namespace=namespace, pod_name=pod_name, container_name="browser")
+            fetched_time = time.monotonic()
+            TEARDOWN_STEP_SECONDS.observe(fetched_time - start_time, step="log_fetch")
 
             current_app.logger.info(f"s3 put_object called for pod_name: {pod_name}")
             upload_to_s3(key=session_data["log_name"], data=logs_data)
-            total_time_diff = (datetime.now() - start_time).total_seconds()
-            current_app.logger.info(f"Total time to fetch logs and upload : {total_time_diff}")
+            TEARDOWN_STEP_SECONDS.observe(time.monotonic() - fetched_time, step="s3_upload")
 
-        current_app.logger.info(f"Calling update_session. pod_name: {pod_name}")
+        def update_status(results=None):
+            if defer_status_update is not None:
+                return defer_status_update(update_url, status_data)
 
-        retry_func(func=update_session,
-                   retry_limit=env_info.FUNC_RETRY_LIMIT,
-                   pause_time=env_info.FUNC_RETRY_PAUSE_TIME,
-                   url=update_url,
-                   data=status_data)
+            current_app.logger.info(f"Calling update_session. pod_name: {pod_name}")
+            return retry_func(func=update_session,
+                              retry_limit=env_info.FUNC_RETRY_LIMIT,
+                              pause_time=env_info.FUNC_RETRY_PAUSE_TIME,
+                              url=update_url,
+                              data=status_data)
 
-        k8s_client.delete_pod(namespace=env_info.ORG_NAME, pod_name=pod_name)
+        def delete_pod(results):
+            k8s_client.delete_pod(namespace=namespace, pod_name=pod_name)
 
-        base_response.data = get_session_deleted_response()
-        base_response.msg = SESSION_DELETED_SUCCESSFULLY
-        current_app.logger.info(f"session with pod name: {pod_name} successfully deleted.")
+        graph = StepGraph(steps=[
+            Step("fetch_pod", fetch_pod),
+            Step("fetch_session_details", fetch_session_details),
+            Step("stop_recording", stop_recording, depends_on=("fetch_pod", "fetch_session_details")),
+            Step("ship_logs", ship_logs, depends_on=("fetch_pod", "fetch_session_details")),
+            Step("update_status", update_status, depends_on=("stop_recording", "ship_logs")),
+            Step("delete_pod", delete_pod, depends_on=("stop_recording", "ship_logs")),
+        ], executor=_STEP_EXECUTOR, skip=skip_steps, on_step_done=on_step_done)
+        if graph.skipped:
+            current_app.logger.info(f"Resuming teardown for pod_name: {pod_name}, skipping completed steps: "
+                                    f"{sorted(graph.skipped)}")
 
-    except Exception as err:
-        current_app.logger.error(err)
-        retry_func(func=update_session,
-                   retry_limit=env_info.FUNC_RETRY_LIMIT,
-                   pause_time=env_info.FUNC_RETRY_PAUSE_TIME,
-                   url=update_url,
-                   data=status_data)
+        delete_type_label = status_data["status"]
+        outcome = "failed"
+        start_time = time.monotonic()
+        TEARDOWNS_IN_FLIGHT.inc()
 
-        base_response.data = get_session_deleted_response()
-        base_response.msg = SESSION_NOT_DELETED
-        raise f"BaseException for pod_name: {pod_name}, session_id: {session_id}, request_id: {request_id}"
+        # Retries of every step, and the final status update, share one time budget.
+        with deadline_scope(env_info.TEARDOWN_DEADLINE), retry_tally() as retries:
+            try:
+                graph.run()
+                if session_cache is not None:
+                    session_cache.discard(session_id=session_id, request_id=request_id)
+
+                base_response.data = get_session_deleted_response()
+                base_response.msg = SESSION_DELETED_SUCCESSFULLY
+                outcome = "succeeded"
+                current_app.logger.info(f"session with pod name: {pod_name} successfully deleted.")
+                return graph.durations()
+
+            except Exception as err:
+                current_app.logger.error(f"Step `{graph.failed_step}` failed for pod_name: {pod_name}: {err}")
+                TEARDOWN_FAILURES.inc(delete_type=delete_type_label, step=graph.failed_step or "setup")
+                if "update_status" not in graph.results:
+                    update_status()
+
+                base_response.data = get_session_deleted_response()
+                base_response.msg = SESSION_NOT_DELETED
+                raise TeardownFailed(f"Step `{graph.failed_step or 'setup'}` failed for pod_name: {pod_name}, "
+                                     f"session_id: {session_id}, request_id: {request_id}: {err}",
+                                     step=graph.failed_step) from err
+
+            finally:
+                TEARDOWNS_IN_FLIGHT.dec()
+                TEARDOWN_SECONDS.observe(time.monotonic() - start_time, delete_type=delete_type_label, outcome=outcome)
+                TEARDOWN_RETRIES.inc(retries.count, delete_type=delete_type_label)
+                durations = graph.durations()
+                for step_name, seconds in durations.items():
+                    TEARDOWN_STEP_SECONDS.observe(seconds, step=step_name)
+                current_app.logger.info(f"Teardown step timings for pod_name: {pod_name} : {durations}, "
+                                        f"critical path: {' -> '.join(graph.critical_path())}")
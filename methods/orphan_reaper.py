@@ -0,0 +1,200 @@
+"""
+    Background reconciler deleting browser pods whose sessions already ended on the backend
+"""
+
+from __future__ import annotations
+
+import contextvars
+import datetime
+import fcntl
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask, current_app
+from kubernetes.client import V1Pod
+
+from commons import env_info, metrics
+from commons.base_response import BaseResponse
+from helpers.circuit_breaker import DependencyUnavailable
+from helpers.rate_limiter import TokenBucket
+from helpers.utils import get_endpoint_api, get_generated_urls
+from k8s import k8s_client
+from methods.delete_session import delete_session
+
+
+REAPER_PODS = metrics.counter("orphan_reaper_pods_total", "Pods examined by the orphan reaper by outcome.", ("outcome",))
+RECLAIMED_POD_HOURS = metrics.counter("orphan_reaper_reclaimed_pod_hours_total",
+                                      "Age in hours of the orphaned pods deleted by the reaper.")
+REAPER_CYCLE_SECONDS = metrics.histogram("orphan_reaper_cycle_seconds", "Duration of one orphan reaper pass.")
+
+SESSION_ACTIVE = "active"
+SESSION_STALE = "stale"
+SESSION_UNKNOWN = "unknown_session"
+SESSION_CHECK_FAILED = "check_failed"
+
+
+class OrphanReaper:
+    """
+        Lists the pods of each namespace page by page and tears down those whose session the backend reports
+        as finished (ORPHAN_REAPER_STALE_STATUSES). Pods of sessions unknown to the backend are only counted,
+        delete_session needs the session details to ship logs and update the status. The namespaces share
+        one rate limit and worker pool.
+    """
+
+    def __init__(self, app: Flask, namespaces: t.Sequence[str]):
+        self.app = app
+        self.namespaces = tuple(namespaces)
+        self.bucket = TokenBucket(rate=env_info.ORPHAN_REAPER_RATE, burst=env_info.ORPHAN_REAPER_CONCURRENCY)
+        self.executor = ThreadPoolExecutor(max_workers=env_info.ORPHAN_REAPER_CONCURRENCY,
+                                           thread_name_prefix="orphan-reaper")
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="orphan-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        with self.app.app_context():
+            while not self._stop.wait(env_info.ORPHAN_REAPER_INTERVAL):
+                try:
+                    with open(env_info.ORPHAN_REAPER_LOCK_PATH, "a") as lock_file:
+                        # Only one worker process of the pod reaps at a time.
+                        try:
+                            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except BlockingIOError:
+                            continue
+                        for namespace in self.namespaces:
+                            self._reap_namespace(namespace)
+                except Exception as err:
+                    current_app.logger.warning(f"Orphan reaper pass failed: {err}")
+
+    def _reap_namespace(self, namespace: str) -> None:
+        try:
+            stats = self.reap_once(namespace)
+            current_app.logger.info(f"Orphan reaper pass in namespace {namespace} : {stats}")
+        except Exception as err:
+            current_app.logger.warning(f"Orphan reaper pass in namespace {namespace} failed: {err}")
+
+    def reap_once(self, namespace: str) -> t.Dict[str, int]:
+        """
+            :param : namespace: namespace of k8s
+            :type: namespace: str
+            :return number of examined pods by outcome
+            :rtype: dict
+        """
+        start_time = time.monotonic()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        futures = []
+        outcomes: t.Dict[str, int] = {}
+
+        def count(outcome):
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            REAPER_PODS.inc(outcome=outcome)
+
+        try:
+            for pod in k8s_client.list_pods(namespace=namespace,
+                                            label_selector=env_info.ORPHAN_REAPER_LABEL_SELECTOR,
+                                            page_size=env_info.ORPHAN_REAPER_PAGE_SIZE):
+                if pod.metadata.deletion_timestamp is not None:
+                    count("terminating")
+                    continue
+                age = (now - pod.metadata.creation_timestamp).total_seconds()
+                if age < env_info.ORPHAN_REAPER_MIN_AGE:
+                    count("too_young")
+                    continue
+                labels = pod.metadata.labels or {}
+                if not labels.get(env_info.ORPHAN_REAPER_SESSION_LABEL) and \
+                        not labels.get(env_info.ORPHAN_REAPER_REQUEST_LABEL):
+                    count("unlabelled")
+                    continue
+                context = contextvars.copy_context()
+                futures.append(self.executor.submit(context.run, self._reconcile, pod, age))
+        finally:
+            for future in futures:
+                try:
+                    count(future.result())
+                except Exception as err:
+                    current_app.logger.warning(f"Orphan reaper couldn't reconcile a pod: {err}")
+                    count(SESSION_CHECK_FAILED)
+            REAPER_CYCLE_SECONDS.observe(time.monotonic() - start_time)
+        return outcomes
+
+    def _reconcile(self, pod: V1Pod, age: float) -> str:
+        """
+            :return outcome for the pod
+            :rtype: str
+        """
+        with self.app.app_context():
+            pod_name = pod.metadata.name
+            labels = pod.metadata.labels or {}
+            session_id = labels.get(env_info.ORPHAN_REAPER_SESSION_LABEL)
+            request_id = labels.get(env_info.ORPHAN_REAPER_REQUEST_LABEL)
+
+            state, status = check_session(session_id=session_id, request_id=request_id)
+            if state != SESSION_STALE:
+                return state
+
+            if env_info.ORPHAN_REAPER_DRY_RUN:
+                current_app.logger.info(f"Orphan reaper would delete pod_name: {pod_name}, session status: {status}")
+                return SESSION_STALE
+
+            self.bucket.acquire()
+            current_app.logger.info(f"Orphan reaper deleting pod_name: {pod_name}, session status: {status}, "
+                                    f"age: {round(age)}s")
+            try:
+                delete_session(base_response=BaseResponse(), pod_name=pod_name, namespace=pod.metadata.namespace,
+                               session_id=session_id, request_id=request_id, delete_type=status)
+            except Exception as err:
+                current_app.logger.error(f"Orphan reaper couldn't delete pod_name: {pod_name}: {err}")
+                return "reap_failed"
+
+            RECLAIMED_POD_HOURS.inc(age / 3600)
+            return "reaped"
+
+
+def check_session(session_id: str = None, request_id: str = None) -> t.Tuple[str, str | None]:
+    """
+        :param : session_id: webdriver session_id from the pod label
+        :type: session_id: str
+        :param : request_id: request_id from the pod label
+        :type: request_id: str
+        :return (state, backend status) where state is active, stale, unknown_session or check_failed
+        :rtype: tuple
+    """
+    session_details_url, _ = get_generated_urls(session_id=session_id, request_id=request_id)
+    try:
+        res = get_endpoint_api(url=session_details_url)
+    except (requests.RequestException, DependencyUnavailable) as err:
+        current_app.logger.warning(f"Orphan reaper couldn't check session {session_id or request_id}: {err}")
+        return SESSION_CHECK_FAILED, None
+
+    if res.status_code == 404:
+        return SESSION_UNKNOWN, None
+    if res.status_code != 200:
+        return SESSION_CHECK_FAILED, None
+
+    status = (res.json().get("data") or {}).get("status")
+    if status in env_info.ORPHAN_REAPER_STALE_STATUSES:
+        return SESSION_STALE, status
+    return SESSION_ACTIVE, status
+
+
+def start_orphan_reaper(app: Flask, namespaces: t.Sequence[str]) -> OrphanReaper:
+    """
+        :param : app: flask application the reaper pushes an app context for
+        :type: app: Flask
+        :param : namespaces: namespaces of k8s to reap
+        :type: namespaces: list
+        :return the started reaper
+        :rtype: OrphanReaper
+    """
+    reaper = OrphanReaper(app=app, namespaces=namespaces)
+    reaper.start()
+    return reaper
@@ -0,0 +1,244 @@
+"""
+    Durable journal of teardown progress, recovered after restarts
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing as t
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, current_app
+
+from commons import env_info, metrics
+
+
+JOURNAL_RECOVERED = metrics.counter("teardown_journal_recovered_total", "Unfinished teardowns resumed by outcome.",
+                                    ("outcome",))
+JOURNAL_UNFINISHED = metrics.gauge("teardown_journal_unfinished", "Teardowns in the journal not yet finished.")
+
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS teardown_jobs (
+    job_id TEXT PRIMARY KEY,
+    pod_name TEXT NOT NULL,
+    namespace TEXT,
+    session_id TEXT,
+    request_id TEXT,
+    delete_type TEXT,
+    steps TEXT NOT NULL DEFAULT '[]',
+    status TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS teardown_jobs_status ON teardown_jobs (status, updated_at);
+CREATE TABLE IF NOT EXISTS journal_owners (
+    owner TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+class TeardownJournal:
+    """
+        SQLite (WAL mode) journal shared by the worker processes of one pod. Each process is an owner
+        with a heartbeat; running jobs of owners whose heartbeat stopped are claimed and resumed.
+    """
+
+    def __init__(self, path: str, heartbeat_interval: float, retention: float):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.heartbeat_interval = heartbeat_interval
+        self.retention = retention
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self.heartbeat()
+
+    def _execute(self, sql: str, params: t.Sequence[t.Any] = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(sql, params)
+
+    def heartbeat(self) -> None:
+        self._execute("INSERT OR REPLACE INTO journal_owners (owner, heartbeat_at) VALUES (?, ?)",
+                      (self.owner, time.time()))
+
+    def begin(self, pod_name: str, session_id: str = None, request_id: str = None, delete_type: str = None,
+              namespace: str = None, job_id: str = None) -> str:
+        """
+            :param : job_id: id of the entry, e.g. the id of the queued teardown job, generated when None
+            :type: job_id: str
+            :return id of the new journal entry
+            :rtype: str
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        self._execute("INSERT INTO teardown_jobs (job_id, pod_name, namespace, session_id, request_id, delete_type, "
+                      "status, owner, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                      (job_id, pod_name, namespace, session_id, request_id, delete_type, STATUS_RUNNING, self.owner,
+                       now, now))
+        return job_id
+
+    def record_step(self, job_id: str, step: str) -> None:
+        with self._lock:
+            row = self._connection.execute("SELECT steps FROM teardown_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            steps = json.loads(row[0])
+            if step not in steps:
+                steps.append(step)
+            self._connection.execute("UPDATE teardown_jobs SET steps = ?, updated_at = ? WHERE job_id = ?",
+                                     (json.dumps(steps), time.time(), job_id))
+
+    def discard(self, job_id: str) -> None:
+        self._execute("DELETE FROM teardown_jobs WHERE job_id = ?", (job_id,))
+
+    def finish(self, job_id: str, status: str) -> None:
+        self._execute("UPDATE teardown_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                      (status, time.time(), job_id))
+
+    def claim_orphaned(self) -> t.List[t.Dict[str, t.Any]]:
+        """
+            :return running jobs of owners without a recent heartbeat, now owned by this process
+            :rtype: list
+        """
+        alive_after = time.time() - 3 * self.heartbeat_interval
+        rows = self._execute(
+            "SELECT job_id, pod_name, namespace, session_id, request_id, delete_type, steps, owner FROM teardown_jobs "
+            "WHERE status = ? AND owner != ? AND owner NOT IN "
+            "(SELECT owner FROM journal_owners WHERE heartbeat_at > ?)",
+            (STATUS_RUNNING, self.owner, alive_after)).fetchall()
+
+        claimed = []
+        for job_id, pod_name, namespace, session_id, request_id, delete_type, steps, owner in rows:
+            cursor = self._execute("UPDATE teardown_jobs SET owner = ?, attempts = attempts + 1, updated_at = ? "
+                                   "WHERE job_id = ? AND owner = ? AND status = ?",
+                                   (self.owner, time.time(), job_id, owner, STATUS_RUNNING))
+            if cursor.rowcount == 1:
+                claimed.append({"job_id": job_id, "pod_name": pod_name, "namespace": namespace,
+                                "session_id": session_id, "request_id": request_id, "delete_type": delete_type,
+                                "steps": json.loads(steps)})
+        return claimed
+
+    def compact(self) -> int:
+        """
+            Drops finished entries older than the retention and owners that stopped heart-beating.
+
+            :return number of removed entries
+            :rtype: int
+        """
+        cutoff = time.time() - self.retention
+        removed = self._execute("DELETE FROM teardown_jobs WHERE status != ? AND updated_at < ?",
+                                (STATUS_RUNNING, cutoff)).rowcount
+        self._execute("DELETE FROM journal_owners WHERE heartbeat_at < ? AND owner NOT IN "
+                      "(SELECT owner FROM teardown_jobs WHERE status = ?)", (cutoff, STATUS_RUNNING))
+        self._execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        unfinished = self._execute("SELECT COUNT(*) FROM teardown_jobs WHERE status = ?", (STATUS_RUNNING,)).fetchone()
+        JOURNAL_UNFINISHED.set(unfinished[0])
+        return removed
+
+
+_JOURNAL: TeardownJournal | None = None
+_JOURNAL_LOCK = threading.Lock()
+
+
+def get_journal() -> TeardownJournal | None:
+    """
+        :return process wide journal, None when TEARDOWN_JOURNAL_PATH is not set. Recovering the teardowns of a
+                replaced pod needs the path on a persistent volume the new pod mounts.
+        :rtype: TeardownJournal/None
+    """
+    global _JOURNAL
+    if not env_info.TEARDOWN_JOURNAL_PATH:
+        return None
+    if _JOURNAL is None:
+        with _JOURNAL_LOCK:
+            if _JOURNAL is None:
+                _JOURNAL = TeardownJournal(path=env_info.TEARDOWN_JOURNAL_PATH,
+                                           heartbeat_interval=env_info.TEARDOWN_JOURNAL_HEARTBEAT,
+                                           retention=env_info.TEARDOWN_JOURNAL_RETENTION)
+    return _JOURNAL
+
+
+def start_journal_maintenance(app: Flask) -> None:
+    """
+        Starts the background thread that heart-beats, claims orphaned teardowns (left by a crashed or
+        restarted process) and compacts the journal. Claimed teardowns are resumed one at a time on a
+        separate recovery thread, so a slow recovery never delays the heartbeat and other workers don't
+        take this process for dead.
+
+        :param : app: flask application the threads push an app context for
+        :type: app: Flask
+    """
+    journal = get_journal()
+    if journal is None:
+        return
+
+    recovery = ThreadPoolExecutor(max_workers=1, thread_name_prefix="teardown-recovery")
+
+    def resume(job):
+        from methods.delete_session import delete_session
+
+        with app.app_context():
+            try:
+                _resume(journal, job, delete_session)
+            except Exception as err:
+                current_app.logger.warning(f"Resuming journaled teardown {job['job_id']} failed: {err}")
+
+    def run():
+        with app.app_context():
+            last_compaction = 0.0
+            while True:
+                try:
+                    journal.heartbeat()
+                    for job in journal.claim_orphaned():
+                        recovery.submit(resume, job)
+                    if time.monotonic() - last_compaction > env_info.TEARDOWN_JOURNAL_COMPACT_INTERVAL:
+                        removed = journal.compact()
+                        last_compaction = time.monotonic()
+                        current_app.logger.info(f"Teardown journal compacted, {removed} entries removed.")
+                except Exception as err:
+                    current_app.logger.warning(f"Teardown journal maintenance failed: {err}")
+                time.sleep(journal.heartbeat_interval)
+
+    threading.Thread(target=run, name="teardown-journal", daemon=True).start()
+
+
+def _resume(journal: TeardownJournal, job: t.Dict[str, t.Any], delete_session: t.Callable[..., t.Any]) -> None:
+    from commons.base_response import BaseResponse
+    from methods.delete_session import RESUMABLE_STEPS
+
+    if set(RESUMABLE_STEPS) <= set(job["steps"]):
+        journal.finish(job["job_id"], STATUS_COMPLETED)
+        return
+
+    current_app.logger.info(f"Resuming teardown {job['job_id']} for pod_name: {job['pod_name']}, "
+                            f"completed steps: {job['steps']}")
+    try:
+        delete_session(base_response=BaseResponse(), pod_name=job["pod_name"], namespace=job["namespace"],
+                       session_id=job["session_id"],
+                       request_id=job["request_id"], delete_type=job["delete_type"],
+                       journal_job_id=job["job_id"], completed_steps=job["steps"])
+        status = STATUS_COMPLETED
+    except Exception as err:
+        current_app.logger.error(f"Resumed teardown {job['job_id']} for pod_name: {job['pod_name']} failed: {err}")
+        status = STATUS_FAILED
+
+    # Already done by delete_session, unless the resumed call was coalesced with a running teardown.
+    journal.finish(job["job_id"], status)
+    JOURNAL_RECOVERED.inc(outcome=status)
@@ -0,0 +1,237 @@
+"""
+    Background work queue for asynchronous session teardown
+"""
+
+from __future__ import annotations
+
+import queue
+import sqlite3
+import threading
+import time
+import typing as t
+import uuid
+
+from flask import Flask, current_app
+
+from commons import env_info, metrics
+from commons.base_response import BaseResponse
+from methods.delete_session import delete_session
+from methods.teardown_journal import get_journal
+
+
+QUEUE_DEPTH = metrics.gauge("teardown_queue_depth", "Teardown jobs waiting in the queue.")
+QUEUE_WAIT_SECONDS = metrics.histogram("teardown_queue_wait_seconds", "Time jobs spend queued before a worker picks them up.")
+JOB_RUN_SECONDS = metrics.histogram("teardown_job_run_seconds", "Time workers spend running a teardown job.")
+JOBS_TOTAL = metrics.counter("teardown_jobs_total", "Teardown jobs by outcome.", ("outcome",))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+class TeardownJob:
+    def __init__(self, pod_name: str, session_id: str = None, request_id: str = None, delete_type: str = None,
+                 namespace: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.pod_name = pod_name
+        self.namespace = namespace
+        self.session_id = session_id
+        self.request_id = request_id
+        self.delete_type = delete_type
+        self.journal_job_id = None
+        self.status = JOB_QUEUED
+        self.msg = None
+        self.error = None
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.step_timings = None
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        return {
+            "job_id": self.job_id,
+            "pod_name": self.pod_name,
+            "namespace": self.namespace,
+            "session_id": self.session_id,
+            "request_id": self.request_id,
+            "delete_type": self.delete_type,
+            "status": self.status,
+            "msg": self.msg,
+            "error": self.error,
+            "enqueued_at": self.enqueued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "step_timings": self.step_timings,
+        }
+
+
+class TeardownQueue:
+    def __init__(self, max_size: int, workers: int, job_ttl: int):
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._workers = workers
+        self._job_ttl = job_ttl
+        self._jobs: t.Dict[str, TeardownJob] = {}
+        self._lock = threading.Lock()
+        self._threads: t.List[threading.Thread] = []
+        self._app: Flask | None = None
+        self._accepting = True
+
+    def start(self, app: Flask) -> None:
+        """
+            :param : app: flask application the workers push an app context for
+            :type: app: Flask
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._app = app
+            for index in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f"teardown-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, pod_name: str, session_id: str = None, request_id: str = None,
+               delete_type: str = None, namespace: str = None) -> TeardownJob | None:
+        """
+            :param : pod_name: name of k8s pod
+            :type: pod_name: str
+            :param : session_id: webdriver session_id from API URI
+            :type: session_id: str
+            :param : request_id: request_id from API URI
+            :type: request_id: str
+            :param : delete_type: type of deletion from API URI
+            :type: delete_type: str
+            :param : namespace: namespace from API URI, None to resolve it when the job runs
+            :type: namespace: str
+            :return queued job, None when the queue is full
+            :rtype: TeardownJob/None
+        """
+        if not self._accepting:
+            return None
+
+        self.start(current_app._get_current_object())
+        self._purge_finished()
+
+        job = TeardownJob(pod_name=pod_name, session_id=session_id, request_id=request_id, delete_type=delete_type,
+                          namespace=namespace)
+        # Journaled before the 202 goes out, so a job still queued when the process dies is resumed.
+        journal = self._journal_job(job)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            if job.journal_job_id is not None:
+                try:
+                    journal.discard(job.journal_job_id)
+                except sqlite3.Error as err:
+                    current_app.logger.warning(f"Couldn't discard journaled teardown {job.job_id}: {err}")
+            JOBS_TOTAL.inc(outcome="rejected")
+            return None
+
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return job
+
+    def _journal_job(self, job: TeardownJob):
+        """
+            :return the journal, None when journaling is disabled or the journal can't be written
+        """
+        try:
+            journal = get_journal()
+            if journal is not None:
+                job.journal_job_id = journal.begin(pod_name=job.pod_name, namespace=job.namespace,
+                                                   session_id=job.session_id, request_id=job.request_id,
+                                                   delete_type=job.delete_type, job_id=job.job_id)
+            return journal
+        except sqlite3.Error as err:
+            current_app.logger.warning(f"Couldn't journal teardown job {job.job_id}: {err}")
+            return None
+
+    def shutdown(self, timeout: float) -> bool:
+        """
+            Stops accepting jobs (callers fall back to synchronous teardown) and waits for queued and
+            running jobs to finish.
+
+            :param : timeout: max seconds to wait
+            :type: timeout: float
+            :return True when the queue drained in time
+            :rtype: bool
+        """
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+        return not self._queue.unfinished_tasks
+
+    def get(self, job_id: str) -> TeardownJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            in_progress = sum(1 for job in self._jobs.values() if job.status == JOB_RUNNING)
+            tracked = len(self._jobs)
+        return {
+            "depth": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "workers": len(self._threads),
+            "running": in_progress,
+            "tracked_jobs": tracked,
+            "wait_seconds": QUEUE_WAIT_SECONDS.samples().get((), {}),
+            "run_seconds": JOB_RUN_SECONDS.samples().get((), {}),
+        }
+
+    def _purge_finished(self) -> None:
+        expire_before = time.time() - self._job_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < expire_before]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                QUEUE_DEPTH.set(self._queue.qsize())
+                with self._app.app_context():
+                    self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job: TeardownJob) -> None:
+        job.started_at = time.time()
+        job.status = JOB_RUNNING
+        QUEUE_WAIT_SECONDS.observe(job.started_at - job.enqueued_at)
+
+        base_response = BaseResponse()
+        try:
+            job.step_timings = delete_session(base_response=base_response, pod_name=job.pod_name,
+                                              namespace=job.namespace, session_id=job.session_id, request_id=job.request_id,
+                                              delete_type=job.delete_type, journal_job_id=job.journal_job_id)
+            job.status = JOB_SUCCEEDED
+        except Exception as err:
+            current_app.logger.error(f"Teardown job {job.job_id} for pod_name: {job.pod_name} failed: {err}")
+            job.error = str(err)
+            job.status = JOB_FAILED
+
+        job.msg = base_response.msg
+        job.finished_at = time.time()
+        JOB_RUN_SECONDS.observe(job.finished_at - job.started_at)
+        JOBS_TOTAL.inc(outcome=job.status)
+
+
+_TEARDOWN_QUEUE = TeardownQueue(max_size=env_info.TEARDOWN_QUEUE_SIZE,
+                                workers=env_info.TEARDOWN_WORKERS,
+                                job_ttl=env_info.TEARDOWN_JOB_TTL)
+
+
+def get_teardown_queue() -> TeardownQueue:
+    """
+        :return process wide teardown queue
+        :rtype: TeardownQueue
+    """
+    return _TEARDOWN_QUEUE
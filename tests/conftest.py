@@ -0,0 +1,93 @@
+"""
+    Shared fixtures: the service is configured for the local fakes of benchmarks.fakes before any of
+    it is imported, since env_info reads the environment once, at its first import.
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+_BACKEND_PORT = _free_port()
+_SIDECAR_PORT = _free_port()
+
+os.environ.update({
+    "ORG_NAME": "test",
+    "STORAGE_BACKEND": "memory",
+    "BASE_URL": f"http://127.0.0.1:{_BACKEND_PORT}",
+    "BACKEND_URL": "api",
+    "SIDECAR_PORT": str(_SIDECAR_PORT),
+    "RETRY_LIMIT": "2",
+    "RETRY_PAUSE_TIME": "0",
+    "POD_WAIT_TIME": "5",
+    "LOG_LEVEL": "WARNING",
+    "LOG_GROUP_NAME": "",
+    "ASYNC_TEARDOWN": "false",
+    "POD_INFORMER": "false",
+    "TEARDOWN_DEDUP_TTL": "0",
+    "TEARDOWN_JOURNAL_PATH": "",
+    "ARTIFACT_OFFLOAD": "false",
+})
+
+import pytest  # noqa: E402
+from flask import Flask  # noqa: E402
+
+from benchmarks.fakes import FakeCoreV1Api, FakeHttpServer  # noqa: E402
+from helpers.storage import MemoryStorage, set_storage  # noqa: E402
+from k8s import k8s_client  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def backend() -> FakeHttpServer:
+    server = FakeHttpServer(port=_BACKEND_PORT).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def sidecar() -> FakeHttpServer:
+    server = FakeHttpServer(port=_SIDECAR_PORT).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app(backend, sidecar) -> Flask:
+    flask_app = Flask("tests")
+    with flask_app.app_context():
+        yield flask_app
+
+
+@pytest.fixture
+def k8s() -> FakeCoreV1Api:
+    api = FakeCoreV1Api(log_bytes=1024)
+    k8s_client.set_core_v1_api(api)
+    yield api
+    k8s_client.set_core_v1_api(None)
+
+
+@pytest.fixture
+def storage() -> MemoryStorage:
+    memory_storage = MemoryStorage()
+    set_storage(memory_storage)
+    yield memory_storage
+    set_storage(None)
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    from commons import env_info
+    from methods import teardown_journal
+
+    journal_ = teardown_journal.TeardownJournal(path=str(tmp_path / "journal.db"), heartbeat_interval=1,
+                                                retention=3600)
+    monkeypatch.setattr(env_info, "TEARDOWN_JOURNAL_PATH", journal_.path)
+    monkeypatch.setattr(teardown_journal, "_JOURNAL", journal_)
+    return journal_
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from methods import batch_delete
+from methods.batch_delete import StatusUpdateSender
+
+
+def test_status_updates_are_deduplicated_by_url_and_payload(app, monkeypatch):
+    sent = []
+
+    def fake_retry_func(func, retry_limit, pause_time, url, data):
+        sent.append((url, data))
+        return object()
+
+    monkeypatch.setattr(batch_delete, "retry_func", fake_retry_func)
+    sender = StatusUpdateSender()
+
+    assert sender.send("http://backend/status/s1", {"status": "completed"})
+    assert sender.send("http://backend/status/s1", {"status": "completed"})
+    assert sender.send("http://backend/status/s1", {"status": "timeout"})
+
+    assert sent == [("http://backend/status/s1", {"status": "completed"}),
+                    ("http://backend/status/s1", {"status": "timeout"})]
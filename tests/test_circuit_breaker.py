@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from helpers.circuit_breaker import CLOSED, HALF_OPEN, OPEN, BulkheadFullError, CircuitBreaker, CircuitOpenError
+
+
+def _fail():
+    raise ConnectionError("down")
+
+
+def _tripped_breaker(**kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker(name="test", min_calls=2, failure_ratio=0.5, open_seconds=0.2, **kwargs)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(_fail)
+    return breaker
+
+
+def test_failures_open_the_circuit_and_calls_fail_fast():
+    breaker = _tripped_breaker()
+    calls = []
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(calls.append, 1)
+    assert calls == []
+
+
+def test_successful_probe_closes_the_circuit():
+    breaker = _tripped_breaker()
+    time.sleep(0.25)
+
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls_in_window"] == 0
+
+
+def test_failed_probe_opens_the_circuit_again():
+    breaker = _tripped_breaker()
+    time.sleep(0.25)
+
+    with pytest.raises(ConnectionError):
+        breaker.call(_fail)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+
+
+def test_only_one_probe_runs_while_half_open():
+    breaker = _tripped_breaker()
+    time.sleep(0.25)
+    probing = threading.Event()
+    release = threading.Event()
+
+    def probe():
+        probing.set()
+        release.wait()
+
+    thread = threading.Thread(target=breaker.call, args=(probe,))
+    thread.start()
+    probing.wait()
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+    release.set()
+    thread.join()
+
+    assert breaker.state == CLOSED
+
+
+def test_breaker_without_trips_stays_closed():
+    breaker = CircuitBreaker(name="test", min_calls=2, failure_ratio=0.5, trips=False)
+    for _ in range(5):
+        with pytest.raises(ConnectionError):
+            breaker.call(_fail)
+
+    assert breaker.state == CLOSED
+
+
+def test_full_bulkhead_fails_fast():
+    breaker = CircuitBreaker(name="test", max_concurrent=1, bulkhead_wait=0.05)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        holding.set()
+        release.wait()
+
+    thread = threading.Thread(target=breaker.call, args=(hold,))
+    thread.start()
+    holding.wait()
+    with pytest.raises(BulkheadFullError):
+        breaker.call(lambda: "ok")
+    release.set()
+    thread.join()
+
+    assert breaker.call(lambda: "ok") == "ok"
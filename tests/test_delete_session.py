@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+import pytest
+import urllib3
+
+from benchmarks.fakes import Fault, FakeCoreV1Api
+from commons import env_info
+from commons.base_response import BaseResponse
+from commons.static_messages import SESSION_DELETED_SUCCESSFULLY
+from helpers import artifact_spool
+from helpers.artifact_spool import ArtifactSpool
+from helpers.singleflight import SingleFlight
+from k8s import k8s_client
+from methods import delete_session as delete_session_module
+from methods.delete_session import delete_session
+from methods.teardown_journal import STATUS_COMPLETED
+
+
+class _BrokenLogResponse:
+    def stream(self, amt=65536, decode_content=True):
+        yield b"first part of the log\n"
+        raise urllib3.exceptions.ProtocolError("Connection broken: IncompleteRead")
+
+    def release_conn(self):
+        pass
+
+
+class _BrokenLogStreamApi(FakeCoreV1Api):
+    def read_namespaced_pod_log(self, name, namespace, container=None, _preload_content=True, **kwargs):
+        if not _preload_content:
+            self._call("read_namespaced_pod_log", name)
+            return _BrokenLogResponse()
+        return super().read_namespaced_pod_log(name, namespace, container=container, **kwargs)
+
+
+def test_log_stream_failing_partway_still_deletes_pod(app, storage, backend, tmp_path, monkeypatch):
+    api = _BrokenLogStreamApi(log_bytes=1024)
+    monkeypatch.setattr(k8s_client, "_V1_INSTANCE", api)
+    spool = ArtifactSpool(path=str(tmp_path), max_bytes=1024 * 1024, workers=1, max_attempts=1, max_pause=1,
+                          scan_interval=60)
+    monkeypatch.setattr(env_info, "ARTIFACT_OFFLOAD", True)
+    monkeypatch.setattr(artifact_spool, "_SPOOL", spool)
+    updates_before = backend.requests.get("PUT update-session-status", 0)
+
+    base_response = BaseResponse()
+    delete_session(pod_name="chrome-broken-log", session_id="broken-log", delete_type="completed",
+                   base_response=base_response)
+
+    assert base_response.msg == SESSION_DELETED_SUCCESSFULLY
+    assert "chrome-broken-log" in api.deleted
+    assert backend.requests["PUT update-session-status"] == updates_before + 1
+    # The partial spool entry is gone and the logs went to storage directly.
+    assert [name for name in os.listdir(tmp_path) if name != "failed"] == []
+    assert storage.objects["bench/broken-log.log"] == api.log_data
+
+
+def _journal_statuses(journal):
+    return dict(journal._execute("SELECT job_id, status FROM teardown_jobs").fetchall())
+
+
+def test_coalesced_teardowns_finish_their_journal_entries(app, k8s, storage, journal, monkeypatch):
+    monkeypatch.setattr(delete_session_module, "_TEARDOWN_FLIGHTS", SingleFlight(group="teardown", ttl=60))
+    k8s.fault = Fault(latency=0.2)
+    for job_id in ("leader", "follower", "cached"):
+        journal.begin(pod_name="chrome-coalesced", namespace="test", session_id="coalesced",
+                      delete_type="completed", job_id=job_id)
+
+    def teardown(job_id):
+        with app.app_context():
+            delete_session(pod_name="chrome-coalesced", session_id="coalesced", delete_type="completed",
+                           base_response=BaseResponse(), journal_job_id=job_id)
+
+    leader = threading.Thread(target=teardown, args=("leader",))
+    leader.start()
+    time.sleep(0.1)
+    teardown("follower")
+    leader.join()
+    teardown("cached")
+
+    assert k8s.calls["delete_namespaced_pod"] == 1
+    assert _journal_statuses(journal) == {"leader": STATUS_COMPLETED, "follower": STATUS_COMPLETED,
+                                          "cached": STATUS_COMPLETED}
+
+
+def test_namespace_outside_served_ones_is_refused(app, k8s, storage, monkeypatch):
+    # Only the default namespace is served when NAMESPACES is unset.
+    monkeypatch.setattr(env_info, "NAMESPACES", ())
+    with pytest.raises(Exception, match="not served"):
+        delete_session(pod_name="chrome-other-namespace", namespace="kube-system", session_id="other-namespace",
+                       delete_type="completed", base_response=BaseResponse())
+
+    assert k8s.calls.get("delete_namespaced_pod") is None
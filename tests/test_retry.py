@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import time
+
+from helpers.circuit_breaker import CircuitOpenError
+from helpers.retry import Deadline, RetryPolicy, deadline_scope, retry_tally
+
+
+class _Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+def _responses(*status_codes):
+    calls = []
+
+    def send(**kwargs):
+        calls.append(kwargs)
+        return _Response(status_codes[min(len(calls), len(status_codes)) - 1])
+
+    return send, calls
+
+
+def test_retries_until_success(app):
+    send, calls = _responses(503, 503, 200)
+    with retry_tally() as tally:
+        response = RetryPolicy(max_attempts=5, base_delay=0.01, jitter=False).call(send, url="http://backend")
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert tally.count == 2
+
+
+def test_non_retryable_status_is_not_retried(app):
+    send, calls = _responses(404)
+
+    assert RetryPolicy(max_attempts=5, base_delay=0.01).call(send) is None
+    assert len(calls) == 1
+
+
+def test_gives_up_when_the_next_pause_would_pass_the_deadline(app):
+    send, calls = _responses(503)
+    policy = RetryPolicy(max_attempts=10, base_delay=0.1, multiplier=2, jitter=False)
+
+    start = time.monotonic()
+    assert policy.call(send, deadline=Deadline(0.5)) is None
+
+    # Pauses of 0.1 and 0.2 fit in the budget, the third (0.4) would not.
+    assert len(calls) == 3
+    assert time.monotonic() - start < 0.5
+
+
+def test_first_attempt_is_made_past_the_deadline(app):
+    send, calls = _responses(503)
+    with deadline_scope(0):
+        assert RetryPolicy(max_attempts=5, base_delay=0.01).call(send) is None
+
+    assert len(calls) == 1
+
+
+def test_inner_deadline_scope_cannot_extend_the_outer_one():
+    with deadline_scope(1) as outer:
+        with deadline_scope(60) as inner:
+            assert inner is outer
+
+
+def test_open_circuit_is_not_retried(app):
+    calls = []
+
+    def unavailable(**kwargs):
+        calls.append(kwargs)
+        raise CircuitOpenError("backend", "Circuit for `backend` is open")
+
+    assert RetryPolicy(max_attempts=5, base_delay=0.01).call(unavailable) is None
+    assert len(calls) == 1
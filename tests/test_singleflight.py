@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from helpers.singleflight import ROLE_CACHED, ROLE_FOLLOWER, ROLE_LEADER, SingleFlight
+
+
+def test_concurrent_duplicates_follow_the_leader_and_late_ones_get_the_cached_result():
+    flight = SingleFlight(group="test", ttl=60)
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    roles = []
+    leader = threading.Thread(target=lambda: roles.append(flight.do("key", work)))
+    leader.start()
+    time.sleep(0.05)
+    follower = flight.do("key", work)
+    leader.join()
+
+    assert roles == [("done", ROLE_LEADER)]
+    assert follower == ("done", ROLE_FOLLOWER)
+    assert flight.do("key", work) == ("done", ROLE_CACHED)
+    assert len(calls) == 1
+
+
+def test_followers_get_the_leader_error_and_failures_are_not_cached():
+    flight = SingleFlight(group="test", ttl=60)
+    started = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("boom")
+
+    def lead():
+        try:
+            flight.do("key", fail)
+        except RuntimeError as err:
+            errors.append(err)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait()
+    with pytest.raises(RuntimeError, match="boom"):
+        flight.do("key", fail)
+    leader.join()
+
+    assert len(errors) == 1
+    assert flight.do("key", lambda: "retried") == ("retried", ROLE_LEADER)
+
+
+def test_zero_ttl_disables_the_cache():
+    flight = SingleFlight(group="test", ttl=0)
+
+    assert flight.do("key", lambda: 1) == (1, ROLE_LEADER)
+    assert flight.do("key", lambda: 2) == (2, ROLE_LEADER)
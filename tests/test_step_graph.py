@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from helpers.step_graph import Step, StepGraph
+
+
+@pytest.fixture
+def executor():
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def test_steps_receive_the_results_of_their_dependencies(app, executor):
+    graph = StepGraph([
+        Step("fetch", lambda results: 2),
+        Step("double", lambda results: results["fetch"] * 2, depends_on=("fetch",)),
+        Step("square", lambda results: results["fetch"] ** 2, depends_on=("fetch",)),
+        Step("sum", lambda results: results["double"] + results["square"], depends_on=("double", "square")),
+    ], executor)
+
+    assert graph.run()["sum"] == 8
+    assert graph.critical_path()[0] == "fetch"
+    assert graph.critical_path()[-1] == "sum"
+
+
+def test_failed_step_stops_its_dependents_and_running_steps_finish(app, executor):
+    sibling_started = threading.Event()
+    started = []
+    done = []
+
+    def fail(results):
+        sibling_started.wait()
+        raise RuntimeError("fetch failed")
+
+    def sibling(results):
+        sibling_started.set()
+        return "sibling"
+
+    graph = StepGraph([
+        Step("fetch", fail),
+        Step("sibling", sibling),
+        Step("dependent", lambda results: started.append("dependent"), depends_on=("fetch",)),
+    ], executor, on_step_done=done.append)
+
+    with pytest.raises(RuntimeError, match="fetch failed"):
+        graph.run()
+
+    assert graph.failed_step == "fetch"
+    assert started == []
+    assert done == ["sibling"]
+    assert graph.results == {"sibling": "sibling"}
+
+
+def test_skipped_steps_count_as_finished(app, executor):
+    ran = []
+    graph = StepGraph([
+        Step("stop_recording", lambda results: ran.append("stop_recording")),
+        Step("delete_pod", lambda results: ran.append("delete_pod"), depends_on=("stop_recording",)),
+    ], executor, skip=("stop_recording",))
+
+    graph.run()
+
+    assert ran == ["delete_pod"]
+
+
+def test_unknown_dependency_is_rejected(executor):
+    with pytest.raises(ValueError, match="unknown steps"):
+        StepGraph([Step("delete_pod", lambda results: None, depends_on=("missing",))], executor)
+
+
+def test_cyclic_dependencies_are_reported(app, executor):
+    graph = StepGraph([
+        Step("a", lambda results: None, depends_on=("b",)),
+        Step("b", lambda results: None, depends_on=("a",)),
+    ], executor)
+
+    with pytest.raises(ValueError, match="cyclic"):
+        graph.run()
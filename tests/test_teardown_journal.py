@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import time
+
+from methods.delete_session import delete_session
+from methods.teardown_journal import STATUS_COMPLETED, STATUS_RUNNING, TeardownJournal, _resume
+
+
+def _crashed_owner(journal: TeardownJournal) -> TeardownJournal:
+    """
+        Second owner of the same journal file whose heartbeat stopped long ago.
+    """
+    other = TeardownJournal(path=journal.path, heartbeat_interval=journal.heartbeat_interval, retention=3600)
+    other._execute("UPDATE journal_owners SET heartbeat_at = ? WHERE owner = ?", (time.time() - 60, other.owner))
+    return other
+
+
+def _status(journal: TeardownJournal, job_id: str) -> str:
+    return journal._execute("SELECT status FROM teardown_jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+
+def test_running_jobs_of_a_dead_owner_are_claimed_once(journal):
+    other = _crashed_owner(journal)
+    job_id = other.begin(pod_name="chrome-orphan", namespace="test", session_id="orphan", delete_type="completed")
+    other.record_step(job_id, "stop_recording")
+    finished = other.begin(pod_name="chrome-finished", namespace="test")
+    other.finish(finished, STATUS_COMPLETED)
+
+    claimed = journal.claim_orphaned()
+
+    assert [(job["job_id"], job["steps"]) for job in claimed] == [(job_id, ["stop_recording"])]
+    assert journal.claim_orphaned() == []
+
+
+def test_jobs_of_a_live_owner_are_not_claimed(journal):
+    other = TeardownJournal(path=journal.path, heartbeat_interval=journal.heartbeat_interval, retention=3600)
+    other.begin(pod_name="chrome-busy", namespace="test")
+
+    assert journal.claim_orphaned() == []
+
+
+def test_resume_skips_completed_steps(app, k8s, storage, journal):
+    other = _crashed_owner(journal)
+    job_id = other.begin(pod_name="chrome-resumed", namespace="test", session_id="resumed", delete_type="completed")
+    other.record_step(job_id, "stop_recording")
+    other.record_step(job_id, "ship_logs")
+
+    [job] = journal.claim_orphaned()
+    _resume(journal, job, delete_session)
+
+    assert "chrome-resumed" in k8s.deleted
+    assert k8s.calls.get("read_namespaced_pod_log") is None
+    assert _status(journal, job_id) == STATUS_COMPLETED
+
+
+def test_resume_of_a_fully_done_job_only_finishes_it(app, journal):
+    other = _crashed_owner(journal)
+    job_id = other.begin(pod_name="chrome-done", namespace="test")
+    for step in ("stop_recording", "ship_logs", "update_status", "delete_pod"):
+        other.record_step(job_id, step)
+    calls = []
+
+    [job] = journal.claim_orphaned()
+    assert _status(journal, job_id) == STATUS_RUNNING
+    _resume(journal, job, lambda **kwargs: calls.append(kwargs))
+
+    assert calls == []
+    assert _status(journal, job_id) == STATUS_COMPLETED